@@ -8,7 +8,7 @@ import six
 from six.moves import cStringIO as StringIO
 import zipfile
 
-from .relib import Backend, BackendFileNotFound, register
+from .relib import Backend, BackendFileNotFound, TableStore, register
 
 log = logging.getLogger(__name__)
 
@@ -17,10 +17,21 @@ log = logging.getLogger(__name__)
 class S3Backend(Backend):
     """
     S3 backend for TableStore.
+
+    Files are cached along with their ETag and only downloaded again if the ETag has changed,
+    so loading a table store that hasn't changed since the last load costs a request per file
+    but no transfer. A table store loaded in full is cached as well, see load_table_store().
+
+    Backends created from a url are kept per url, so the caches are shared by everything that
+    loads from the same url in this process. See create_from_url_parts().
     """
 
     __scheme__ = 's3'
     default_format = 'pickle'
+    json_profile = 'compact'
+    fetch_workers = 10  # The client is thread safe and keeps up to 10 connections by default.
+    save_workers = 10
+    _instances = {}  # Key is a tuple of bucket, folder and region names, value is a backend.
 
     def __init__(self, bucket_name, folder_name, region_name=None, etag=None):
         import boto3
@@ -28,15 +39,24 @@ class S3Backend(Backend):
         self.bucket_name = bucket_name
         self.folder_name = folder_name.lstrip('/')  # Strip leading slashes
         self.region_name = region_name
-        self.etag = etag
+        self.etag = etag  # ETag of the table store pickle as of the last load.
+        self._etag_cache = {}  # Key is key name, value is a tuple of ETag and data.
+        self._store_cache = None  # Tuple of 'tables' argument, ETags and table store.
 
     @classmethod
     def create_from_url_parts(cls, parts, query):
+        """Return the backend for the url, creating it the first time the url is used."""
         if 'region' in query:
             region_name = query['region'][0]
         else:
             region_name = None
-        return cls(bucket_name=parts.hostname, folder_name=parts.path, region_name=region_name)
+        key = (parts.hostname, parts.path.lstrip('/'), region_name)
+        backend = cls._instances.get(key)
+        if backend is None:
+            backend = cls._instances.setdefault(
+                key, cls(bucket_name=parts.hostname, folder_name=parts.path, region_name=region_name)
+            )
+        return backend
 
     def get_url(self):
         url = 's3://{}/{}'.format(self.bucket_name, self.folder_name)
@@ -50,7 +70,52 @@ class S3Backend(Backend):
     def get_key_name(self, file_name):
         return '{}/{}'.format(self.folder_name, file_name)
 
+    def load_table_store(self, lazy=False, tables=None, fetch_rows=False):
+        """
+        Same as Backend.load_table_store(), except the last table store loaded in full is
+        returned from cache if the ETags of the pickle, or the definition and meta data for
+        json, are unchanged. Each call returns a clone of the cached table store, which is
+        loaded in full even if 'lazy' or 'fetch_rows' is set.
+
+        Pickles are always loaded in full, so they are cached even if 'lazy' or 'fetch_rows'
+        is set. Json tables loaded lazily and row files fetched on demand are not, but their
+        files are only downloaded if their ETags have changed.
+        """
+        if self._store_cache is not None:
+            cached_tables, etags, ts = self._store_cache
+            if cached_tables == tables and self._get_store_etags(fetch=True) == etags:
+                log.debug("%s not modified. Using cached table store.", self)
+                return ts.clone()
+
+        ts = super(S3Backend, self).load_table_store(lazy=lazy, tables=tables, fetch_rows=fetch_rows)
+        if not (lazy or fetch_rows) or ts._source[1] == 'pickle':
+            self._store_cache = (tables, self._get_store_etags(fetch=False), ts.clone())
+        return ts
+
+    def _get_store_etags(self, fetch):
+        """
+        Return the ETags of the files that change whenever the table store is saved. If 'fetch'
+        is False, the ETags are taken from cache.
+        """
+        file_names = [self.pickle_filename, TableStore.TS_DEF_FILENAME, TableStore.TS_META_TABLENAME + '.json']
+        etags = []
+        for file_name in file_names:
+            try:
+                if fetch:
+                    etag, data = self._get_object(file_name)
+                else:
+                    etag, data = self._etag_cache.get(self.get_key_name(file_name), (None, None))
+            except BackendFileNotFound:
+                etag, data = None, None
+            etags.append(etag)
+            if file_name == self.pickle_filename:
+                self.etag = etag
+                if data:
+                    break  # Pickles and snapshots are a single file.
+        return etags
+
     def save_data(self, file_name, data):
+        self._etag_cache.pop(self.get_key_name(file_name), None)
         return self._save_data_with_bucket_logic(file_name, data, try_create_bucket=True)
 
     def _save_data_with_bucket_logic(self, file_name, data, try_create_bucket):
@@ -76,19 +141,43 @@ class S3Backend(Backend):
                 raise
 
     def load_data(self, file_name):
+        return self._get_object(file_name)[1]
+
+    def _get_object(self, file_name):
+        """
+        Return a tuple of ETag and data for 'file_name'. If the file is in cache, it's only
+        downloaded if its ETag has changed.
+        """
         from botocore.client import ClientError
         key_name = self.get_key_name(file_name)
         s3_url = "s3://%s/%s" % (self.bucket_name, key_name)
+        cached = self._etag_cache.get(key_name)
         log.debug("Downloading %s", s3_url)
-        f = six.BytesIO()
         try:
-            self.s3_client.download_fileobj(self.bucket_name, key_name, f)
+            if cached:
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key_name, IfNoneMatch=cached[0])
+            else:
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key_name)
         except ClientError as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if cached and status == 304:
+                log.debug("Not modified %s", s3_url)
+                return cached
             log.error("Error downloading %s", s3_url)
-            if '404' in str(e):
+            if status == 404 or '404' in str(e) or 'NoSuchKey' in str(e):
+                self._etag_cache.pop(key_name, None)
                 raise BackendFileNotFound
             raise
-        return f.getvalue()
+
+        etag, data = response['ETag'], response['Body'].read()
+        self._etag_cache[key_name] = (etag, data)
+        return etag, data
+
+    def delete_data(self, file_name):
+        key_name = self.get_key_name(file_name)
+        self._etag_cache.pop(key_name, None)
+        log.debug("Deleting s3://%s/%s", self.bucket_name, key_name)
+        self.s3_client.delete_object(Bucket=self.bucket_name, Key=key_name)
 
 
 @register
@@ -96,6 +185,7 @@ class RedisBackend(Backend):
 
     __scheme__ = 'redis'
     default_format = 'pickle'
+    json_profile = 'compact'
     is_cache = True
 
     def __init__(self, host=None, port=None, db=None, prefix=None, expire_sec=None):
@@ -105,6 +195,8 @@ class RedisBackend(Backend):
         db = db or 0
         self.prefix = prefix or ''
         self.expire_sec = expire_sec
+        # Skipping unchanged keys would let them expire.
+        self.delta_saves = expire_sec is None
 
         self.conn = redis.StrictRedis(
             host=host,
@@ -159,6 +251,32 @@ class RedisBackend(Backend):
             raise BackendFileNotFound
         return data
 
+    def delete_data(self, file_name):
+        key_name = self.get_key_name(file_name)
+        log.debug("Deleting from Redis:%s", key_name)
+        self.conn.delete(key_name)
+
+    def load_many(self, file_names, decode=None):
+        # Fetch all the keys in a single round trip.
+        key_names = [self.get_key_name(file_name) for file_name in file_names]
+        log.debug("Reading %s keys from Redis", len(key_names))
+        values = self.conn.mget(key_names) if key_names else []
+        for key_name, data in zip(key_names, values):
+            if data is None:
+                log.warning("Redis cache doesn't have '{}'. (Is it expired?)".format(key_name))
+                raise BackendFileNotFound
+        if decode is not None:
+            values = [decode(file_name, data) for file_name, data in zip(file_names, values)]
+        return values
+
+    def save_many(self, items):
+        # Pipeline all the keys in a single round trip.
+        log.debug("Adding %s keys to Redis with expiry:%s", len(items), self.expire_sec)
+        pipe = self.conn.pipeline(transaction=False)
+        for file_name, data in items:
+            pipe.set(self.get_key_name(file_name), data, ex=self.expire_sec)
+        pipe.execute()
+
     def get_url(self):
         return "redis://{}:{}/{}?prefix={}".format(self.host, self.port, self.db, self.prefix)
 
@@ -223,11 +341,18 @@ class FileBackend(Backend):
         with open(path_name, 'rb') as f:
             return f.read()
 
+    def delete_data(self, file_name):
+        path_name = self.get_filename(file_name)
+        if os.path.exists(path_name):
+            log.debug("Deleting %s", path_name)
+            os.remove(path_name)
+
 
 @register
 class MemoryBackend(Backend):
 
     __scheme__ = 'memory'
+    json_profile = 'compact'
     archive = {}
 
     def __init__(self, folder_name):
@@ -256,9 +381,14 @@ class MemoryBackend(Backend):
             raise BackendFileNotFound
         return MemoryBackend.archive[self.folder_name][file_name]
 
+    def delete_data(self, file_name):
+        MemoryBackend.archive[self.folder_name].pop(file_name, None)
+
 
 class ZipEncoded(Backend):
     """Aggregate class which serializes to and from a single zip file."""
+    delta_saves = False  # The zip file is written from scratch.
+
     def __init__(self, aggregate):
         self.aggregate = aggregate
 
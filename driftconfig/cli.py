@@ -24,7 +24,7 @@ try:
 except ImportError:
     got_pygments = False
 
-from driftconfig.relib import create_backend, get_store_from_url, diff_meta, diff_tables, CHECK_INTEGRITY, copy_table_store
+from driftconfig.relib import create_backend, get_store_from_url, diff_meta, diff_tables, integrity, copy_table_store
 from driftconfig.config import get_drift_table_store, get_redis_cache_backend, push_to_origin, pull_from_origin, TSTransaction, TSLocal
 from driftconfig.config import update_cache
 from driftconfig.backends import FileBackend
@@ -170,6 +170,10 @@ def get_options(parser):
         '-p', '--pickle',
         action='store_true', help="Use pickle format for destination."
     )
+    p.add_argument(
+        '-s', '--snapshot',
+        action='store_true', help="Use snapshot format for destination."
+    )
 
     # 'diff' command
     p = subparsers.add_parser(
@@ -324,13 +328,12 @@ def get_options(parser):
 
 def init_command(args):
     echo("Initializing config from {}".format(args.source))
-    if args.ignore_errors:
-        del CHECK_INTEGRITY[:]
-    ts = create_backend(args.source).load_table_store()
-    domain_name = ts.get_table('domain')['domain_name']
-    echo("Config domain name: {}".format(domain_name))
-    local_store = create_backend('file://' + config_dir(domain_name, user_dir=args.user_dir))
-    local_store.save_table_store(ts)
+    with integrity(False if args.ignore_errors else None):
+        ts = create_backend(args.source).load_table_store()
+        domain_name = ts.get_table('domain')['domain_name']
+        echo("Config domain name: {}".format(domain_name))
+        local_store = create_backend('file://' + config_dir(domain_name, user_dir=args.user_dir))
+        local_store.save_table_store(ts)
     echo("Config stored at: {}".format(local_store))
 
 
@@ -389,6 +392,8 @@ def _pull_command(args):
                 local_backend.save_table_store(result['table_store'])
 
             echo("Config for {} pulled. Reason: {}".format(domain_name, result['reason']))
+            if 'tables_fetched' in result:
+                echo("Tables fetched: {}".format(", ".join(result['tables_fetched']) or "none"))
 
 
 def cache_command(args):
@@ -485,6 +490,9 @@ def push_command(args):
             echo("Time diff " + result['time_diff'])
     else:
         echo("Config pushed. Reason: " + result['reason'])
+        if 'stats' in result:
+            echo("Files saved: {files_saved} ({bytes_saved} bytes), skipped: {files_skipped} ({bytes_skipped} bytes), "
+                 "deleted: {files_deleted}. Tables skipped: {tables_skipped}.".format(**result['stats']))
         local_store = create_backend('file://' + domain_info['path'])
         local_store.save_table_store(ts)
 
@@ -496,7 +504,12 @@ def copy_command(args):
     else:
         ts = get_store_from_url(args.source_url)
     b = create_backend(args.dest_url)
-    b.default_format = 'pickle' if args.pickle else 'json'
+    if args.pickle:
+        b.default_format = 'pickle'
+    elif args.snapshot:
+        b.default_format = 'snapshot'
+    else:
+        b.default_format = 'json'
     b.save_table_store(ts)
     echo("Done.")
 
@@ -1287,7 +1300,7 @@ def developer(recreate, shared, run):
     )
 
     # Define an alias for the developer tenant so it less cumbersome than the actual name.
-    result['tenant_master_row']['alias'] = tenant_name
+    ts.get_table('tenant-names').update(dict(result['tenant_master_row'], alias=tenant_name))
     tenant_name = result['tenant_master_row']['tenant_name']  # The actual tenant name
 
     # Provision all resources for the tenant for all deployables
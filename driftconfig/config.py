@@ -969,7 +969,8 @@ def push_to_origin(local_ts, force=False, _first=False, _origin_crc=None):
     If origin has changed since last pull, the push is cancelled and the
     return value contains 'reason' = 'checksum_differ'.
 
-    To force a push to a modified origin, set 'force' = True.
+    To force a push to a modified origin, set 'force' = True. A forced push saves all
+    tables in full.
 
     If 'skip_cache' is true, the cache, if defined for the table store, will
     not be updated.
@@ -978,6 +979,9 @@ def push_to_origin(local_ts, force=False, _first=False, _origin_crc=None):
     store is pushed.
 
     '_origin_crc' is the original and expected origin crc.
+
+    Only tables and row files that differ from origin are uploaded. The return value
+    of a push contains 'stats' with the number of files and bytes saved and skipped.
     """
     origin = local_ts.get_table('domain')['origin']
     origin_backend = create_backend(origin)
@@ -987,7 +991,8 @@ def push_to_origin(local_ts, force=False, _first=False, _origin_crc=None):
         crc_match = force = True
     else:
         try:
-            origin_ts = origin_backend.load_table_store()
+            # Tables are only loaded if they need to be compared to local.
+            origin_ts = origin_backend.load_table_store(lazy=True)
         except Exception as e:
             log.warning("Can't load table store from %s: %s", origin_backend, repr(e))
             crc_match = force = True
@@ -1015,29 +1020,42 @@ def push_to_origin(local_ts, force=False, _first=False, _origin_crc=None):
         return {'pushed': True, 'reason': 'push_skipped_crc_match'}
 
     # Always turn on all integrity check when saving to origin
-    tmp = driftconfig.relib.CHECK_INTEGRITY
-    driftconfig.relib.CHECK_INTEGRITY = ['pk', 'fk', 'unique', 'schema', 'constraints']
-    try:
-        origin_backend.save_table_store(local_ts)
-    finally:
-        driftconfig.relib.CHECK_INTEGRITY = tmp
+    with driftconfig.relib.integrity(True):
+        stats = origin_backend.save_table_store(local_ts, base=None if force else origin_ts)
 
-    return {'pushed': True, 'reason': 'pushed_to_origin'}
+    return {'pushed': True, 'reason': 'pushed_to_origin', 'stats': stats}
 
 
 def pull_from_origin(local_ts, ignore_if_modified=False, force=False):
+    """
+    Pull table store from origin of 'local_ts'.
+    Returns a dict with 'pulled' as True or False depending on success.
+
+    Only the meta data is fetched from origin up front. Tables that are the same in
+    origin and 'local_ts' are reused from 'local_ts' and the rest is fetched from origin.
+    The return value of a pull contains 'tables_fetched' with the names of those tables.
+    """
     origin = local_ts.get_table('domain')['origin']
-    origin_ts = create_backend(origin).load_table_store()
+    origin_ts = create_backend(origin).load_table_store(lazy=True)
+    local_crc = local_ts.meta['checksum']
     old, new = local_ts.refresh_metadata()
 
     if old != new and not ignore_if_modified:
         return {'pulled': False, 'reason': 'local_is_modified'}
 
-    crc_match = local_ts.meta['checksum'] == origin_ts.meta['checksum']
+    # Refreshing the meta data upgrades checksums calculated by older versions. If the local
+    # store is unmodified, the checksum it was loaded with matches an origin saved by them.
+    crc_match = origin_ts.meta['checksum'] in (local_ts.meta['checksum'], local_crc if old == new else None)
     if crc_match and not force:
         return {'pulled': True, 'table_store': local_ts, 'reason': 'pull_skipped_crc_match'}
 
-    return {'pulled': True, 'table_store': origin_ts, 'reason': 'pulled_from_origin'}
+    origin_ts.reuse_tables(local_ts)
+    tables_fetched = [
+        table_name for table_name, table in origin_ts._tables.items() if table._pending_load is not None
+    ]
+    origin_ts._load_pending()
+
+    return {'pulled': True, 'table_store': origin_ts, 'reason': 'pulled_from_origin', 'tables_fetched': tables_fetched}
 
 
 def get_redis_cache_backend(ts, tier_name):
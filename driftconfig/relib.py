@@ -14,24 +14,357 @@ try:
 except ImportError:
     ujson = json
 import re
+import bisect
 import collections
+import concurrent.futures
+import contextlib
 import copy
+import functools
+import operator
+import threading
+import weakref
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
 from six.moves.urllib.parse import urlparse, parse_qs
 import hashlib
+import binascii
+import struct
 from datetime import datetime
 
 import six
 import six.moves.cPickle as pickle
+from six.moves._thread import get_ident
+from jsonschema import ValidationError
 
 
-from .schemautil import check_schema
+from .schemautil import check_schema, get_validator
 
 log = logging.getLogger(__name__)
 
 
-# Global integrity check switches.
-# TODO: Add unit tests to check proper functionality of these flags.
-CHECK_INTEGRITY = ['pk', 'fk', 'unique', 'schema', 'constraints']
+# Global integrity check switches. These are the process wide defaults. Use integrity() to
+# change them for the current thread or context only.
+INTEGRITY_CHECKS = ['pk', 'fk', 'unique', 'schema', 'constraints']
+CHECK_INTEGRITY = INTEGRITY_CHECKS[:]
+
+# Json serialization profiles for table data. Checksums are always calculated from the
+# compact form, which is canonical, so they don't depend on the profile used.
+JSON_PROFILES = {
+    'pretty': {'indent': 4, 'sort_keys': True},  # Human readable and diff friendly.
+    'compact': {'separators': (',', ':'), 'sort_keys': True},
+}
+
+# Table store snapshot file format. The file starts with a fixed size header containing the
+# magic, format version and location of the table of contents. The toc is a compact Json doc
+# pointing out the definition and the row data of each table, all of which are Json as well.
+# The row data is an array of row key and row pairs.
+SNAPSHOT_MAGIC = b'RELIBSNP'
+SNAPSHOT_VERSION = 2
+_SNAPSHOT_HEADER = struct.Struct('>8sHQQ')  # magic, version, toc offset, toc length.
+
+if contextvars:
+    _integrity_var = contextvars.ContextVar('relib_integrity', default=None)
+else:
+    class _ThreadLocalVar(threading.local):
+        """Minimal stand-in for ContextVar on Python versions without contextvars."""
+        value = None
+
+        def get(self):
+            return self.value
+
+        def set(self, value):
+            token, self.value = self.value, value
+            return token
+
+        def reset(self, token):
+            self.value = token
+
+    _integrity_var = _ThreadLocalVar()
+
+
+def get_integrity_checks():
+    """Return the integrity checks in effect for the current thread or context."""
+    checks = _integrity_var.get()
+    return CHECK_INTEGRITY if checks is None else checks
+
+
+@contextlib.contextmanager
+def integrity(default=None, **switches):
+    """
+    Context manager to turn integrity checks on or off for the current thread or context
+    only. Other threads are not affected.
+
+    'default' turns all checks on if True or off if False. The individual switches are
+    'pk', 'fk', 'unique', 'schema' and 'constraints'. Example:
+
+        with relib.integrity(pk=False, unique=False):
+            table.add(row)
+    """
+    unknown = set(switches) - set(INTEGRITY_CHECKS)
+    if unknown:
+        raise RelibError("Unknown integrity check(s): {}".format(", ".join(sorted(unknown))))
+
+    current = get_integrity_checks()
+    checks = []
+    for check in INTEGRITY_CHECKS:
+        enabled = check in current if default is None else default
+        if switches.get(check, enabled):
+            checks.append(check)
+
+    token = _integrity_var.set(checks)
+    try:
+        yield checks
+    finally:
+        _integrity_var.reset(token)
+
+
+class ReadWriteLock(object):
+    """
+    A reentrant reader-writer lock. Any number of threads can hold the read lock at the same
+    time, but the write lock is exclusive. Waiting writers block new readers.
+
+    A thread holding the write lock can acquire the read lock as well, but a thread holding
+    only the read lock can not upgrade it to a write lock.
+
+    Readers don't take the internal lock unless a writer holds or waits for the write lock.
+    Each reader only touches its own entry in '_readers', and checks for writers again after
+    adding it, while writers check for readers after announcing themselves. A writer stays
+    counted in '_writers_waiting' until '_writer' is set, and readers check the two in the
+    opposite order, so there is no moment where a reader sees neither.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # Key is thread id, value is recursion count.
+        self._writer = None  # Thread id of the writer.
+        self._write_count = 0
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        me = get_ident()
+        readers = self._readers
+        count = readers.get(me)
+        if count:
+            readers[me] = count + 1
+            return
+        if self._writer == me:
+            self._write_count += 1
+            return
+        if not self._writers_waiting and self._writer is None:
+            readers[me] = 1
+            if not self._writers_waiting and self._writer is None:
+                return
+            # A writer got in first. Back off and wait for it.
+            self._release_last_read(me)
+
+        with self._cond:
+            while self._writer is not None or self._writers_waiting:
+                self._cond.wait()
+            readers[me] = 1
+
+    def release_read(self):
+        me = get_ident()
+        readers = self._readers
+        count = readers.get(me)
+        if count is None and self._writer == me:
+            self.release_write()
+        elif count > 1:
+            readers[me] = count - 1
+        else:
+            self._release_last_read(me)
+
+    def _release_last_read(self, me):
+        del self._readers[me]
+        if self._writers_waiting:
+            with self._cond:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        me = get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._write_count += 1
+                return
+            if me in self._readers:
+                raise RelibError("Can't upgrade a read lock to a write lock.")
+            self._writers_waiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writer = me
+                self._write_count = 1
+            finally:
+                self._writers_waiting -= 1
+
+    def release_write(self):
+        with self._cond:
+            self._release_write()
+
+    def _release_write(self):
+        self._write_count -= 1
+        if not self._write_count:
+            self._writer = None
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def read_locked(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def write_locked(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+@contextlib.contextmanager
+def _not_locked():
+    yield
+
+
+def _read_locked(method):
+    """
+    Run 'method' holding the read lock of the table store if it has locking enabled.
+    If the table shares rows with a clone, the rows are unshared first. If the table was
+    loaded lazily, the rows are loaded first.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._pending_load is not None:
+            self._load_pending()
+        if self._cow_shared:
+            self._unshare()
+        lock = self._get_rwlock()
+        if lock is None:
+            return method(self, *args, **kwargs)
+        lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+    return wrapper
+
+
+def _row_fetching(method):
+    """
+    Same as _read_locked, except that a table loaded with 'fetch_rows' is not loaded in full
+    up front. It's up to 'method' to fetch the rows it needs, see Table._fetch_row_group().
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._pending_load is not None and self._row_fetch is None:
+            self._load_pending()
+        if self._cow_shared:
+            self._unshare()
+        lock = self._get_rwlock()
+        if lock is None:
+            return method(self, *args, **kwargs)
+        lock.acquire_read()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_read()
+    return wrapper
+
+
+def _write_locked(method):
+    """
+    Run 'method' holding the write lock of the table store if it has locking enabled.
+    Raises TableError if the table or table store is frozen. If the table shares rows with a
+    clone, the rows are unshared first. If the table was loaded lazily, the rows are loaded
+    first, in full if they were fetched on demand.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._frozen:
+            raise TableError("Can't call {}() on frozen {}.".format(method.__name__, self.__class__.__name__))
+        if self._pending_load is not None:
+            self._load_pending()
+        if self._cow_shared:
+            self._unshare()
+        lock = self._get_rwlock()
+        if lock is None:
+            return method(self, *args, **kwargs)
+        lock.acquire_write()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            lock.release_write()
+    return wrapper
+
+
+class FrozenDict(dict):
+    """A read-only dict. Use copy.deepcopy() or dict() to get a modifiable copy."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{} is read-only.".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return {k: copy.deepcopy(v, memo) for k, v in self.items()}
+
+    def __copy__(self):
+        return dict(self)
+
+
+class FrozenList(list):
+    """A read-only list. Use copy.deepcopy() or list() to get a modifiable copy."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("{} is read-only.".format(self.__class__.__name__))
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = remove = pop = sort = reverse = _readonly
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(v, memo) for v in self]
+
+    def __copy__(self):
+        return list(self)
+
+
+def _copy_value(value):
+    """Return a modifiable copy of 'value' where dicts and lists are copied recursively."""
+    if isinstance(value, dict):
+        return {k: _copy_value(v) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    return value
+
+
+# Guards the sharing of rows between tables and their clones. See TableStore.clone().
+_cow_lock = threading.Lock()
+
+# Guards moving rows between index buckets by readers. See Table._verify_indexes().
+_index_lock = threading.Lock()
+
+# Guards the cached row hashes and Merkle tree nodes, which are updated by readers. See
+# Table.get_checksum().
+_checksum_lock = threading.RLock()
+
+
+def _freeze_value(value):
+    """Return a read-only copy of 'value' where dicts and lists are frozen recursively."""
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze_value(v)) for k, v in value.items())
+    elif isinstance(value, list):
+        return FrozenList(_freeze_value(v) for v in value)
+    return value
 
 
 class RelibError(RuntimeError):
@@ -46,6 +379,14 @@ class ConstraintError(TableError):
     pass
 
 
+class IntegrityError(ConstraintError):
+    """One or more integrity violations found in a bulk operation. 'errors' is a list of the violations."""
+    def __init__(self, errors):
+        self.errors = errors
+        super(IntegrityError, self).__init__("{} integrity violation(s):\n{}".format(
+            len(errors), "\n".join(str(e) for e in errors)))
+
+
 class BackendError(RelibError):
     pass
 
@@ -59,6 +400,44 @@ class Table(object):
     TABLENAME_REGEX = re.compile(r"^([a-z\d.-]){1,50}$")
     PK_FIELDNAME_REGEX = re.compile(r"^([\w\d.-]){1,50}$")
 
+    # Properties derived from the table definition and rows. They are neither part of the
+    # table definition nor pickled, but rebuilt when needed.
+    _transient_attributes = (
+        '_index_maps', '_reindex_keys', '_pk_canonicalizer', '_group_by_canonicalizer', '_valid_key_values', '_schema_validator',
+        '_cow_shared', '_cow_source', '_cow_clones',
+        '_row_hashes', '_dirty_keys', '_handed_out_keys', '_merkle_leaves', '_merkle_nodes', '_checksum', '_change_count',
+        '_pending_load', '_loading', '_row_fetch', '_row_groups', '_row_cache', '_row_fetches',
+    )
+
+    # Max number of validated primary key values cached per table.
+    VALID_KEY_CACHE_SIZE = 10000
+
+    # Max number of row files kept by a table loaded with 'fetch_rows'. See _fetch_row_group().
+    ROW_CACHE_SIZE = 1000
+
+    # Max number of rows in a leaf node of the Merkle tree. See get_checksum().
+    MERKLE_LEAF_SIZE = 16
+
+    _frozen = False  # See TableStore.freeze().
+
+    # Copy-on-write state, see TableStore.clone(). A clone shares the rows and indexes of its
+    # source table until either of them is accessed. The source keeps the row objects and
+    # the clone gets a copy.
+    _cow_shared = False  # True while rows are shared with a source or a clone.
+    _cow_source = None  # The table this clone shares rows with.
+    _cow_clones = None  # Clones sharing rows with this table.
+
+    # Lazy loading state, see Backend.load_table_store(). The rows of a table loaded lazily
+    # are fetched and inserted when the table is first accessed.
+    _pending_load = None  # Tuple of load function and the integrity checks to apply.
+    _loading = False  # True while the pending load is in progress.
+
+    # On-demand row fetching state, see _start_row_fetch().
+    _row_fetch = None  # Function to fetch row files with.
+    _row_groups = None  # Key is group key, value is a primary key in the group.
+    _row_cache = None  # Key is group key, value is a list of rows. Most recently used last.
+    _row_fetches = None  # Key is group key, value is a Future for the row file being fetched.
+
     def __init__(self, table_name, table_store=None, from_def=None):
 
         # Table name must be nicely formatted so we can use it in path names.
@@ -76,6 +455,13 @@ class Table(object):
         self._group_by_fields = None
         self._subfolder = None
         self._is_system_table = False
+        self._indexes = []  # List of field name lists, one for each secondary index.
+        self._sequences = {}  # Last value issued for each @@identity field.
+        self._index_maps = {}  # Key is a tuple of field names, value is the hash index.
+        self._reindex_keys = set()  # Keys of rows handed out since the indexes were verified.
+        self._valid_key_values = set()  # Primary key values known to match PK_FIELDNAME_REGEX.
+        self._schema_validator = None  # Compiled from '_schema' on first use.
+        self._reset_checksum()
 
         if from_def:
             self.__dict__.update(from_def['dict'])
@@ -83,6 +469,28 @@ class Table(object):
             if '_table_store' in from_def['dict']:
                 self._table_store = table_store
                 log.warning("Fixing _table_store property due to legacy definition file.")
+            self._rebuild_indexes()
+
+        self._build_canonicalizers()
+
+    def __getstate__(self):
+        if self._pending_load is not None:
+            self._load_pending()
+        state = self.__dict__.copy()
+        for attr in self._transient_attributes:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        # Pickles made by older versions may lack some of the properties.
+        state.setdefault('_indexes', [])
+        state.setdefault('_sequences', {})
+        self.__dict__.update(state)
+        self._valid_key_values = set()
+        self._schema_validator = None
+        self._reset_checksum()
+        self._rebuild_indexes()
+        self._build_canonicalizers()
 
     def __str__(self):
         return "Table('{}')".format(self._table_name)
@@ -91,6 +499,116 @@ class Table(object):
     def name(self):
         return self._table_name
 
+    def _get_rwlock(self):
+        ts = self._table_store
+        if ts is None or ts._loading_thread == get_ident():
+            return None  # The thread loading a lazy table holds the read lock already.
+        return ts._rwlock
+
+    def _load_pending(self, errors=None):
+        """
+        Fetch and insert the rows of a table that was loaded lazily. The rows are checked using
+        the integrity checks that were in effect when the table store was loaded. See
+        add_many() for 'errors'.
+        """
+        ts = self._table_store
+        table_errors = []
+        with ts.read_locked(), ts._load_lock:
+            if self._pending_load is None or self._loading:
+                return
+            load, checks = self._pending_load
+            # Rows fetched on demand are not part of the table, so they are simply dropped.
+            self._row_fetch = self._row_groups = self._row_cache = self._row_fetches = None
+            loading_thread, ts._loading_thread = ts._loading_thread, get_ident()
+            self._loading = True
+            try:
+                log.debug("Lazy load %s", self)
+                with integrity(False, **{check: True for check in checks}):
+                    load(table_errors)
+                    self._seed_sequences_from_meta()
+            finally:
+                self._loading = False
+                ts._loading_thread = loading_thread
+            self._pending_load = None
+
+        if table_errors:
+            if errors is None:
+                raise IntegrityError(table_errors)
+            errors.extend(table_errors)
+
+    def _clone(self, table_store):
+        """Return a copy of this table belonging to 'table_store' which shares the rows."""
+        state = self.__getstate__()
+        for attr in ('_rows', '_table_store', '_frozen'):
+            state.pop(attr, None)
+
+        table = self.__class__.__new__(self.__class__)
+        table.__dict__.update(copy.deepcopy(state))
+        table._table_store = table_store
+        table._rows = self._rows
+        table._index_maps = self._index_maps
+        table._reindex_keys = set()
+        table._valid_key_values = set()
+        table._schema_validator = self._schema_validator
+        table._build_canonicalizers()
+
+        # The row hashes are shared along with the rows.
+        table._row_hashes = self._row_hashes
+        table._dirty_keys = set(self._dirty_keys)
+        table._handed_out_keys = set(self._handed_out_keys)
+        table._merkle_leaves = self._merkle_leaves
+        table._merkle_nodes = self._merkle_nodes
+        table._checksum = self._checksum
+        table._change_count = 0
+
+        # Clones of clones share the row objects of the original source.
+        with _cow_lock:
+            source = self._cow_source or self
+            if source._cow_clones is None:
+                source._cow_clones = weakref.WeakSet()
+            source._cow_clones.add(table)
+            source._cow_shared = True
+            table._cow_source = source
+            table._cow_shared = True
+
+        return table
+
+    def _unshare(self):
+        """Stop sharing rows with the source table or clones of this table."""
+        with _cow_lock:
+            if self._cow_source is not None:
+                self._cow_source._cow_clones.discard(self)
+                self._copy_shared_rows()
+            if self._cow_clones:
+                for clone in list(self._cow_clones):
+                    clone._copy_shared_rows()
+                self._cow_clones.clear()
+            self._cow_shared = False
+
+    def _copy_shared_rows(self):
+        self._rows = {row_key: _copy_value(row) for row_key, row in self._rows.items()}
+        if self._row_hashes is not None:
+            self._row_hashes = dict(self._row_hashes)
+            self._merkle_leaves = list(self._merkle_leaves)
+            self._merkle_nodes = dict(self._merkle_nodes)
+        self._rebuild_indexes()
+        self._cow_source = None
+        self._cow_shared = False
+
+    def _freeze(self, table_store):
+        """Return a frozen copy of this table belonging to 'table_store'."""
+        state = self.__getstate__()
+        rows = state.pop('_rows')
+        del state['_table_store']
+        state = copy.deepcopy(state)
+        state['_rows'] = {row_key: _freeze_value(rows[row_key]) for row_key in sorted(rows)}
+        state['_table_store'] = table_store
+        state['_frozen'] = True
+
+        table = self.__class__.__new__(self.__class__)
+        table.__setstate__(state)  # Builds fresh indexes.
+        return table
+
     def _canonicalize_key(self, primary_key, use_group_by=False):
         """
         Return a canonical representation of the primary key 'primary_key' using the
@@ -107,32 +625,95 @@ class Table(object):
         Special case: If the primary key is a number, the canonicalized version is the
         number itself. This guarantees proper ordering when writing out json.
         """
-        fields = self._group_by_fields if use_group_by else self._pk_fields
-
-        if not set(fields).issubset(set(primary_key.keys())):
-            raise TableError("For table '{}', can't make primary key. Need {} but got {}.".format(
-                self._table_name, fields, primary_key.keys()))
+        if use_group_by:
+            return self._group_by_canonicalizer(primary_key)
+        return self._pk_canonicalizer(primary_key)
 
-        if len(fields) == 1 and isinstance(primary_key[fields[0]], (six.integer_types, float)):
-            canonicalized = primary_key[fields[0]]
-        else:
-            for k in fields:
-                if k in primary_key and not self.PK_FIELDNAME_REGEX.match(str(primary_key[k])):
+    def _build_canonicalizers(self):
+        """
+        Build functions specialized for canonicalizing primary keys and row group keys of
+        this table. See _canonicalize_key() for details.
+        """
+        self._pk_canonicalizer = self._make_canonicalizer(self._pk_fields)
+        self._group_by_canonicalizer = self._make_canonicalizer(self._group_by_fields)
+
+    def _make_canonicalizer(self, fields):
+        if fields is None:
+            def canonicalize(primary_key):
+                raise TableError("In table '{}', rows are not grouped. Call set_row_as_file() first.".format(
+                    self._table_name))
+            return canonicalize
+
+        fields = tuple(fields)
+        match = self.PK_FIELDNAME_REGEX.match
+        valid_values = self._valid_key_values
+        cache_size = self.VALID_KEY_CACHE_SIZE
+
+        def get_values(primary_key):
+            try:
+                return [primary_key[k] for k in fields]
+            except KeyError:
+                raise TableError("For table '{}', can't make primary key. Need {} but got {}.".format(
+                    self._table_name, list(fields), primary_key.keys()))
+
+        def validate(value):
+            value = str(value)
+            if value not in valid_values:
+                if not match(value):
                     raise ConstraintError("Primary key value {!r} didn't match pattern '{}' in table '{}'.".format(
-                        primary_key[k], self.PK_FIELDNAME_REGEX.pattern, self.name))
-            canonicalized = '.'.join([str(primary_key[k]) for k in fields if k in primary_key])
+                        value, self.PK_FIELDNAME_REGEX.pattern, self.name))
+                if len(valid_values) >= cache_size:
+                    valid_values.clear()
+                valid_values.add(value)
+            return value
+
+        if len(fields) == 1:
+            field = fields[0]
+
+            def canonicalize(primary_key):
+                try:
+                    value = primary_key[field]
+                except KeyError:
+                    get_values(primary_key)  # Raises TableError.
+                if value.__class__ is str and value in valid_values:
+                    return value
+                if isinstance(value, (six.integer_types, float)):
+                    return value
+                return validate(value)
+        elif fields:
+            get_fields = operator.itemgetter(*fields)
+            keys = {}  # Canonical keys by the string values they're made of.
+
+            def canonicalize(primary_key):
+                try:
+                    values = get_fields(primary_key)
+                except KeyError:
+                    get_values(primary_key)  # Raises TableError.
+                try:
+                    return keys[values]
+                except (KeyError, TypeError):
+                    pass
+                key = '.'.join([validate(value) for value in values])
+                if all(value.__class__ is str for value in values):
+                    if len(keys) >= cache_size:
+                        keys.clear()
+                    keys[values] = key
+                return key
+        else:
+            def canonicalize(primary_key):
+                return ''
 
-        return canonicalized
+        return canonicalize
 
-    def _check_row(self, row):
+    def _check_row(self, row, checks):
         # Make sure 'row' contains primary key and unique key fields and does not violate any
         # constraints thereof.
         # For convenience, the function returns the canonicalized primary key for the row.
-        check_pk = 'pk' in CHECK_INTEGRITY
-        check_fk = 'fk' in CHECK_INTEGRITY
-        check_unique = 'unique' in CHECK_INTEGRITY
-        check_schema_ = 'schema' in CHECK_INTEGRITY
-        check_constraints = 'constraints' in CHECK_INTEGRITY
+        check_pk = 'pk' in checks
+        check_fk = 'fk' in checks
+        check_unique = 'unique' in checks
+        check_schema_ = 'schema' in checks
+        check_constraints = 'constraints' in checks
 
         if check_constraints:
             for c in self._constraints:
@@ -141,7 +722,7 @@ class Table(object):
 
                 # Do unique check but allow for "null" values or omitted field.
                 if c['type'] == 'unique' and check_unique and set(c['fields']).issubset(row):
-                    # Check for duplicates
+                    # Check for duplicates. This is a hash index lookup on the constraint fields.
                     search_criteria = {k: row[k] for k in c['fields']}
                     found = self.find(search_criteria)
                     if len(found):
@@ -151,12 +732,11 @@ class Table(object):
                     if set(c['foreign_key_fields']).issubset(row):
                         foreign_row = self.get_foreign_row(None, c['table'], c['foreign_key_fields'], _row=row)
                         if foreign_row is None:
-                            raise ConstraintError("In table '{}', foreign key record in '{}' not found {}.\nRow data:\n{}".format(
-                                self.name, c['table'], {k: row[k] for k in c['foreign_key_fields']}, json.dumps(row, indent=4)))
+                            raise self._foreign_key_error(c, row)
 
         # Check Json schema format compliance
-        if check_schema_:
-            check_schema(row, self._schema, "Adding row to {}".format(self))
+        if check_schema_ and self._schema:
+            check_schema(row, self._schema, "Adding row to {}".format(self), validator=self._get_schema_validator())
 
         # Check primary key violation
         row_key = self._canonicalize_key(row)
@@ -165,27 +745,445 @@ class Table(object):
 
         return row_key
 
+    def _foreign_key_error(self, c, row):
+        return ConstraintError("In table '{}', foreign key record in '{}' not found {}.\nRow data:\n{}".format(
+            self.name, c['table'], {k: row[k] for k in c['foreign_key_fields']}, json.dumps(row, indent=4)))
+
+    def _get_schema_validator(self):
+        if self._schema_validator is None:
+            self._schema_validator = get_validator(self._schema)
+        return self._schema_validator
+
+    def _check_rows(self, items, checks):
+        """
+        Run unique, foreign key and schema checks on rows that have already been inserted.
+        'items' is a list of (row key, row) tuples and 'checks' the integrity checks to run.
+        The checks are done in a single pass per constraint. Returns a list of violations.
+        """
+        check_fk = 'fk' in checks
+        check_unique = 'unique' in checks
+        check_schema_ = 'schema' in checks
+        check_constraints = 'constraints' in checks
+        errors = []
+
+        self._verify_indexes()
+        for c in self._constraints if check_constraints else []:
+            if c['type'] == 'unique' and check_unique:
+                # Any index bucket containing more than one row is a violation.
+                index = self._index_maps[tuple(c['fields'])]
+                reported = set()
+                for row_key, row in items:
+                    value = _index_value(c['fields'], row)
+                    if value is None or value in reported or len(index.get(value, ())) < 2:
+                        continue
+                    reported.add(value)
+                    search_criteria = dict(zip(c['fields'], value))
+                    errors.append(ConstraintError("Unique constraint violation on {} because of {}.".format(
+                        search_criteria, list(index[value].values()))))
+            elif c['type'] == 'foreign_key' and check_fk:
+                # Look up each distinct foreign key value only once.
+                found = {}
+                for row_key, row in items:
+                    if not set(c['foreign_key_fields']).issubset(row):
+                        continue
+                    value = _index_value(c['foreign_key_fields'], row)
+                    if value is None or value not in found:
+                        foreign_row = self.get_foreign_row(None, c['table'], c['foreign_key_fields'], _row=row)
+                        if value is not None:
+                            found[value] = foreign_row is not None
+                        if foreign_row is None:
+                            errors.append(self._foreign_key_error(c, row))
+                    elif not found[value]:
+                        errors.append(self._foreign_key_error(c, row))
+
+        if check_schema_ and self._schema:
+            validator = self._get_schema_validator()
+            for row_key, row in items:
+                try:
+                    check_schema(row, self._schema, "Adding row to {}".format(self), validator=validator)
+                except ValidationError as e:
+                    errors.append(e)
+
+        return errors
+
+    def _index_fields(self):
+        """
+        Return a dict of all hash indexes maintained for this table. The key is a tuple of
+        sorted field names and the value is the index type.
+        """
+        # Unique constraints are enforced using a hash index on the constraint fields, and
+        # foreign keys are indexed to quickly find rows referencing a foreign row. Partial
+        # primary keys are indexed by prefix, as are the row grouping fields.
+        fields = [(c['fields'], 'unique') for c in self._constraints if c['type'] == 'unique']
+        fields += [(self._pk_fields[:i], 'primary_key_prefix') for i in range(1, len(self._pk_fields))]
+        if self._group_by_fields and self._group_by_fields != self._pk_fields:
+            fields += [(self._group_by_fields[:i], 'group_by_prefix') for i in range(1, len(self._group_by_fields) + 1)]
+        fields += [(c['foreign_key_fields'], 'foreign_key') for c in self._constraints if c['type'] == 'foreign_key']
+        fields += [(f, 'secondary') for f in self._indexes]
+
+        index_fields = collections.OrderedDict()
+        for f, index_type in fields:
+            index_fields.setdefault(tuple(sorted(f)), index_type)
+        return index_fields
+
+    def _rebuild_indexes(self):
+        """Rebuild all hash indexes from scratch."""
+        index_maps = {fields: {} for fields in self._index_fields()}
+        for fields, index in index_maps.items():
+            for row_key, row in self._rows.items():
+                value = _index_value(fields, row)
+                if value is not None:
+                    index.setdefault(value, {})[row_key] = row
+        self._index_maps = index_maps
+        self._reindex_keys = set()
+
+    def _hand_out(self, row_keys):
+        """
+        Note that the rows at 'row_keys' are handed out by reference, as they may be modified
+        in-place. See _verify_indexes() and get_checksum().
+        """
+        if self._frozen:
+            return
+        row_keys = list(row_keys)
+        if self._index_maps:
+            self._reindex_keys.update(row_keys)
+        if self._row_hashes is not None:
+            self._handed_out_keys.update(row_keys)
+
+    def _verify_indexes(self):
+        """
+        Make sure the rows handed out since the last call are in the right index buckets, in
+        case their indexed fields were modified in-place. Rows modified in-place after that
+        must be touched. See touch().
+        """
+        if not self._reindex_keys:
+            return
+        row_keys, self._reindex_keys = self._reindex_keys, set()
+        for row_key in list(row_keys):
+            row = self._rows.get(row_key)
+            if row is not None and not self._is_indexed(row_key, row):
+                self._reindex_row(row_key, row)
+
+    def _is_indexed(self, row_key, row):
+        for fields, index in self._index_maps.items():
+            value = _index_value(fields, row)
+            if value is not None and index.get(value, {}).get(row_key) is not row:
+                return False
+        return True
+
+    def _reindex_row(self, row_key, row):
+        """
+        Move 'row' to the index buckets matching its current field values. This may be done
+        while holding only the read lock, so buckets are replaced rather than modified.
+        """
+        with _index_lock:
+            for fields, index in self._index_maps.items():
+                value = _index_value(fields, row)
+                if value is not None and index.get(value, {}).get(row_key) is row:
+                    continue
+                # The indexed fields were modified in-place. Find the old bucket the hard way.
+                for old_value, bucket in list(index.items()):
+                    if bucket.get(row_key) is row:
+                        bucket = dict(bucket)
+                        del bucket[row_key]
+                        if bucket:
+                            index[old_value] = bucket
+                        else:
+                            del index[old_value]
+                if value is not None:
+                    bucket = dict(index.get(value, {}))
+                    bucket[row_key] = row
+                    index[value] = bucket
+
+    def _index_row(self, row_key, row):
+        for fields, index in self._index_maps.items():
+            value = _index_value(fields, row)
+            if value is not None:
+                index.setdefault(value, {})[row_key] = row
+
+    def _unindex_row(self, row_key, row):
+        for fields, index in self._index_maps.items():
+            value = _index_value(fields, row)
+            if value is None:
+                continue
+            bucket = index.get(value)
+            if bucket is None or row_key not in bucket:
+                # The indexed fields were modified in-place. Find the row the hard way.
+                value = next((v for v, b in index.items() if b.get(row_key) is row), None)
+                if value is None:
+                    continue
+                bucket = index[value]
+            del bucket[row_key]
+            if not bucket:
+                del index[value]
+
+    def _clear_rows(self):
+        self._rows.clear()
+        for index in self._index_maps.values():
+            index.clear()
+        self._reset_checksum()
+        self._change_count += 1
+
+    def _reset_checksum(self):
+        """Forget all row hashes. The checksum is calculated from scratch the next time."""
+        self._row_hashes = None  # Key is row key, value is a tuple of key hash and row digest.
+        self._dirty_keys = set()  # Keys of rows which need to be hashed again.
+        self._handed_out_keys = set()  # Keys of rows handed out since they were hashed.
+        self._merkle_leaves = None  # Sorted list of key hash and row key tuples.
+        self._merkle_nodes = None  # Key is key hash prefix, value is digest of the node.
+        self._checksum = None
+        self._change_count = getattr(self, '_change_count', 0)
+
+    def _mark_dirty(self, row_keys):
+        """
+        Mark rows as modified. Their hashes are calculated again by get_checksum(). This is done
+        for rows that are added, removed or touched.
+        """
+        if self._row_hashes is not None:
+            self._dirty_keys.update(row_keys)
+
+    @property
+    def change_count(self):
+        """Number of times rows have been added, updated, removed or touched."""
+        return self._change_count
+
+    @_read_locked
+    def touch(self, row=None):
+        """
+        Mark 'row' as modified. Use this when a row is modified in-place after the checksum of
+        the table was calculated, or after a later lookup in the table. If 'row' is not set,
+        all rows are marked as modified.
+
+        This only takes the read lock, so the checksum state is reset holding the checksum lock
+        in case get_checksum() is running in another thread.
+        """
+        with _checksum_lock:
+            if row is None:
+                self._reset_checksum()
+                self._rebuild_indexes()
+            else:
+                row_key = self._canonicalize_key(row)
+                self._mark_dirty([row_key])
+                if row_key in self._rows:
+                    self._reindex_row(row_key, self._rows[row_key])
+            self._change_count += 1
+
+    @_read_locked
+    def get_checksum(self):
+        """
+        Return sha256 checksum of the table data, which is the root of a Merkle tree over the
+        rows.
+
+        Rows are placed in the tree by the hex digest of their row key. A node for a given
+        prefix of the hex digest contains all the rows whose key hash starts with that prefix.
+        A node with MERKLE_LEAF_SIZE rows or fewer is a leaf and its digest is calculated from
+        the key hashes and row hashes. Other nodes have 16 children, one for each hex digit
+        following the prefix.
+
+        The row hashes and node digests are cached. Only rows that were added, removed or
+        touched since the last call are hashed again, along with the nodes above them. Rows
+        handed out by get() and find() are hashed again as they may have been modified in-place,
+        but the nodes above them are only recalculated if their hash changed.
+        """
+        with _checksum_lock:
+            if self._row_hashes is None:
+                self._row_hashes = {row_key: (_hash_key(row_key), _hash_row(row)) for row_key, row in self._rows.items()}
+                self._merkle_leaves = sorted((v[0], row_key) for row_key, v in self._row_hashes.items())
+                self._merkle_nodes = {}
+                self._dirty_keys = set()
+                self._handed_out_keys = set()
+            else:
+                dirty = self._dirty_keys | self._handed_out_keys
+                self._dirty_keys, self._handed_out_keys = set(), set()
+                changed = [row_key for row_key in dirty if self._rehash_row(row_key)]
+                if not changed and self._checksum is not None:
+                    return self._checksum
+
+            self._checksum = binascii.hexlify(self._merkle_node('', 0, len(self._merkle_leaves))).decode("ascii")
+            return self._checksum
+
+    def _rehash_row(self, row_key):
+        """
+        Update the hash of the row at 'row_key' and invalidate the Merkle nodes above it.
+        Returns True if the hash changed.
+        """
+        row = self._rows.get(row_key)
+        old = self._row_hashes.get(row_key)
+        if row is not None:
+            key_hash = old[0] if old else _hash_key(row_key)
+            digest = _hash_row(row)
+            if old and old[1] == digest:
+                return False
+            self._row_hashes[row_key] = key_hash, digest
+            if not old:
+                bisect.insort(self._merkle_leaves, (key_hash, row_key))
+        elif old:
+            key_hash = old[0]
+            del self._row_hashes[row_key]
+            del self._merkle_leaves[bisect.bisect_left(self._merkle_leaves, (key_hash, row_key))]
+        else:
+            return False
+
+        nodes = self._merkle_nodes
+        for i in range(len(key_hash) + 1):
+            nodes.pop(key_hash[:i], None)
+        return True
+
+    def _merkle_range(self, prefix, lo, hi):
+        """Return the range in the leaf list of rows whose key hash starts with 'prefix'."""
+        leaves = self._merkle_leaves
+        lo = bisect.bisect_left(leaves, (prefix,), lo, hi)
+        return lo, bisect.bisect_left(leaves, (prefix + 'g',), lo, hi)  # 'g' follows the hex digits.
+
+    def _merkle_node(self, prefix, lo, hi):
+        """Return digest of the Merkle tree node for 'prefix' spanning 'lo' to 'hi' in the leaf list."""
+        digest = self._merkle_nodes.get(prefix)
+        if digest is None:
+            checksum = hashlib.sha256()
+            if hi - lo <= self.MERKLE_LEAF_SIZE:
+                for key_hash, row_key in self._merkle_leaves[lo:hi]:
+                    checksum.update(key_hash.encode("ascii"))
+                    checksum.update(self._row_hashes[row_key][1])
+            else:
+                for c in '0123456789abcdef':
+                    child_lo, child_hi = self._merkle_range(prefix + c, lo, hi)
+                    if child_hi > child_lo:
+                        checksum.update(self._merkle_node(prefix + c, child_lo, child_hi))
+                    else:
+                        checksum.update(b'-')
+                    lo = child_hi
+            digest = self._merkle_nodes[prefix] = checksum.digest()
+        return digest
+
+    def _merkle_diff(self, other, prefix='', ranges=None):
+        """
+        Generate row keys of rows that differ between this table and 'other' by descending
+        into the Merkle tree nodes that differ. get_checksum() must be called on both tables
+        first.
+        """
+        lo1, hi1, lo2, hi2 = ranges or (0, len(self._merkle_leaves), 0, len(other._merkle_leaves))
+        if self._merkle_node(prefix, lo1, hi1) == other._merkle_node(prefix, lo2, hi2):
+            return
+
+        if hi1 - lo1 <= self.MERKLE_LEAF_SIZE or hi2 - lo2 <= other.MERKLE_LEAF_SIZE:
+            # Compare the rows directly.
+            rows1 = {row_key: self._row_hashes[row_key][1] for key_hash, row_key in self._merkle_leaves[lo1:hi1]}
+            rows2 = {row_key: other._row_hashes[row_key][1] for key_hash, row_key in other._merkle_leaves[lo2:hi2]}
+            for row_key in set(rows1) | set(rows2):
+                if rows1.get(row_key) != rows2.get(row_key):
+                    yield row_key
+            return
+
+        for c in '0123456789abcdef':
+            lo1, child_hi1 = self._merkle_range(prefix + c, lo1, hi1)
+            lo2, child_hi2 = other._merkle_range(prefix + c, lo2, hi2)
+            for row_key in self._merkle_diff(other, prefix + c, (lo1, child_hi1, lo2, child_hi2)):
+                yield row_key
+            lo1, lo2 = child_hi1, child_hi2
+
+    def _plan_query(self, search_criteria):
+        """
+        Pick the best access path for 'search_criteria'.
+
+        Returns a tuple of plan and candidates. The plan is a dict describing the access
+        path and the candidates is a dict of row key and row. The candidates must still be
+        matched against the criteria.
+
+        The access paths, in order of preference:
+            'primary_key': The criteria contains the full primary key.
+            'index': The criteria contains all the fields of one or more hash indexes. The
+                     index that yields the fewest candidates is picked.
+            'full_scan': No index applies, all rows are candidates.
+        """
+        if self._pk_fields and all(k in search_criteria for k in self._pk_fields):
+            try:
+                row_key = self._canonicalize_key(search_criteria)
+            except ConstraintError:
+                candidates = {}  # Not a valid key so no row can match it.
+            else:
+                row = self._rows.get(row_key)
+                candidates = {} if row is None else {row_key: row}
+            return {'access_path': 'primary_key', 'index_fields': sorted(self._pk_fields)}, candidates
+
+        self._verify_indexes()
+        best = None
+        for fields, index in self._index_maps.items():
+            if all(k in search_criteria for k in fields):
+                try:
+                    bucket = index.get(tuple(search_criteria[k] for k in fields)) or {}
+                except TypeError:
+                    continue  # Unhashable search value.
+                if best is None or len(bucket) < len(best[1]):
+                    best = fields, bucket
+
+        if best is None:
+            return {'access_path': 'full_scan'}, self._rows
+
+        fields, bucket = best
+        plan = {
+            'access_path': 'index',
+            'index_fields': list(fields),
+            'index_type': self._index_fields().get(fields),
+        }
+        return plan, bucket
+
+    @_read_locked
+    def explain(self, search_criteria=None):
+        """
+        Return the query plan find() uses for 'search_criteria'.
+        The plan is a dict with 'access_path' and 'rows_examined', and for index lookups
+        'index_fields' and 'index_type'. See _plan_query() for details.
+        """
+        if not search_criteria:
+            plan, candidates = {'access_path': 'full_scan'}, self._rows
+        else:
+            plan, candidates = self._plan_query(search_criteria)
+        plan['rows_examined'] = len(candidates)
+        return plan
+
+    def _find_items(self, search_criteria):
+        """Return a list of (row key, row) tuples for all rows matching 'search_criteria'."""
+        candidates = self._plan_query(search_criteria)[1]
+
+        items = []
+        for row_key, row in candidates.items():
+            for k, v in search_criteria.items():
+                if k not in row or row[k] != v:
+                    break
+            else:
+                items.append((row_key, row))
+
+        self._hand_out(row_key for row_key, row in items)
+        return items
+
+    @_row_fetching
     def find(self, search_criteria=None):
         """
         Find all rows matching 'search_criteria'.
         'search_criteria' is a dict with field=value pairs.
+
+        The primary key or a hash index is used to narrow down the search if possible.
+        Otherwise all rows are scanned. Use explain() to see which access path is used.
+
+        If the table was loaded with 'fetch_rows', only the matching row files are fetched if
+        'search_criteria' contains any of the group by fields. Otherwise the table is loaded in
+        full.
         """
+        if self._row_fetch is not None:
+            rows = self._fetch_row_groups(search_criteria) if search_criteria else None
+            if rows is not None:
+                return [row for row in rows if all(k in row and row[k] == v for k, v in search_criteria.items())]
+            self._load_pending()
+
         if search_criteria is None:
             # Special case, return all rows
+            self._hand_out(self._rows)
             return list(self._rows.values())
 
-        rows = []
-        search_criteria = search_criteria or {}
-        for row in self._rows.values():
-            for k, v in search_criteria.items():
-                if k not in row or row[k] != v:
-                    break
-            else:
-                rows.append(row)
+        return [row for row_key, row in self._find_items(search_criteria or {})]
 
-        return rows
-
-    def add(self, row, check_only=False):
+    @_write_locked
+    def add(self, row, check_only=False, checks=None):
         """
         Add a row to the table.
         'row' is a dict.
@@ -203,45 +1201,161 @@ class Table(object):
 
         If 'check_only' is True, then the row is only checked for validation but not
         added to the table.
+
+        'checks' is a list of integrity checks to run for this call. If not set, the checks
+        in effect for the current context are used. See integrity().
         """
+        if checks is None:
+            checks = get_integrity_checks()
+
         # Apply default values
-        target_row = self._get_default_values()
+        target_row = self._get_default_values(row)
         target_row.update(row)
         row = target_row
 
-        row_key = self._check_row(row)
+        self._verify_indexes()
+        row_key = self._check_row(row, checks)
         if not check_only:
+            old_row = self._rows.get(row_key)
+            if old_row is not None:
+                self._unindex_row(row_key, old_row)
             self._rows[row_key] = row
+            self._index_row(row_key, row)
+            self._advance_sequences(row)
+            self._mark_dirty([row_key])
+            self._hand_out([row_key])
+            self._change_count += 1
         return row
 
+    @_write_locked
+    def add_many(self, rows, defer_checks=True, errors=None, checks=None):
+        """
+        Add a list of rows to the table. Returns a list of the rows added.
+
+        If 'defer_checks' is True, all the rows are inserted first and then checked for
+        unique, foreign key and schema violations in a single pass. All violations are
+        reported together by raising IntegrityError, and the table is left unchanged.
+        If 'errors' is a list, the violations are appended to it instead, and the rows
+        are kept in the table.
+
+        If 'defer_checks' is False, this is the same as calling add() for each row.
+
+        See add() for 'checks'.
+        """
+        if checks is None:
+            checks = get_integrity_checks()
+
+        if not defer_checks:
+            return [self.add(row, checks=checks) for row in rows]
+
+        check_pk = 'pk' in checks
+        check_constraints = 'constraints' in checks
+        pk_constraint = {'type': 'primary_key', 'fields': sorted(self._pk_fields)}
+        self._verify_indexes()
+        violations = []
+        items = []
+        replaced = {}
+
+        for row in rows:
+            # Apply default values
+            target_row = self._get_default_values(row)
+            target_row.update(row)
+            row = target_row
+
+            if check_constraints and not set(self._pk_fields).issubset(row):
+                violations.append(ConstraintError("In table '{}', row violates constraint {}: {}".format(
+                    self._table_name, pk_constraint, row)))
+                continue
+            try:
+                row_key = self._canonicalize_key(row)
+            except TableError as e:
+                violations.append(e)
+                continue
+
+            old_row = self._rows.get(row_key)
+            if old_row is not None:
+                if check_pk:
+                    violations.append(ConstraintError("Primary key violation in table '{}': {}".format(
+                        self._table_name, row_key)))
+                    continue
+                replaced.setdefault(row_key, old_row)
+                self._unindex_row(row_key, old_row)
+            self._rows[row_key] = row
+            self._index_row(row_key, row)
+            self._advance_sequences(row)
+            items.append((row_key, row))
+
+        self._mark_dirty(row_key for row_key, row in items)
+        self._change_count += 1
+        violations += self._check_rows(items, checks)
+        if violations and errors is None:
+            # Roll back
+            for row_key, row in reversed(items):
+                if self._rows.get(row_key) is row:
+                    del self._rows[row_key]
+                    self._unindex_row(row_key, row)
+            for row_key, row in replaced.items():
+                self._rows[row_key] = row
+                self._index_row(row_key, row)
+            raise IntegrityError(violations)
+        elif violations:
+            errors.extend(violations)
+
+        self._hand_out(row_key for row_key, row in items)
+        return [row for row_key, row in items]
+
+    @_write_locked
     def update(self, row):
         """
         Same as add() but will update the row if it already exists.
         """
-        # Turn off primary key violation and unique contraint check temporarily
-        tmp = CHECK_INTEGRITY[:]
-        if 'pk' in CHECK_INTEGRITY:
-            CHECK_INTEGRITY.remove('pk')
-        if 'unique' in CHECK_INTEGRITY:
-            CHECK_INTEGRITY.remove('unique')
-        try:
-            return self.add(row)
-        finally:
-            CHECK_INTEGRITY[:] = tmp
+        # Skip primary key violation and unique contraint check
+        checks = [c for c in get_integrity_checks() if c not in ('pk', 'unique')]
+        return self.add(row, checks=checks)
 
     def get(self, primary_key):
         """
         Get the record pointed to by 'primary_key'.
         'primary_key' is a dict containing all the fields that make up the primary key.
         """
-        return self._rows.get(self._canonicalize_key(primary_key))
-
+        # Fast path for loaded tables that are not shared with a clone and not locked, which
+        # is a plain lookup of the canonical key. See _get() for the rest.
+        ts = self._table_store
+        if self._pending_load is None and not self._cow_shared and (ts is None or ts._rwlock is None):
+            row_key = self._pk_canonicalizer(primary_key)
+            row = self._rows.get(row_key)
+            if row is not None and not self._frozen:
+                if self._index_maps:
+                    self._reindex_keys.add(row_key)
+                if self._row_hashes is not None:
+                    self._handed_out_keys.add(row_key)
+            return row
+        return self._get(primary_key)
+
+    @_row_fetching
+    def _get(self, primary_key):
+        """Same as get() but holds the read lock and fetches rows on demand."""
+        row_key = self._canonicalize_key(primary_key)
+        if self._row_fetch is not None:
+            rows = self._fetch_row_group(primary_key)
+            if rows is not None:
+                return next((row for row in rows if self._canonicalize_key(row) == row_key), None)
+        self._hand_out([row_key])
+        return self._rows.get(row_key)
+
+    @_write_locked
     def remove(self, primary_key):
         """
         Remove row from table identified by 'primary_key'.
         """
-        del self._rows[self._canonicalize_key(primary_key)]
-
+        self._verify_indexes()
+        row_key = self._canonicalize_key(primary_key)
+        row = self._rows.pop(row_key)
+        self._unindex_row(row_key, row)
+        self._mark_dirty([row_key])
+        self._change_count += 1
+
+    @_write_locked
     def add_primary_key(self, primary_key_fields):
         """
         Add primary key constraint.
@@ -254,7 +1368,10 @@ class Table(object):
         c = {'type': 'primary_key', 'fields': sorted(self._pk_fields)}
         if c not in self._constraints:
             self._constraints.append(c)
+        self._build_canonicalizers()
+        self._rebuild_indexes()
 
+    @_write_locked
     def add_foreign_key(self, foreign_key_fields, table_name, alias_key_fields=None):
         """
         Add foreign key relationship.
@@ -291,7 +1408,9 @@ class Table(object):
                 self._table_name, alias_key_fields, table_name))
 
         self._constraints.append(c)
+        self._rebuild_indexes()
 
+    @_write_locked
     def add_unique_constraint(self, unique_key_fields):
         """
         Add a unique contraint to ensure no duplicate values in the fields specified.
@@ -301,11 +1420,32 @@ class Table(object):
         """
         c = {'type': 'unique', 'fields': sorted(unique_key_fields.split(','))}
         self._constraints.append(c)
+        self._rebuild_indexes()
+
+    @_write_locked
+    def add_index(self, index_fields):
+        """
+        Add a secondary hash index to speed up find().
+        'index_fields' is a comma separated list of field names that make up the index.
+
+        The index is used automatically by find() when the search criteria include all the
+        fields of the index. Just like primary key and unique constraint fields, indexed
+        fields should not be modified in-place after the row is added. Use update() instead.
+
+        Note, the order of the field names is not important.
+        """
+        fields = sorted(index_fields.split(','))
+        if fields not in self._indexes:
+            self._indexes.append(fields)
+            self._rebuild_indexes()
 
+    @_write_locked
     def add_schema(self, schema):
         """Add Json schema for row validation."""
         self._schema = schema
+        self._schema_validator = get_validator(schema)
 
+    @_write_locked
     def add_default_values(self, default_values):
         """
         Define default values for row data.
@@ -317,6 +1457,7 @@ class Table(object):
         """The table file or fileswill be placed in a subfolder called 'subfolder_name'."""
         self._subfolder = subfolder_name
 
+    @_write_locked
     def set_row_as_file(self, subfolder_name=None, group_by=None):
         """
         When serializing the table, group rows together into separate files.
@@ -344,6 +1485,8 @@ class Table(object):
             self._group_by_fields = self._pk_fields
 
         self._subfolder = subfolder_name
+        self._build_canonicalizers()
+        self._rebuild_indexes()
 
     def get_filename(self, row=None, is_index_file=None):
         """
@@ -381,6 +1524,7 @@ class Table(object):
 
         return file_name
 
+    @_row_fetching
     def get_foreign_row(self, primary_key, table_name, foreign_key_fields=None, _row=None):
         """
         Fetch foreign row from 'table_name' referenced by 'primary_key'.
@@ -405,76 +1549,172 @@ class Table(object):
         if self.name == table_name and set(search_criteria.items()).issubset(set(row.items())):
             pass  # Just use the row
         else:
-            # If it's on primary key, use it as it can be must faster than scanning the whole table.
-            if sorted(search_criteria.keys()) == sorted(foreign_table._pk_fields):
-                row = foreign_table.get(search_criteria)
+            # The foreign key is linked to a primary key or a unique constraint, so find() will
+            # do a primary key or an index lookup.
+            rows = foreign_table.find(search_criteria)
+            if rows:
+                row = rows[0]
             else:
-                rows = foreign_table.find(search_criteria)
-                if rows:
-                    row = rows[0]
-                else:
-                    row = None
+                row = None
 
         return row
 
-    def find_references(self, ref_row, _refs=None):
+    def _find_referencing_rows(self, ref_row):
         """
-        Return a dict of tables and rows that reference 'ref_row' either directly or indirectly.
-        {'table name': [row, ...]}
+        Generate a (table, row key, row) tuple for each row directly referencing 'ref_row'
+        through a foreign key. The lookup uses the foreign key index in each referencing table.
         """
-        refs = _refs or []
-
         for table in self._table_store.tables.values():
             for c in table._constraints:
                 if c['type'] == 'foreign_key' and c['table'] == self.name:
                     # 'table' and 'c' is referencing 'self'.
+                    if not set(c['alias_key_fields']).issubset(ref_row):
+                        continue
                     search_criteria = {k2: ref_row[k1] for k1, k2 in zip(c['alias_key_fields'], c['foreign_key_fields'])}
-                    for row in table.find(search_criteria):
-                        refs.append((table.name, row))
-                        if table.name != self.name:
-                            table.find_references(row, refs)
+                    if table._pending_load is not None:
+                        table._load_pending()
+                    if table._cow_shared:
+                        table._unshare()
+                    for row_key, row in table._find_items(search_criteria):
+                        yield table, row_key, row
+
+    @_read_locked
+    def find_references(self, ref_row, _refs=None, _visited=None):
+        """
+        Return a dict of tables and rows that reference 'ref_row' either directly or indirectly.
+        {'table name': [row, ...]}
+        """
+        refs = collections.OrderedDict() if _refs is None else _refs  # Key is (table name, row key).
+        visited = set() if _visited is None else _visited
+
+        for table, row_key, row in self._find_referencing_rows(ref_row):
+            key = (table.name, row_key)
+            refs[key] = row
+            if table.name != self.name and key not in visited:
+                visited.add(key)
+                table.find_references(row, refs, visited)
 
-        # Remove duplicates and formalize the result.
+        if _refs is not None:
+            return  # Recursive call, the result is formalized by the caller.
+
+        # Formalize the result.
         result = {}
-        for table_name, row in refs:
-            rows = result.setdefault(table_name, [])
-            if row not in rows:
-                rows.append(row)
+        for (table_name, row_key), row in refs.items():
+            result.setdefault(table_name, []).append(row)
 
         return result
 
-    def save(self, save_data):
-        cs = self._save_table_data(save_data)
+    @_read_locked
+    def can_remove(self, ref_row):
+        """
+        Return True if 'ref_row' can be removed without breaking foreign key references to it.
+        A row referencing only itself does not prevent removal.
+        """
+        for table, row_key, row in self._find_referencing_rows(ref_row):
+            if row is not ref_row:
+                return False
+        return True
+
+    @_write_locked
+    def save(self, save_data, json_profile='pretty'):
+        """
+        Save table data using 'save_data', a function accepting 'file_name' and 'data'. See
+        _save_table_data() for details. 'json_profile' is one of the keys in JSON_PROFILES.
+        """
+        self._save(lambda items: [save_data(file_name, data) for file_name, data in items], json_profile)
+
+    @_write_locked
+    def _save(self, save_many, json_profile='pretty'):
+        """Same as save() but saves all the files in one go using 'save_many'."""
+        self._save_table_data(save_many, json_profile)
+        self._update_metadata()
+
+    @_read_locked
+    def _get_files(self, json_profile='pretty'):
+        """Return table data as a dict of file name and data, as it would be saved by save()."""
+        files = collections.OrderedDict()
+        self._save_table_data(files.update, json_profile)
+        return files
+
+    def _update_metadata(self):
+        """Update checksum and sequences for this table in the table store meta data."""
         if not self._is_system_table:
+            cs = self.get_checksum()
             table_meta = self._table_store.get_table_metadata(self._table_name)
             if table_meta['md5'] != cs:
                 table_meta['md5'] = cs
                 table_meta['last_modified'] = datetime.utcnow().isoformat() + 'Z'
+            # Older versions calculated the checksum differently. See _load_lazily().
+            table_meta['checksum_type'] = 'merkle'
+            sequences = table_meta.get('sequences')
+            if self._sequences and self._sequences != sequences:
+                # The sequences are seeded from the rows on load, so meta data without them,
+                # like the one saved by older versions, only needs them once they're ahead.
+                seeded = {k: self._get_row_sequence(k) for k in self._sequences}
+                if sequences is not None or self._sequences != seeded:
+                    table_meta['sequences'] = dict(self._sequences)
+
+    def _get_legacy_checksum(self):
+        """
+        Return the checksum of the table data as older versions calculated it, which is the
+        sha256 of the table files in pretty Json format. See TableStore._upgrade_checksums().
+        """
+        checksum = hashlib.sha256()
+        for data in self._get_files('pretty').values():
+            checksum.update(data)
+        return checksum.hexdigest()
 
-    def load(self, fetch_from_storage):
-        return self._load_table_data(fetch_from_storage)
+    @_write_locked
+    def load(self, fetch_from_storage, errors=None, workers=1):
+        """
+        Load table data using 'fetch_from_storage', a function that accepts a file name and
+        returns the data pointed to by it. See _load_table_data() for details.
+        If 'errors' is a list, integrity violations are appended to it instead of raising
+        IntegrityError.
 
-    def _save_table_data(self, save_data):
+        If the rows are stored in separate files, 'workers' is the number of threads fetching
+        and decoding the files in parallel. See _fetch_many().
+        """
+        return self._load(functools.partial(_fetch_many, fetch_from_storage, workers=workers), errors)
+
+    @_write_locked
+    def _load(self, load_many, errors=None):
+        """Same as load() but fetches the files in batches using 'load_many'."""
+        ret = self._load_table_data(load_many, errors)
+        self._seed_sequences_from_meta()
+        return ret
+
+    def _seed_sequences_from_meta(self):
+        if not self._is_system_table and self._table_store:
+            # The sequences are seeded from the loaded rows, but may have advanced further
+            # if rows were deleted.
+            self._seed_sequences()
+            for table_meta in self._table_store.meta['tables']:
+                if table_meta['table_name'] == self._table_name:
+                    for k, v in table_meta.get('sequences', {}).items():
+                        self._sequences[k] = max(self._sequences.get(k, v), v)
+
+    def _save_table_data(self, save_many, json_profile='pretty'):
         """
         Save all table data.
 
-        'save_data' is a function accepting a 'file_name' and 'json' parameter where
+        'save_many' is a function accepting a list of 'file_name' and 'data' tuples where
         'file_name' is a globally unique identifier for the table data or row and can
-        be used when writing out the 'json' data to file, db, cloud storage or any other
-        device for safe keeping.
+        be used when writing out the json 'data' to file, db, cloud storage or any other
+        device for safe keeping. It's called once with all the files of the table.
+        See Backend.save_many().
+
+        'json_profile' is one of the keys in JSON_PROFILES.
         """
 
         # Save the rows sorted on primary key.
         rows = [self._rows[k] for k in sorted(self._rows)]
-
-        # Stub out the save_data() function so we can calculate a checksum.
-        checksum = hashlib.sha256()
+        json_args = JSON_PROFILES[json_profile]
+        files = []
 
         def save_data_check(filename, data):
-            # convert json to bytes and call the backend save function
-            raw_data = data.encode("ascii")
-            checksum.update(raw_data)
-            return save_data(filename, raw_data)
+            # convert json to bytes and queue it up for the backend save function
+            files.append((filename, data.encode("ascii")))
 
         if self._group_by_fields:
             row_per_file = self._group_by_fields == self._pk_fields
@@ -482,7 +1722,7 @@ class Table(object):
             if row_per_file:
                 for row in rows:
                     save_data_check(self.get_filename(row),
-                                    json.dumps(row, indent=4, sort_keys=True))
+                                    json.dumps(row, **json_args))
             else:
                 # Group one or more rows together for each file.
                 group = {}
@@ -492,81 +1732,299 @@ class Table(object):
 
                 for rowset in group.values():
                     save_data_check(self.get_filename(rowset[0]),
-                                    json.dumps(rowset, indent=4, sort_keys=True))
+                                    json.dumps(rowset, **json_args))
 
             # Add index so we can read it back in automatically
             index = [{k: row[k] for k in self._pk_fields} for row in rows]
             save_data_check(self.get_filename(is_index_file=True),
-                            json.dumps(index, indent=4, sort_keys=True))
+                            json.dumps(index, **json_args))
 
         else:
             # Write out all rows as a list
             rows = [row for row in rows]
             save_data_check(self.get_filename(),
-                            json.dumps(rows, indent=4, sort_keys=True))
+                            json.dumps(rows, **json_args))
 
-        cs = checksum.hexdigest()
-        return cs
+        save_many(files)
 
-    def _load_table_data(self, fetch_from_storage):
+    def _load_table_data(self, load_many, errors=None):
         """
         Load table data.
 
-        'fetch_from_storage' is an function that accepts 'file_name' as a single argument and
-        returns the data pointed to by 'file_name'.
+        'load_many' is a function like Backend.load_many() that accepts a list of file names
+        and returns a list of the data pointed to by each of them, decoded by a 'decode'
+        function. If the rows are stored in separate files, it's called once for the index and
+        once for all the row files.
+
+        All the rows are inserted using add_many() with deferred integrity checks. See
+        add_many() for 'errors'.
         """
         if not self._group_by_fields:
-            data = fetch_from_storage(self.get_filename()).decode("ascii")
-            rows = jsonloads(data, self.get_filename())
-            for row in rows:
-                self.add(row)
+            rows = _load_json(load_many, [self.get_filename()])[0]
         else:
             # Get index
             row_per_file = self._group_by_fields == self._pk_fields
-            index_file_name = self.get_filename(is_index_file=True)
-            index = fetch_from_storage(index_file_name).decode("ascii")
-            index = jsonloads(index, index_file_name)
+            index = _load_json(load_many, [self.get_filename(is_index_file=True)])[0]
 
+            rows = []
             if row_per_file:
-                for primary_key in index:
-                    file_name = self.get_filename(row=primary_key)
-                    data = fetch_from_storage(file_name).decode("ascii")
-                    row = jsonloads(data, file_name)
-                    self.add(row)
+                file_names = [self.get_filename(row=primary_key) for primary_key in index]
+                rows = _load_json(load_many, file_names)
             else:
                 # Group one or more rows together for each file.
-                key_groups = {}
+                key_groups = collections.OrderedDict()
                 for primary_key in index:
                     key = self._canonicalize_key(primary_key, use_group_by=True)
                     key_groups[key] = primary_key
 
-                for group_key in key_groups.values():
-                    file_name = self.get_filename(row=group_key)
-                    data = fetch_from_storage(file_name).decode("ascii")
-                    rows = jsonloads(data, file_name)
-                    for row in rows:
-                        self.add(row)
+                file_names = [self.get_filename(row=group_key) for group_key in key_groups.values()]
+                for group_rows in _load_json(load_many, file_names):
+                    rows += group_rows
+
+        self._hydrate(rows, errors)
+
+    def _load_lazily(self, load_many, errors=None):
+        """
+        Load table data using 'load_many' for a table that was loaded lazily. The files are
+        fetched some time after the meta data, so the checksum is compared to the one in the
+        meta data in case the table store was saved in between. If they don't match, the table
+        is loaded once more, and RelibError is raised if they still don't match.
+        """
+        md5 = None
+        for table_meta in self._table_store.meta['tables']:
+            if table_meta['table_name'] == self._table_name and table_meta.get('checksum_type') == 'merkle':
+                md5 = table_meta['md5']
+
+        for attempt in range(2):
+            table_errors = []
+            self._load_table_data(load_many, table_errors)
+            if not md5 or self.get_checksum() == md5:
+                break
+            log.warning("Checksum of %s doesn't match the meta data. Loading it again.", self)
+            self._clear_rows()
+        else:
+            raise RelibError("Table '{}' doesn't match the checksum in the table store meta data. It may have "
+                             "been saved after the table store was loaded.".format(self._table_name))
+
+        if table_errors:
+            if errors is None:
+                raise IntegrityError(table_errors)
+            errors.extend(table_errors)
+
+    def _hydrate(self, rows, errors=None):
+        """Insert loaded 'rows' into an empty table. See add_many() for 'errors'."""
+        self.add_many(rows, errors=errors)
+
+    def _start_row_fetch(self, load_many, checks):
+        """
+        Load only the index of a table that is serialized using set_row_as_file(). Row files
+        are then fetched on demand by get() and find(), while anything else loads the table
+        in full using 'load_many'.
+
+        The fetched rows are checked against the table schema if 'checks' include it. Unique
+        and foreign key checks need the whole table and are done when it's loaded in full.
+
+        The fetched rows are not part of the table, so they are frozen, and modifying the table
+        raises TableError until it's loaded in full.
+        """
+        index = _load_json(load_many, [self.get_filename(is_index_file=True)])[0]
+        self._row_groups = {self._canonicalize_key(primary_key, use_group_by=True): primary_key for primary_key in index}
+        self._row_cache = collections.OrderedDict()
+        self._row_fetches = {}
+        self._row_fetch = load_many
+        self._pending_load = (functools.partial(self._load_lazily, load_many), checks)
+
+    def _fetch_row_groups(self, search_criteria):
+        """
+        Return the list of rows in all row groups matching the group by fields found in
+        'search_criteria', fetching the row files if needed. The row groups are looked up in
+        the index. Returns None if 'search_criteria' contains none of the group by fields, or
+        if the table has been loaded in full meanwhile. See _fetch_row_group().
+        """
+        fields = [k for k in self._group_by_fields if k in search_criteria]
+        if len(fields) == len(self._group_by_fields):
+            return self._fetch_row_group(search_criteria)
+        if not fields:
+            return None
+        with self._table_store._load_lock:
+            if self._row_groups is None:
+                return None
+            primary_keys = [
+                primary_key for primary_key in self._row_groups.values()
+                if all(primary_key[k] == search_criteria[k] for k in fields)
+            ]
 
-    def _get_default_values(self):
+        rows = []
+        for primary_key in primary_keys:
+            group_rows = self._fetch_row_group(primary_key)
+            if group_rows is None:
+                return None
+            rows.extend(group_rows)
+        return rows
+
+    def _fetch_row_group(self, search_criteria):
+        """
+        Return the list of rows in the row group that 'search_criteria' belongs to, fetching
+        the row file if needed. Returns None if 'search_criteria' doesn't contain all the group
+        by fields, or if the table has been loaded in full meanwhile.
+
+        The rows of the ROW_CACHE_SIZE most recently used row groups are kept. The row file is
+        fetched without holding the load lock. Threads that need the same row file meanwhile
+        wait for it to be fetched instead of fetching it again. A row file that is missing
+        from the backend, as it was deleted by a later save, is treated as an empty row group.
+        """
+        if not all(k in search_criteria for k in self._group_by_fields):
+            return None
+        try:
+            group_key = self._canonicalize_key(search_criteria, use_group_by=True)
+        except ConstraintError:
+            return []  # Not a valid key so no row can match it.
+
+        lock = self._table_store._load_lock
+        with lock:
+            if self._row_cache is None:
+                return None
+            rows = self._row_cache.pop(group_key, None)
+            if rows is not None:
+                self._row_cache[group_key] = rows
+                return rows
+            primary_key = self._row_groups.get(group_key)
+            if primary_key is None:
+                return []
+            future = self._row_fetches.get(group_key)
+            fetching = future is None
+            if fetching:
+                future = self._row_fetches[group_key] = concurrent.futures.Future()
+                row_fetch, checks = self._row_fetch, self._pending_load[1]
+
+        if not fetching:
+            return future.result()
+
+        try:
+            rows = self._read_row_group(row_fetch, checks, primary_key)
+        except Exception as e:
+            with lock:
+                if self._row_fetches is not None:
+                    self._row_fetches.pop(group_key, None)
+            future.set_exception(e)
+            raise
+
+        with lock:
+            if self._row_cache is not None:
+                del self._row_fetches[group_key]
+                if rows:
+                    self._row_cache[group_key] = rows
+                    while len(self._row_cache) > self.ROW_CACHE_SIZE:
+                        self._row_cache.popitem(last=False)
+                else:
+                    del self._row_groups[group_key]
+        future.set_result(rows)
+        return rows
+
+    def _read_row_group(self, row_fetch, checks, primary_key):
+        """Fetch the row file of 'primary_key' using 'row_fetch' and return its rows, frozen."""
+        file_name = self.get_filename(row=primary_key)
+        log.debug("Fetch rows %s", file_name)
+        try:
+            rows = _load_json(row_fetch, [file_name])[0]
+        except BackendFileNotFound:
+            log.info("Row file %s of %s not found. It may have been deleted since the index was loaded.",
+                     file_name, self)
+            return []
+        if self._group_by_fields == self._pk_fields:
+            rows = [rows]
+        if 'schema' in checks and self._schema:
+            validator = self._get_schema_validator()
+            for row in rows:
+                check_schema(row, self._schema, "Fetching row from {}".format(self), validator=validator)
+        return [_freeze_value(row) for row in rows]
+
+    def _load_snapshot_data(self, snapshot, offset, length, errors=None):
+        """Load the rows found at 'offset' in 'snapshot'. See TableStore.get_snapshot()."""
+        self._hydrate_snapshot(jsonloads(snapshot[offset:offset + length].decode("ascii"), self._table_name), errors)
+
+    def _hydrate_snapshot(self, items, errors=None):
+        """
+        Insert 'items', a list of row key and row pairs from a snapshot, into an empty table.
+        The rows were saved with their default values applied, so they are inserted as they
+        are and indexed in one go instead of going through add_many(). The row keys are
+        verified if the 'pk' or 'constraints' checks are in effect. See add_many() for
+        'errors'.
+        """
+        checks = get_integrity_checks()
+        check_keys = 'pk' in checks or 'constraints' in checks
+        violations = []
+        rows = self._rows
+        for row_key, row in items:
+            if check_keys:
+                try:
+                    valid = self._canonicalize_key(row) == row_key and row_key not in rows
+                except TableError as e:
+                    violations.append(e)
+                    continue
+                if not valid:
+                    violations.append(ConstraintError("Primary key violation in table '{}': {}".format(
+                        self._table_name, row_key)))
+                    continue
+            rows[row_key] = row
+
+        if self._sequences:
+            for row in rows.values():
+                self._advance_sequences(row)
+        self._rebuild_indexes()
+        self._change_count += 1
+        violations += self._check_rows(list(rows.items()), checks)
+        if violations and errors is None:
+            self._clear_rows()
+            raise IntegrityError(violations)
+        elif violations:
+            errors.extend(violations)
+
+    def _get_snapshot_data(self):
+        """Return all rows, sorted on primary key, as a compact Json array of row key and row pairs."""
+        rows = [[k, self._rows[k]] for k in sorted(self._rows)]
+        return json.dumps(rows, **JSON_PROFILES['compact']).encode("ascii")
+
+    def _get_default_values(self, row=None):
         """
         Return a dict of default values for this table. Dynamic values are calculated.
+        If 'row' is set, values for fields already defined in 'row' are omitted.
         """
         # TODO: Move this to a utility
 
-        d = copy.deepcopy(self._default_values)
+        d = copy.deepcopy({k: v for k, v in self._default_values.items() if row is None or k not in row})
         for k, v in d.items():
             if isinstance(v, six.string_types) and v.startswith('@@'):
                 if v == '@@utcnow':
                     d[k] = datetime.utcnow().isoformat() + 'Z'
                 elif v == '@@identity':
-                    if self._rows:
-                        d[k] = max([row[k] for row in self._rows.values()]) + 1
-                    else:
-                        d[k] = 1
+                    d[k] = self._next_identity(k)
                 else:
                     log.warning("Unknown dynamic default value '{}' defined in table '{}'".format(k, self._table_name))
         return d
 
+    def _seed_sequences(self):
+        """Seed the @@identity sequences using the current rows. This is only done once."""
+        for k, v in self._default_values.items():
+            if v == '@@identity' and k not in self._sequences:
+                self._sequences[k] = self._get_row_sequence(k)
+
+    def _get_row_sequence(self, field_name):
+        """Return the highest @@identity value for 'field_name' used in the rows."""
+        values = [row[field_name] for row in self._rows.values() if isinstance(row.get(field_name), six.integer_types)]
+        return max(values) if values else 0
+
+    def _next_identity(self, field_name):
+        """Return the next value in the @@identity sequence for 'field_name'."""
+        self._seed_sequences()
+        return self._sequences[field_name] + 1
+
+    def _advance_sequences(self, row):
+        """Make sure seeded @@identity sequences don't reissue values used in 'row'."""
+        for k, last in self._sequences.items():
+            if isinstance(row.get(k), six.integer_types) and row[k] > last:
+                self._sequences[k] = row[k]
+
 
 class SingleRowTable(Table):
     """
@@ -583,28 +2041,38 @@ class SingleRowTable(Table):
     def _canonicalize_key(self, primary_key, use_group_by=False):
         return ''
 
+    @_read_locked
     def get(self):
         if self._rows:
+            self._hand_out([''])
             return next(r for r in self._rows.values())
 
     def __getitem__(self, key):
         """Convenience operator to access properties of a single row."""
         return self.get()[key]
 
-    def add(self, row, check_only=False):
+    @_write_locked
+    def add(self, row, check_only=False, checks=None):
         # Adding a row to a single row table essentially means overwrite whatever is
         # in there. So let's remove the singleton record before adding this one if needed.
         tmp = self.get()
-        self._rows.clear()
+        self._clear_rows()
         try:
-            return super(SingleRowTable, self).add(row, check_only)
+            return super(SingleRowTable, self).add(row, check_only, checks)
         finally:
-            if check_only:
-                self._rows.add(tmp)
+            if check_only and tmp is not None:
+                self._rows[''] = tmp
+                self._index_row('', tmp)
+                self._reset_checksum()
+
+    @_write_locked
+    def add_many(self, rows, defer_checks=True, errors=None, checks=None):
+        raise TableError("Single row table can only hold one row.")
 
     def set_row_as_file(self, use_subfolder=None, subfolder_name=None, group_by=None):
         raise TableError("Single row table ")
 
+    @_write_locked
     def add_default_values(self, default_values):
         # As single row table always contains one row, we need to make re-add the
         # default row now.
@@ -613,25 +2081,38 @@ class SingleRowTable(Table):
         super(SingleRowTable, self).add_default_values(default_values)
         self.add({})
 
-    def _save_table_data(self, save_data):
+    def _save_table_data(self, save_many, json_profile='pretty'):
         """
         Save document.
         """
         doc = self.get() or {}
-        data = json.dumps(doc, indent=4, sort_keys=True).encode("ascii")
-        save_data(self.get_filename(), data)
+        data = json.dumps(doc, **JSON_PROFILES[json_profile]).encode("ascii")
+        save_many([(self.get_filename(), data)])
 
-        checksum = hashlib.sha256()
-        checksum.update(data)
-        return checksum.hexdigest()
-
-    def _load_table_data(self, fetch_from_storage):
+    def _load_table_data(self, load_many, errors=None):
         """
         Load document data.
         """
-        data = fetch_from_storage(self.get_filename()).decode("ascii")
-        doc = jsonloads(data, self.get_filename())
-        self.add(doc)
+        doc = _load_json(load_many, [self.get_filename()])[0]
+        self._hydrate([doc], errors)
+
+    def _hydrate(self, rows, errors=None):
+        try:
+            self.add(rows[0])
+        except (TableError, ValidationError) as e:
+            if errors is None:
+                raise
+            errors.append(e)
+
+    def _hydrate_snapshot(self, items, errors=None):
+        self._hydrate([row for row_key, row in items], errors)
+
+    def _get_snapshot_data(self):
+        return json.dumps([['', self.get() or {}]], **JSON_PROFILES['compact']).encode("ascii")
+
+
+def _get_table_definition(table):
+    return json.dumps(table, cls=TableStoreEncoder, sort_keys=True)
 
 
 class TableStoreEncoder(json.JSONEncoder):
@@ -643,16 +2124,16 @@ class TableStoreEncoder(json.JSONEncoder):
     """
     def default(self, obj):
         if isinstance(obj, TableStore):
-            return obj.__dict__
+            d = obj.__getstate__()
+            d.pop('_frozen', None)
+            d.pop('_partial', None)
+            return d
         elif isinstance(obj, Table):
-            #
-            tmp, obj._rows = obj._rows, {}  # Remove rows temporarily
-            tmp2 = obj.__dict__.pop('_table_store')  # Exlude this property from definition
-            try:
-                return {'class': obj.__class__.__name__, 'dict': obj.__dict__.copy()}
-            finally:
-                obj._rows = tmp
-                obj._table_store = tmp2
+            # Exclude the table store reference, sequences, frozen flag and transient properties from definition.
+            excluded = ('_table_store', '_sequences', '_frozen') + obj._transient_attributes
+            d = {k: v for k, v in obj.__dict__.items() if k not in excluded}
+            d['_rows'] = {}  # Rows are not part of the definition.
+            return {'class': obj.__class__.__name__, 'dict': d}
 
         # Let the base class default method raise the TypeError
         return super(TableStoreEncoder, self).default(obj)
@@ -663,17 +2144,41 @@ class TableStore(object):
     TS_DEF_FILENAME = '#tsdef.json'
     TS_META_TABLENAME = '#tsmeta'
 
-    def __init__(self):
+    _frozen = False  # See freeze().
+    _cow_shared = False  # Only tables share rows. See clone().
+    _partial = False  # True if only some of the tables were loaded. See _select_tables().
+    _source = None  # Backend and file format the table store was loaded from.
+
+    # Lazy loading state, see Backend.load_table_store().
+    _pending_load = None  # True if some tables are yet to be loaded.
+    _load_lock = None  # Serializes loading of tables.
+    _loading_thread = None  # Thread id of the thread loading a table.
+
+    def __init__(self, locking=False):
         """
-        Initialize TableStore. If 'backend' is set, it will load definition and data from
-        that backend.
+        Initialize TableStore.
+
+        If 'locking' is True, the table store is safe to use from multiple threads. See
+        set_locking() for details.
         """
         self._tables = collections.OrderedDict()
         self._tableorder = []  # Table order, because of DAG
         self._origin = 'clean'
         self._lock_meta = False  # Safeguard updates to meta data.
+        self._rwlock = ReadWriteLock() if locking else None
         self._add_metatable()
 
+    def __getstate__(self):
+        # The locks are runtime properties and are neither pickled nor part of the definition.
+        state = self.__dict__.copy()
+        for attr in ('_rwlock', '_pending_load', '_load_lock', '_loading_thread', '_source'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._rwlock = None
+
     def __str__(self):
         if 'domain' in self._tables:
             domain = self._tables['domain'].get()
@@ -690,6 +2195,156 @@ class TableStore(object):
         """Dict of all tables, excluding system tables."""
         return {tn: table for tn, table in self._tables.items() if not table._is_system_table}
 
+    def _get_rwlock(self):
+        if self._loading_thread == get_ident():
+            return None  # See Table._get_rwlock().
+        return self._rwlock
+
+    def _select_tables(self, table_names):
+        """
+        Drop all user tables except 'table_names' and the tables they refer to through foreign
+        keys, directly or indirectly. The table store is then partial and can't be saved.
+        """
+        selected = set()
+        pending = list(table_names)
+        while pending:
+            table_name = pending.pop()
+            if table_name in selected:
+                continue
+            if table_name not in self._tables:
+                raise TableError("Table '{}' not found.".format(table_name))
+            selected.add(table_name)
+            for c in self._tables[table_name]._constraints:
+                if c['type'] == 'foreign_key':
+                    pending.append(c['table'])
+
+        self._tables = collections.OrderedDict(
+            (table_name, table) for table_name, table in self._tables.items()
+            if table_name in selected or table._is_system_table
+        )
+        self._tableorder = list(self._tables.keys())
+        self._partial = True
+
+    def _load_pending(self):
+        """Load all tables that were loaded lazily and report all integrity violations together."""
+        errors = []
+        for table in list(self._tables.values()):
+            if table._pending_load is not None:
+                table._load_pending(errors)
+        self._pending_load = None
+        if errors:
+            raise IntegrityError(errors)
+
+    def reuse_tables(self, other):
+        """
+        Use tables from table store 'other' in place of tables in this table store which are
+        yet to be loaded lazily, if their definition and checksum match. The checksum is taken
+        from the meta data of this table store, so the rows are never fetched. The tables
+        share rows with 'other' until modified, see clone(). Their @@identity sequences are
+        advanced to the ones in the meta data of this table store if those are further along.
+
+        Returns the names of the tables that were reused.
+        """
+        reused = []
+        md5s = {table_meta['table_name']: table_meta['md5'] for table_meta in self.meta['tables']}
+        with other.read_locked():
+            for table_name, table in list(self._tables.items()):
+                other_table = other._tables.get(table_name)
+                if table._pending_load is None or table._is_system_table or other_table is None:
+                    continue
+                if md5s.get(table_name) != other_table.get_checksum():
+                    continue
+                if _get_table_definition(table) != _get_table_definition(other_table):
+                    continue
+                log.debug("Reuse %s from %s", table, other)
+                table = self._tables[table_name] = other_table._clone(self)
+                table._seed_sequences_from_meta()
+                reused.append(table_name)
+
+        if self._pending_load is not None:
+            self._pending_load = any(table._pending_load for table in self._tables.values()) or None
+        return reused
+
+    def set_locking(self, enabled):
+        """
+        Turn reader-writer locking on or off for this table store.
+
+        With locking on, any number of threads can read from the tables concurrently using
+        get(), find() and the like, but adding, updating and removing rows, changing table
+        definitions, and loading and saving the table store is exclusive.
+
+        Note that rows are returned by reference. Modify rows in-place only while holding
+        the write lock. See write_locked().
+        """
+        if enabled and self._rwlock is None:
+            self._rwlock = ReadWriteLock()
+        elif not enabled:
+            self._rwlock = None
+
+    @property
+    def is_frozen(self):
+        return self._frozen
+
+    def freeze(self):
+        """
+        Return a read-only snapshot of this table store.
+
+        The rows in the snapshot are FrozenDict instances, with nested dicts and lists frozen
+        as well, and the indexes are built up front. Any call that would modify the snapshot,
+        including saving it to a backend, raises TableError. The snapshot is not affected by
+        later changes to this table store and can be shared between threads without locking.
+        """
+        if self._pending_load is not None:
+            self._load_pending()
+        with self.read_locked():
+            ts = TableStore.__new__(TableStore)
+            ts.__setstate__(self.__getstate__())
+            ts._frozen = True
+            ts._tables = collections.OrderedDict(
+                (table_name, table._freeze(ts)) for table_name, table in self._tables.items()
+            )
+            ts._tableorder = list(ts._tables.keys())
+        return ts
+
+    def clone(self):
+        """
+        Return a stand-alone copy of this table store.
+
+        Cloning is cheap as the clone shares the rows of each table with this table store
+        until the table is accessed through either of them. Then the clone gets its own copy
+        of the rows of that table, while the rows of this table store are left intact.
+
+        Note that rows fetched from this table store before cloning should not be modified
+        in-place afterwards, as the change would be visible in the clone as well.
+        """
+        if self._pending_load is not None:
+            self._load_pending()
+        with self.read_locked():
+            ts = TableStore.__new__(TableStore)
+            ts.__setstate__(self.__getstate__())
+            ts.__dict__.pop('_frozen', None)
+            ts._lock_meta = False
+            ts._tables = collections.OrderedDict(
+                (table_name, table._clone(ts)) for table_name, table in self._tables.items()
+            )
+            ts._tableorder = list(ts._tables.keys())
+        return ts
+
+    def read_locked(self):
+        """
+        Context manager holding the read lock for a series of reads that must be consistent.
+        Does nothing if locking is not enabled.
+        """
+        return self._rwlock.read_locked() if self._rwlock else _not_locked()
+
+    def write_locked(self):
+        """
+        Context manager holding the write lock for a series of modifications, like changing
+        rows in-place. Does nothing if locking is not enabled.
+        """
+        return self._rwlock.write_locked() if self._rwlock else _not_locked()
+
+    @_write_locked
     def add_table(self, table_name, single_row=False):
         if single_row:
             cls = SingleRowTable
@@ -700,7 +2355,11 @@ class TableStore(object):
         return table
 
     def get_table(self, table_name):
-        return self._tables[table_name]
+        """Returns the table 'table_name'. If the table was loaded lazily, it is loaded now."""
+        table = self._tables[table_name]
+        if table._pending_load is not None and table._row_fetch is None:
+            table._load_pending()
+        return table
 
     def clear(self):
         for table in self._tables.values():
@@ -714,6 +2373,7 @@ class TableStore(object):
         self._tableorder = list(self._tables.keys())
         return json.dumps(self, indent=4, cls=TableStoreEncoder, sort_keys=True)
 
+    @_write_locked
     def init_from_definition(self, definition):
         """
         Initialize this instance using result from a previous call to
@@ -742,18 +2402,21 @@ class TableStore(object):
                 raise RuntimeError("Unknown table class '{}'".format(table_data['class']))
             self._tables[table_name] = cls(table_name, self, table_data)
 
+    @_write_locked
     def check_integrity(self):
         """Run constraints and schema integrity check on current table store."""
-        if not CHECK_INTEGRITY:  # Do a quick bail-out.
+        if not get_integrity_checks():  # Do a quick bail-out.
             return
 
         b = DictBackend()
         b.save_table_store(self, run_integrity_check=False)
         # self.save_to_backend(b, run_integrity_check=False)
         # Serializing in a table store will in fact run all the integrity checks.
-        b.load_table_store()  # This will trigger any constraint or schema violations.
+        # This will trigger any constraint or schema violations, reported together in an IntegrityError.
+        b.load_table_store()
 
-    def _save_to_backend(self, backend, force=False, run_integrity_check=True):
+    @_write_locked
+    def _save_to_backend(self, backend, force=False, run_integrity_check=True, base=None):
         """
         Save this table store definition and table data to 'backend'.
 
@@ -763,9 +2426,18 @@ class TableStore(object):
 
         If 'run_integrity_check' is True, full integrity check on constraints and schema
         will be made prior to saving to backend.
+
+        If 'base' is the table store currently in 'backend', only files that differ from it
+        are saved and row files no longer in use are deleted. A table is skipped without
+        serializing it if its definition and checksum are the same as in 'base'. A table that
+        can't be loaded from 'base', e.g. if an earlier save was interrupted before the meta
+        data was saved, is saved in full.
+
+        Returns a dict with the number of files and bytes saved and skipped, files deleted and
+        tables skipped.
         """
         # Do basic self test
-        if len(self._tables) < 2 and not force:
+        if (len(self._tables) < 2 or self._partial) and not force:
             # Table store is only partially functional.
             raise RuntimeError("Won't save out partially constructed table store.")
 
@@ -773,47 +2445,208 @@ class TableStore(object):
             self.check_integrity()
 
         backend.start_saving()
-        backend.save_data(self.TS_DEF_FILENAME, self.get_definition().encode())
-
         user_tables = [table for table in self._tables.values() if not table._is_system_table]
         system_tables = [table for table in self._tables.values() if table._is_system_table]
 
+        stats = dict(files_saved=0, bytes_saved=0, files_skipped=0, bytes_skipped=0, files_deleted=0, tables_skipped=0)
+        deleted = []
+
+        def save_many(items):
+            stats['files_saved'] += len(items)
+            stats['bytes_saved'] += sum(len(data) for file_name, data in items)
+            backend.save_many(items)
+
+        # The files of all the user tables are saved in a single batch.
+        items = [(self.TS_DEF_FILENAME, self.get_definition().encode())]
         for table in user_tables:
             log.debug("Save to backend %s: %s", backend, table)
-            table.save(backend.save_data)
+            base_table = base._tables.get(table.name) if base is not None else None
+            if base_table is None or _get_table_definition(table) != _get_table_definition(base_table):
+                table._save(items.extend, backend.json_profile)
+                continue
 
-        # Calculate checksum for user tables
-        checksum = hashlib.sha256()
-        for table in user_tables:
-            md5 = self.get_table_metadata(table.name)['md5']
-            checksum.update(md5.encode("ascii"))
-        self.meta.get()['checksum'] = checksum.hexdigest()
+            table._update_metadata()
+            base_meta = next((m for m in base.meta['tables'] if m['table_name'] == table.name), {})
+            if base_meta.get('md5') == self.get_table_metadata(table.name)['md5']:
+                stats['tables_skipped'] += 1
+                continue
+
+            try:
+                base_files = base_table._get_files(backend.json_profile)
+            except Exception as e:
+                log.warning("Can't load %s from %s to compare, saving it in full: %s", table, backend, repr(e))
+                table._save(items.extend, backend.json_profile)
+                continue
+            files = table._get_files(backend.json_profile)
+            for file_name, data in files.items():
+                if base_files.get(file_name) == data:
+                    stats['files_skipped'] += 1
+                    stats['bytes_skipped'] += len(data)
+                else:
+                    items.append((file_name, data))
+            deleted += [file_name for file_name in base_files if file_name not in files]
+        save_many(items)
+
+        # The meta data is saved only after all the table files are in place.
+        self._update_checksum(user_tables)
 
         for table in system_tables:
             log.debug("Save to backend %s: %s", backend, table)
-            table.save(backend.save_data)
+            table._save(save_many, backend.json_profile)
+
+        for file_name in deleted:
+            backend.delete_data(file_name)
+        stats['files_deleted'] = len(deleted)
 
         backend.done_saving()
+        return stats
 
-    def _load_from_backend(self, backend, skip_definition=False):
+    @_write_locked
+    def _load_from_backend(self, backend, skip_definition=False, lazy=False, tables=None, fetch_rows=False):
         """
         Initialize this table store using data from 'backend'.
 
         If 'skip_definition' is True, the current definition in the
         TableStore object is used, instead of the one stored in the
         backend.
+
+        If 'lazy' is True, only the system tables are loaded. Each user table is loaded when
+        first accessed.
+
+        If 'tables' is a list of table names, only those tables and the tables they refer to
+        are loaded. See _select_tables().
+
+        If 'fetch_rows' is True, only the index of tables serialized using set_row_as_file()
+        is loaded. See Table._start_row_fetch().
         """
         backend.start_loading()
         if not skip_definition:
             definition = backend.load_data(self.TS_DEF_FILENAME).decode()
             self.init_from_definition(definition)
+        if tables is not None:
+            self._select_tables(tables)
         self._origin = str(backend)
 
+        # Bulk load all the tables and report all integrity violations together.
+        errors = []
+        checks = get_integrity_checks()
         for table in self._tables.values():
+            if fetch_rows and table._group_by_fields and not table._is_system_table:
+                table._start_row_fetch(backend.load_many, checks)
+                continue
+            if lazy and not table._is_system_table:
+                table._pending_load = (functools.partial(table._load_lazily, backend.load_many), checks)
+                continue
             log.debug("Load from backend %s: %s", backend, table)
-            table.load(backend.load_data)
+            table._load(backend.load_many, errors)
 
         backend.done_loading()
+        if lazy or fetch_rows:
+            self._set_lazy()
+        if errors:
+            raise IntegrityError(errors)
+
+    def _set_lazy(self):
+        self._load_lock = threading.RLock()
+        self._pending_load = any(table._pending_load for table in self._tables.values()) or None
+
+    @_write_locked
+    def get_snapshot(self):
+        """
+        Returns this table store, definition and table data, as a single snapshot blob. The
+        table metadata is brought up to date first, like when saving to a backend.
+
+        Unlike pickle, a snapshot contains nothing but Json data, so it's safe to load from
+        untrusted sources, and it is decoded one table at a time using the table of contents.
+        """
+        user_tables = [table for table in self._tables.values() if not table._is_system_table]
+        for table in user_tables:
+            table._update_metadata()
+        self._update_checksum(user_tables)
+
+        definition = self.get_definition().encode("ascii")
+        chunks = [definition]
+        offset = _SNAPSHOT_HEADER.size
+        toc = {'definition': [offset, len(definition)], 'tables': []}
+        offset += len(definition)
+        for table in self._tables.values():
+            data = table._get_snapshot_data()
+            toc['tables'].append([table.name, offset, len(data)])
+            chunks.append(data)
+            offset += len(data)
+
+        toc_data = json.dumps(toc, **JSON_PROFILES['compact']).encode("ascii")
+        header = _SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, offset, len(toc_data))
+        return b''.join([header] + chunks + [toc_data])
+
+    @_write_locked
+    def init_from_snapshot(self, snapshot, lazy=False, tables=None):
+        """
+        Initialize this instance using result from a previous call to 'get_snapshot'.
+
+        The rows are inserted with the integrity checks currently in effect, see integrity().
+        All violations are reported together in an IntegrityError.
+
+        If 'lazy' is True, only the system tables are decoded. Each user table is decoded
+        when first accessed, and 'snapshot' is kept until then.
+
+        If 'tables' is a list of table names, only those tables and the tables they refer to
+        are decoded. See _select_tables().
+        """
+        toc = _read_snapshot_toc(snapshot)
+        offset, length = toc['definition']
+        self.init_from_definition(snapshot[offset:offset + length].decode("ascii"))
+        if tables is not None:
+            self._select_tables(tables)
+
+        errors = []
+        checks = get_integrity_checks()
+        for table_name, offset, length in toc['tables']:
+            table = self._tables.get(table_name)
+            if table is None:
+                continue
+            load = functools.partial(table._load_snapshot_data, snapshot, offset, length)
+            if lazy and not table._is_system_table:
+                table._pending_load = (load, checks)
+            else:
+                load(errors)
+                table._seed_sequences_from_meta()
+
+        if lazy:
+            self._set_lazy()
+        if errors:
+            raise IntegrityError(errors)
+
+    def _update_checksum(self, user_tables):
+        """
+        Calculate checksum for user tables. It is the root of a Merkle tree with the table name
+        and checksum of each table as leaves, ordered by table name.
+        """
+        checksum = hashlib.sha256()
+        for table in sorted(user_tables, key=lambda table: table.name):
+            md5 = self.get_table_metadata(table.name)['md5']
+            checksum.update(_hash_key(table.name).encode("ascii"))
+            checksum.update(md5.encode("ascii"))
+        self.meta.get()['checksum'] = checksum.hexdigest()
+
+    def _upgrade_checksums(self, user_tables):
+        """
+        Replace the checksums in the meta data that were calculated by older versions with the
+        current ones, for the tables that haven't been modified since. The tables are not
+        reported as modified by refresh_metadata() because of it.
+        """
+        upgraded = False
+        for table in user_tables:
+            table_meta = self.get_table_metadata(table.name)
+            if table_meta.get('checksum_type') or not table_meta['md5']:
+                continue
+            if table._get_legacy_checksum() == table_meta['md5']:
+                log.info("Upgrading checksum of %s in the meta data.", table)
+                table_meta['md5'] = table.get_checksum()
+                table_meta['checksum_type'] = 'merkle'
+                upgraded = True
+        if upgraded:
+            self._update_checksum(user_tables)
 
     def get_table_metadata(self, table_name):
         for table_meta in self.meta['tables']:
@@ -827,14 +2660,21 @@ class TableStore(object):
         self.meta['tables'].append(table_meta)
         return table_meta
 
+    @_write_locked
     def refresh_metadata(self):
         """Refreshes local meta data and returns a tuple of old and new metadata."""
         if self._lock_meta:
             raise RuntimeError("Can't refresh metadata as it's safeguarded.")
+        if self._partial:
+            raise RuntimeError("Can't refresh metadata of a partially loaded table store.")
 
+        user_tables = [table for table in self._tables.values() if not table._is_system_table]
+        self._upgrade_checksums(user_tables)
         old = copy.deepcopy(self.meta.get())
-        backend = create_backend('memory://' + datetime.utcnow().isoformat() + 'Z')
-        backend.save_table_store(self)
+        # Only tables modified since the last refresh are hashed again.
+        for table in user_tables:
+            table._update_metadata()
+        self._update_checksum(user_tables)
         new = self.meta.get()
         if old != new:
             # If something changed, bump the version and timestamp
@@ -862,7 +2702,9 @@ class TableStore(object):
                     'properties': {
                         'table_name': {'type': 'string'},
                         'md5': {'type': 'string'},
+                        'checksum_type': {'type': 'string'},
                         'last_modified': {'format': 'date-time'},
+                        'sequences': {'type': 'object'},
                     },
                 }},
             },
@@ -876,17 +2718,76 @@ class TableStore(object):
         })
 
 
+def _is_snapshot(blob):
+    """Returns True if 'blob' is a table store snapshot."""
+    return blob[:len(SNAPSHOT_MAGIC)] == SNAPSHOT_MAGIC
+
+
+def _read_snapshot_toc(snapshot):
+    """
+    Return the table of contents of 'snapshot'. Raises RelibError if the format version is
+    unsupported, the toc is malformed, or if any of its entries overlap or point outside the
+    data section between the header and the toc.
+    """
+    if len(snapshot) < _SNAPSHOT_HEADER.size or not _is_snapshot(snapshot):
+        raise RelibError("Data is not a table store snapshot.")
+    magic, version, toc_offset, toc_length = _SNAPSHOT_HEADER.unpack_from(snapshot)
+    if version != SNAPSHOT_VERSION:
+        raise RelibError("Unsupported table store snapshot version {}.".format(version))
+    toc = snapshot[toc_offset:toc_offset + toc_length]
+    if toc_offset < _SNAPSHOT_HEADER.size or len(toc) != toc_length:
+        raise RelibError("Table store snapshot is truncated.")
+
+    try:
+        toc = jsonloads(toc.decode("ascii"), "<snapshot toc>")
+        entries = [['definition'] + toc['definition']] + toc['tables']
+        spans = sorted((offset, length, name) for name, offset, length in entries)
+    except (ValueError, KeyError, TypeError):
+        raise RelibError("Table store snapshot has a malformed table of contents.")
+    if len(set(name for offset, length, name in spans)) != len(spans):
+        raise RelibError("Table store snapshot has duplicate entries in the table of contents.")
+
+    end = _SNAPSHOT_HEADER.size
+    for offset, length, name in spans:
+        is_int = all(isinstance(v, six.integer_types) and not isinstance(v, bool) for v in (offset, length))
+        if not is_int or length < 0 or offset < end or offset + length > toc_offset:
+            raise RelibError("Table store snapshot entry {!r} is out of bounds or overlaps another one.".format(name))
+        end = offset + length
+    return toc
+
+
 class Backend(object):
     """
     Backend is used to serialize table definition and data.
     """
 
     schemes = {}  # Backend registry using url scheme as key.
-    pickle_filename = 'table-store.pickle'
+    pickle_filename = 'table-store.pickle'  # Holds a pickle or snapshot, or is empty for json.
     default_format = 'json'  # Default table store file format for the backend.
+    json_profile = 'pretty'  # Json profile for table data, see JSON_PROFILES.
     is_cache = False  # If backend is cache rather than source.
+    fetch_workers = 1  # Number of threads fetching files in parallel, see load_many().
+    save_workers = 1  # Number of threads saving files in parallel, see save_many().
+    delta_saves = True  # If unchanged files can be skipped when saving, see save_table_store().
 
-    def load_table_store(self):
+    def load_table_store(self, lazy=False, tables=None, fetch_rows=False):
+        """
+        Load the table store from this backend.
+
+        If 'lazy' is True, only the definition and meta data are loaded up front and each table
+        is loaded when first accessed, so integrity violations are reported then. Json tables
+        loaded lazily are verified against the checksums in the meta data, see
+        Table._load_lazily(). Pickled table stores are always loaded in full.
+
+        If 'tables' is a list of table names, the table store contains only those tables and the
+        tables they refer to through foreign keys. The rest are neither fetched nor decoded,
+        except for pickles. Such a partial table store can't be saved.
+
+        If 'fetch_rows' is True, tables serialized using set_row_as_file() load only their
+        index. get() and find() then fetch the row files they need and keep the most recently
+        used ones. The fetched rows are frozen, and the table can't be modified until it's
+        loaded in full. This applies to json only, as snapshots and pickles are single files.
+        """
         blob = None
         try:
             self.start_loading()
@@ -894,33 +2795,66 @@ class Backend(object):
             self.done_loading()
         except BackendFileNotFound:
             log.info("%s does not contain pickle: %s. Assuming json source.", self, self.pickle_filename)
-        if blob:
+        if blob and _is_snapshot(blob):
+            ts = TableStore()
+            ts.init_from_snapshot(blob, lazy=lazy, tables=tables)
+            ts._origin = str(self)
+            ts._source = (str(self), 'snapshot')
+        elif blob:
             ts = pickle.loads(blob)
+            if tables is not None:
+                ts._select_tables(tables)
+            ts._source = (str(self), 'pickle')
         else:
             # Try json loading
             ts = TableStore()
             try:
-                ts._load_from_backend(self)
+                ts._load_from_backend(self, lazy=lazy, tables=tables, fetch_rows=fetch_rows)
             except BackendFileNotFound:
                 raise RuntimeError("{} does not contain pickle nor json source: {}.".format(self, self.pickle_filename))
+            ts._source = (str(self), 'json')
         return ts
 
-    def save_table_store(self, ts, run_integrity_check=True, file_format=None):
+    def save_table_store(self, ts, run_integrity_check=True, file_format=None, base=None):
+        """
+        Save table store 'ts' to this backend.
+
+        If 'base' is the table store as it was loaded from this backend, a json save writes
+        only the files that changed since and deletes row files no longer in use. 'base' is
+        ignored unless it was loaded in full or lazily from this backend in json format.
+
+        Returns a dict with the number of files and bytes saved and skipped, files deleted and
+        tables skipped.
+        """
         file_format = file_format or self.default_format
+        if ts._partial:
+            raise RuntimeError("Won't save out partially loaded table store.")
+        if base is not None and (base._source != (str(self), file_format) or base._partial or not self.delta_saves):
+            base = None
 
         if file_format == 'json':
-            ts._save_to_backend(self, run_integrity_check=run_integrity_check)
+            stats = ts._save_to_backend(self, run_integrity_check=run_integrity_check, base=base)
             self.save_data(self.pickle_filename, b'')  # An empty pickle file indicates json format.
+            stats['files_saved'] += 1
+            return stats
         elif file_format == 'pickle':
             if run_integrity_check:
                 ts.check_integrity()
             blob = pickle.dumps(ts, protocol=2)
-            self.start_saving()
-            self.save_data(self.pickle_filename, blob)
-            self.done_saving()
+        elif file_format == 'snapshot':
+            if run_integrity_check:
+                ts.check_integrity()
+            blob = ts.get_snapshot()
         else:
             raise RuntimeError("Unsupported table store file format '%s'" % file_format)
 
+        self.start_saving()
+        # The snapshot takes the place of the pickle and is told apart by its magic.
+        self.save_data(self.pickle_filename, blob)
+        self.done_saving()
+        return dict(files_saved=1, bytes_saved=len(blob), files_skipped=0, bytes_skipped=0, files_deleted=0,
+                    tables_skipped=0)
+
     def start_saving(self):
         pass
 
@@ -941,9 +2875,37 @@ class Backend(object):
     def load_data(self, file_name):
         pass
 
+    def delete_data(self, file_name):
+        pass
+
+    def load_many(self, file_names, decode=None):
+        """
+        Return a list of the data of each of 'file_names'. If 'decode' is set, it's called with
+        the file name and data of each file and the results are returned instead.
+
+        The files are loaded using load_data(), one at a time or by a pool of 'fetch_workers'
+        threads. See _fetch_many(). Backends that can fetch many files in a single request
+        override this.
+        """
+        return _fetch_many(self.load_data, file_names, self.fetch_workers, decode)
+
+    def save_many(self, items):
+        """
+        Save a list of 'file_name' and 'data' tuples.
+
+        The files are saved using save_data(), one at a time or by a pool of 'save_workers'
+        threads. See _ParallelSave for how errors are reported. Backends that can save many
+        files in a single request override this.
+        """
+        with _ParallelSave(self.save_data, self.save_workers) as save_data:
+            for file_name, data in items:
+                save_data(file_name, data)
+
 
 class DictBackend(Backend):
     """Wrap a dict as a Backend for TableStore."""
+    json_profile = 'compact'
+
     def __init__(self, storage=None):
         self.storage = {} if storage is None else storage
 
@@ -953,6 +2915,9 @@ class DictBackend(Backend):
     def load_data(self, k):
         return self.storage[k]
 
+    def delete_data(self, k):
+        self.storage.pop(k, None)
+
 
 def create_backend(url):
     parts = urlparse(url)
@@ -963,18 +2928,14 @@ def create_backend(url):
         raise RuntimeError("No backend class registered to handle '{}'".format(url))
 
 
-def get_store_from_url(url):
+def get_store_from_url(url, lazy=False, tables=None, fetch_rows=False):
     b = create_backend(url)
-    return b.load_table_store()
+    return b.load_table_store(lazy=lazy, tables=tables, fetch_rows=fetch_rows)
 
 
 def copy_table_store(table_store):
-    """"Returns a stand-alone copy of 'table_store'."""
-    backend = create_backend('memory://' + datetime.utcnow().isoformat() + 'Z')
-    backend.save_table_store(table_store)
-    ts = backend.load_table_store()
-    ts._lock_meta = False
-    return ts
+    """"Returns a stand-alone copy of 'table_store'. See TableStore.clone()."""
+    return table_store.clone()
 
 
 def diff_tables(t1, t2):
@@ -983,22 +2944,25 @@ def diff_tables(t1, t2):
     Returns a dict with 'identical' as True or False depending on if the tables are identical,
     and 'new_rows', 'deleted_rows' and 'modified_rows' lists with the diffs accordingly.
     """
-    if t1 == t2:
+    if t1 is t2 or t1.get_checksum() == t2.get_checksum():
         return {'identical': True}
 
     diff = {}
     diff['identical'] = False
-
-    # Cheat by using the table._rows dict directly
-    pk1, pk2 = set(t1._rows), set(t2._rows)
-    diff['new_rows'] = [t1._rows[pk] for pk in pk1 - pk2]
-    diff['deleted_rows'] = [t2._rows[pk] for pk in pk2 - pk1]
+    diff['new_rows'] = []
+    diff['deleted_rows'] = []
     diff['modified_rows'] = []
-    for common_pk in pk1.intersection(pk2):
-        first = t1._rows[common_pk]
-        second = t2._rows[common_pk]
-        if first != second:
-            diff['modified_rows'].append({'first': first, 'second': second})
+
+    # Only the parts of the Merkle trees that differ are visited.
+    with _checksum_lock:
+        for row_key in t1._merkle_diff(t2):
+            first, second = t1._rows.get(row_key), t2._rows.get(row_key)
+            if second is None:
+                diff['new_rows'].append(first)
+            elif first is None:
+                diff['deleted_rows'].append(second)
+            else:
+                diff['modified_rows'].append({'first': first, 'second': second})
 
     return diff
 
@@ -1036,6 +3000,110 @@ def register(cls):
     return cls
 
 
+def _index_value(fields, row):
+    """
+    Return the hash index key for 'row' made from 'fields', or None if the row can't be
+    indexed because a field is missing or has an unhashable value.
+    """
+    try:
+        value = tuple(row[k] for k in fields)
+        hash(value)
+    except (KeyError, TypeError):
+        return None
+    return value
+
+
+def _hash_key(row_key):
+    """Return hex digest of 'row_key'. It's used to place the row in the Merkle tree."""
+    return hashlib.sha256(json.dumps(row_key).encode("ascii")).hexdigest()
+
+
+def _hash_row(row):
+    """Return sha256 digest of 'row' in canonical Json form."""
+    return hashlib.sha256(json.dumps(row, **JSON_PROFILES['compact']).encode("ascii")).digest()
+
+
+def _load_json(load_many, file_names):
+    """
+    Fetch the Json files 'file_names' in one go using 'load_many' and decode them. Returns a
+    list of the docs in the same order as 'file_names'.
+    """
+    return load_many(file_names, decode=_decode_json)
+
+
+def _decode_json(file_name, data):
+    return jsonloads(data.decode("ascii"), file_name)
+
+
+def _fetch_many(fetch_from_storage, file_names, workers=1, decode=None):
+    """
+    Fetch the files 'file_names' using 'fetch_from_storage', a function that accepts a single
+    file name. Returns a list of the data in the same order as 'file_names', or what 'decode'
+    returns for each file name and data if it's set.
+
+    If 'workers' is more than 1, the files are fetched by a pool of that many threads, each
+    decoding the files it fetched while the others wait on theirs. 'fetch_from_storage' must
+    then be thread safe.
+    """
+    def fetch(file_name):
+        data = fetch_from_storage(file_name)
+        return data if decode is None else decode(file_name, data)
+
+    if workers <= 1 or len(file_names) <= 1:
+        return [fetch(file_name) for file_name in file_names]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(workers, len(file_names))) as executor:
+        return list(executor.map(fetch, file_names))
+
+
+class _ParallelSave(object):
+    """
+    Context manager to save files using 'save_data' from a pool of 'workers' threads. Files are
+    queued by calling it like 'save_data'. At most a few files per worker are queued at a time,
+    which keeps the memory use in check.
+
+    On exit it waits for all the files to be saved. If any of them failed, the error is raised,
+    or a BackendError listing all of them if more than one failed. The errors are listed in the
+    order the files were queued, regardless of the order in which the saves finished, so the
+    same failures are always reported the same way. With a single worker, the files are saved
+    right away and errors raised immediately.
+    """
+    def __init__(self, save_data, workers=1):
+        self._save_data = save_data
+        self._executor = None
+        if workers > 1:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+            self._slots = threading.BoundedSemaphore(workers * 4)
+            self._futures = []
+
+    def __enter__(self):
+        return self
+
+    def __call__(self, file_name, data):
+        if self._executor is None:
+            return self._save_data(file_name, data)
+        self._slots.acquire()
+        future = self._executor.submit(self._save_data, file_name, data)
+        future.add_done_callback(lambda future: self._slots.release())
+        self._futures.append((file_name, future))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        if exc_type is not None:
+            return  # Let the original error through.
+
+        # The futures are kept in the order the files were queued.
+        errors = [(file_name, future.exception()) for file_name, future in self._futures]
+        errors = [(file_name, e) for file_name, e in errors if e is not None]
+        if len(errors) == 1:
+            raise errors[0][1]
+        elif errors:
+            raise BackendError("Failed to save {} of {} files:\n{}".format(
+                len(errors), len(self._futures),
+                "\n".join("{}: {!r}".format(file_name, e) for file_name, e in errors)))
+
+
 def jsonloads(json_text, filename):
     """
     Wrapper for json.loads function. If the json is bad, a proper error
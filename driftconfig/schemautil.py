@@ -14,17 +14,34 @@ from click import echo
 log = logging.getLogger(__name__)
 
 
-def check_schema(json_object, schema, title=None):
-    """Do json schema check on object and abort with 400 error if it fails."""
-    try:
-        jsonschema.validate(json_object, schema, format_checker=jsonschema.FormatChecker())
-        # jsonschema.validate(json_object, schema)
-    except jsonschema.ValidationError as e:
-        report = _generate_validation_error_report(e, json_object)
-        if title:
-            report = "Schema check failed: %s\n%s" % (title, report)
-        e.message = report
-        raise
+def get_validator(schema):
+    """
+    Return a validator instance for 'schema'. The schema itself is checked as well.
+    The validator can be reused for any number of check_schema() calls.
+    """
+    cls = jsonschema.validators.validator_for(schema)
+    cls.check_schema(schema)
+    return cls(schema, format_checker=jsonschema.FormatChecker())
+
+
+def check_schema(json_object, schema, title=None, validator=None):
+    """
+    Do json schema check on object and abort with 400 error if it fails.
+    If 'validator' is set, it is used instead of creating a new one for 'schema'.
+    """
+    if validator is None:
+        validator = get_validator(schema)
+
+    # Quick check first. The error report is only generated if validation fails.
+    if validator.is_valid(json_object):
+        return
+
+    e = jsonschema.exceptions.best_match(validator.iter_errors(json_object))
+    report = _generate_validation_error_report(e, json_object)
+    if title:
+        report = "Schema check failed: %s\n%s" % (title, report)
+    e.message = report
+    raise e
 
 
 def _generate_validation_error_report(e, json_object):
@@ -1,7 +1,14 @@
 # -*- coding: utf-8 -*-
 import unittest
+import tempfile
+import shutil
+import hashlib
 
-from driftconfig.config import get_drift_table_store, TSTransaction
+import six
+
+from driftconfig.relib import DictBackend, create_backend
+from driftconfig.config import get_drift_table_store, TSTransaction, pull_from_origin
+from driftconfig.util import get_drift_config
 
 # TODO:
 # - test 'check_only' in Table.add().
@@ -228,9 +235,129 @@ class TestRelib(unittest.TestCase):
             'tenant_name': 'dg-unittest-product',
         })
 
+    def test_hot_queries_use_index(self):
+        ts = create_basic_domain()
+        tenants = ts.get_table('tenants')
+        crits = [
+            {'tier_name': 'UNITTEST', 'tenant_name': 'dg-unittest-product'},
+            {'tenant_name': 'dg-unittest-product'},
+            {'tier_name': 'UNITTEST', 'deployable_name': 'drift-base', 'state': 'active'},
+        ]
+        for crit in crits:
+            self.assertEqual(tenants.explain(crit)['access_path'], 'index')
+            self.assertEqual(len(tenants.find(crit)), 1)
+
+        self.assertEqual(ts.get_table('tenant-names').explain({'alias': 'x'})['index_type'], 'unique')
+
+    def test_get_drift_config_fetch_rows(self):
+        ts = create_basic_domain()
+        ts.get_table('tiers').add({'tier_name': 'LIVE', 'is_live': True})
+        ts.get_table('deployables').add({'tier_name': 'LIVE', 'deployable_name': 'drift-base', 'is_active': True})
+        for tier_name, tenant_name in ('UNITTEST', 'dg-other-product'), ('LIVE', 'dg-live-product'):
+            ts.get_table('tenant-names').add({
+                'tenant_name': tenant_name,
+                'product_name': 'dg-unittest-product',
+                'tier_name': tier_name,
+                'organization_name': 'directivegames',
+                })
+            ts.get_table('tenants').add({
+                'tier_name': tier_name,
+                'deployable_name': 'drift-base',
+                'tenant_name': tenant_name,
+                'state': 'active',
+                })
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        loaded = []
+        load_data = b.load_data
+        b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+
+        # Only the row files of the tenants on the tier are fetched, and no other table is
+        # loaded in full.
+        fetch_ts = b.load_table_store(fetch_rows=True)
+        conf = get_drift_config(
+            ts=fetch_ts, tenant_name='dg-unittest-product', tier_name='UNITTEST', deployable_name='drift-base')
+        self.assertEqual(conf.tenant['tenant_name'], 'dg-unittest-product')
+        self.assertEqual(sorted(row['tenant_name'] for row in conf.tenants), ['dg-other-product', 'dg-unittest-product'])
+        self.assertEqual(sorted(f for f in loaded if f.startswith('tenants/tenants.')), [
+            'tenants/tenants.UNITTEST.dg-other-product.json',
+            'tenants/tenants.UNITTEST.dg-unittest-product.json',
+        ])
+        self.assertIsNotNone(fetch_ts.get_table('tenants')._row_fetch)
+
 
 class TestPushPull(unittest.TestCase):
 
+    def test_pull_legacy_checksums(self):
+        # Pulling to a store saved by an older version, which calculated checksums differently,
+        # from an origin saved by it as well.
+        tmpdirname = tempfile.mkdtemp()
+        try:
+            local_ts = create_basic_domain()
+            local_ts.get_table('domain').get()['origin'] = 'file://' + tmpdirname
+            local_ts.refresh_metadata()
+            backend = create_backend('file://' + tmpdirname)
+            backend.save_table_store(local_ts, file_format='json')
+            legacy = hashlib.sha256()
+            for table_meta in local_ts.meta['tables']:
+                files = local_ts.get_table(table_meta['table_name'])._get_files('pretty')
+                table_meta['md5'] = hashlib.sha256(b''.join(files.values())).hexdigest()
+                del table_meta['checksum_type']
+                legacy.update(table_meta['md5'].encode('ascii'))
+            local_ts.meta.get()['checksum'] = legacy.hexdigest()
+            local_ts.meta.save(backend.save_data)
+
+            local_ts = backend.load_table_store()
+            result = pull_from_origin(local_ts)
+            self.assertEqual(result['reason'], 'pull_skipped_crc_match')
+            self.assertEqual(['merkle'], list(set(m['checksum_type'] for m in local_ts.meta['tables'])))
+        finally:
+            shutil.rmtree(tmpdirname)
+
+    def test_pull_not_modified(self):
+        try:
+            from botocore.stub import Stubber
+            from botocore.response import StreamingBody
+        except ImportError:
+            self.skipTest("boto3 not installed")
+
+        # Pulls load the origin lazily. Pickles are loaded in full and json tables only if
+        # they differ from the local ones, which they don't here.
+        formats = {
+            'pickle': ['table-store.pickle'],
+            'json': ['table-store.pickle', '#tsdef.json', '#tsmeta.json'],
+        }
+        for file_format, file_names in formats.items():
+            local_ts = create_basic_domain()
+            origin = 's3://relib-test/pull-{}?region=eu-west-1'.format(file_format)
+            local_ts.get_table('domain').get()['origin'] = origin
+            local_ts.refresh_metadata()
+            b = DictBackend()
+            b.save_table_store(local_ts, file_format=file_format)
+
+            # Each pull creates a backend for the origin, and they share the caches of the first one.
+            backend = create_backend(origin)
+            self.assertIs(backend, create_backend(origin))
+            stubber = Stubber(backend.s3_client)
+            keys = [{'Bucket': 'relib-test', 'Key': 'pull-{}/{}'.format(file_format, name)} for name in file_names]
+            for file_name, key in zip(file_names, keys):
+                data = b.storage[file_name]
+                body = StreamingBody(six.BytesIO(data), len(data))
+                stubber.add_response('get_object', {'ETag': '"{}"'.format(file_name), 'Body': body}, key)
+            for file_name, key in zip(file_names, keys):
+                expected_params = dict(key, IfNoneMatch='"{}"'.format(file_name))
+                stubber.add_client_error('get_object', http_status_code=304, expected_params=expected_params)
+            with stubber:
+                first = pull_from_origin(local_ts, force=True)
+                second = pull_from_origin(local_ts, force=True)
+                stubber.assert_no_pending_responses()
+
+            # Cached table stores are returned as a copy.
+            self.assertIsNot(first['table_store'], second['table_store'])
+            second['table_store'].get_table('tenants').remove(
+                {'tier_name': 'UNITTEST', 'deployable_name': 'drift-base', 'tenant_name': 'dg-unittest-product'})
+            self.assertTrue(first['table_store'].get_table('tenants').find())
+
     @unittest.skip('')
     def test_ts_transaction(self):
 
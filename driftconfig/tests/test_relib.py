@@ -1,15 +1,22 @@
 # -*- coding: utf-8 -*-
 import unittest
 import json
+import copy
 import tempfile
 import shutil
+import pickle
+import threading
+import sys
+import time
+import hashlib
 
 from click import echo
 import six
 
 import jsonschema
 
-from driftconfig.relib import TableStore, Table, TableError, ConstraintError, DictBackend
+from driftconfig import relib
+from driftconfig.relib import TableStore, Table, TableError, ConstraintError, IntegrityError, DictBackend
 from driftconfig.backends import FileBackend
 
 
@@ -287,6 +294,20 @@ class TestRelib(unittest.TestCase):
 
         self.assertIn("Schema check failed", str(context.exception))
 
+        # The validator is compiled once and reused, and recompiled after a round trip
+        # through the definition or pickling.
+        validator = table._schema_validator
+        table.add({'id': 124})
+        self.assertIs(validator, table._schema_validator)
+        for table_check in [
+            pickle.loads(pickle.dumps(ts, protocol=2)).get_table('test-table'),
+            Table('test-table', ts, json.loads(ts.get_definition())['_tables']['test-table']),
+        ]:
+            self.assertIsNone(table_check._schema_validator)
+            with self.assertRaises(jsonschema.ValidationError) as context:
+                table_check.add({'id': 125, 'a_pattern': 'not conforming'})
+            self.assertIsNotNone(table_check._schema_validator)
+
     def test_integrity_check(self):
         ts = make_store(populate=True)
         ts.check_integrity()
@@ -302,6 +323,370 @@ class TestRelib(unittest.TestCase):
             DictBackend().save_table_store(ts)
             self.assertIn("foreign key record in 'continents' not found", str(context.exception))
 
+    def test_add_many(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+        countries.add_schema({'type': 'object', 'properties': {'name': {'type': 'string'}}})
+        rows_before = dict(countries._rows)
+
+        # All violations are reported together and the table is left unchanged.
+        with self.assertRaises(IntegrityError) as context:
+            countries.add_many([
+                {'country_code': 'cn', 'name': 'China', 'continent_id': 2},
+                {'country_code': 'jp', 'name': 'Japan again', 'continent_id': 2},  # PK violation
+                {'country_code': 'kr', 'name': 'Vietnam', 'continent_id': 2},  # Unique violation
+                {'country_code': 'au', 'name': 'Australia', 'continent_id': 5},  # FK violation
+                {'country_code': 'nz', 'name': 'New Zealand', 'continent_id': 5},  # FK violation
+                {'country_code': 'eg', 'name': 123, 'continent_id': 1},  # Schema violation
+            ])
+        self.assertEqual(5, len(context.exception.errors))
+        self.assertIn("Primary key violation", str(context.exception))
+        self.assertIn("Unique constraint violation", str(context.exception))
+        self.assertIn("foreign key record in 'continents' not found", str(context.exception))
+        self.assertIn("Schema check failed", str(context.exception))
+        self.assertEqual(rows_before, countries._rows)
+        self.assertEqual([], countries.find({'continent_id': 5}))
+        self.assertEqual(['vn'], [r['country_code'] for r in countries.find({'name': 'Vietnam'})])
+
+        # Collect violations instead of raising.
+        errors = []
+        countries.add_many([{'country_code': 'au', 'name': 'Australia', 'continent_id': 5}], errors=errors)
+        self.assertEqual(1, len(errors))
+        self.assertIsNotNone(countries.get({'country_code': 'au'}))
+        countries.remove({'country_code': 'au'})
+
+        rows = countries.add_many([
+            {'country_code': 'cn', 'name': 'China', 'continent_id': 2},
+            {'country_code': 'no', 'name': 'Norway', 'continent_id': 3},
+        ])
+        self.assertIs(rows[0], countries.get({'country_code': 'cn'}))
+        self.assertEqual(rows, countries.add_many([], defer_checks=False) + rows)
+
+        # Loading a table store reports violations from all tables together.
+        ts.get_table('continents').remove({'continent_id': 1})
+        ts.get_table('continents').remove({'continent_id': 2})
+        with self.assertRaises(IntegrityError) as context:
+            ts.check_integrity()
+        self.assertEqual(6, len(context.exception.errors))
+
+    def test_integrity_switches(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+        dupe = {'country_code': 'jp', 'name': 'Japan again', 'continent_id': 2}
+
+        with relib.integrity(pk=False, unique=False) as checks:
+            self.assertNotIn('pk', checks)
+            self.assertIn('fk', checks)
+            with relib.integrity(False):
+                self.assertEqual([], relib.get_integrity_checks())
+            self.assertEqual(checks, relib.get_integrity_checks())
+
+            # Other threads see the process wide defaults.
+            seen = []
+            t = threading.Thread(target=lambda: seen.append(relib.get_integrity_checks()))
+            t.start()
+            t.join()
+            self.assertEqual([relib.INTEGRITY_CHECKS], seen)
+
+            countries.add(dupe, check_only=True)
+
+        self.assertEqual(relib.INTEGRITY_CHECKS, relib.get_integrity_checks())
+        self.assertRaises(ConstraintError, countries.add, dupe, check_only=True)
+        countries.add(dupe, check_only=True, checks=['fk'])
+
+        # update() skips pk checks without touching the switches.
+        countries.update(dupe)
+        self.assertEqual(relib.INTEGRITY_CHECKS, relib.CHECK_INTEGRITY)
+
+        with self.assertRaises(relib.RelibError):
+            with relib.integrity(bogus=False):
+                pass
+
+    def test_locking(self):
+        ts = make_store(populate=True)
+        ts.set_locking(True)
+        countries = ts.get_table('countries')
+
+        # Locks are reentrant, but a read lock can't be upgraded.
+        with ts.write_locked():
+            with ts.read_locked():
+                countries.add({'country_code': 'cn', 'name': 'China', 'continent_id': 2})
+        with ts.read_locked():
+            self.assertEqual('China', countries.get({'country_code': 'cn'})['name'])
+            self.assertRaises(relib.RelibError, countries.remove, {'country_code': 'cn'})
+        countries.remove({'country_code': 'cn'})
+
+        # Concurrent readers and writers.
+        failures = []
+
+        def reader():
+            for i in range(200):
+                if len(countries.find({'continent_id': 1})) != 3:
+                    failures.append(i)
+
+        def writer():
+            for i in range(200):
+                with ts.write_locked():
+                    countries.add({'country_code': 'x{}'.format(i), 'name': 'X', 'continent_id': 1})
+                    countries.remove({'country_code': 'x{}'.format(i)})
+
+        threads = [threading.Thread(target=reader) for i in range(4)] + [threading.Thread(target=writer)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], failures)
+
+        # The lock is not part of the definition nor the pickle.
+        self.assertNotIn('_rwlock', json.loads(ts.get_definition()))
+        self.assertIsNone(pickle.loads(pickle.dumps(ts, protocol=2))._rwlock)
+
+    def test_lock_exclusive(self):
+        # Readers must never hold the lock at the same time as a writer. Readers take the lock
+        # without the internal mutex, so stall the writer whenever the lock looks free to a
+        # reader, to give readers a chance to slip in while the writer is acquiring the lock.
+        lock = relib.ReadWriteLock()
+        acquire_write = relib.ReadWriteLock.acquire_write.__code__
+        reading, writing, overlaps = [], [], []
+        done = threading.Event()
+
+        def stall(frame, event, arg):
+            if event == 'line' and lock._writer is None and not lock._writers_waiting:
+                time.sleep(0.002)
+            return stall
+
+        def tracer(frame, event, arg):
+            if frame.f_code is acquire_write:
+                return stall
+
+        def reader(pause):
+            while not done.is_set():
+                with lock.read_locked():
+                    reading.append(1)
+                    time.sleep(pause)
+                    if writing:
+                        overlaps.append('reader')
+                    reading.pop()
+                time.sleep(pause)
+
+        def writer():
+            sys.settrace(tracer)
+            try:
+                for i in range(25):
+                    with lock.write_locked():
+                        writing.append(1)
+                        if reading:
+                            overlaps.append('writer')
+                        time.sleep(0.0002)
+                        writing.pop()
+                    time.sleep(0.001)
+            finally:
+                sys.settrace(None)
+
+        readers = [threading.Thread(target=reader, args=(0.001 * i,)) for i in range(1, 5)]
+        for t in readers:
+            t.start()
+        t = threading.Thread(target=writer)
+        t.start()
+        t.join()
+        done.set()
+        for t in readers:
+            t.join()
+        self.assertEqual([], overlaps)
+
+    def test_freeze(self):
+        ts = make_store(populate=True)
+        ts.get_table('countries').get({'country_code': 'is'})['cities'] = [{'name': 'Reykjavik'}]
+        frozen = ts.freeze()
+        self.assertTrue(frozen.is_frozen)
+        self.assertFalse(ts.is_frozen)
+        countries = frozen.get_table('countries')
+
+        # Rows, nested values and the tables themselves are read-only.
+        row = countries.get({'country_code': 'is'})
+        self.assertIsInstance(row, relib.FrozenDict)
+        self.assertRaises(TypeError, row.__setitem__, 'name', 'Island')
+        self.assertRaises(TypeError, row['cities'].append, {'name': 'Akureyri'})
+        self.assertRaises(TypeError, row['cities'][0].update, {'name': 'Akureyri'})
+        self.assertRaises(TableError, countries.add, {'country_code': 'cn', 'name': 'China', 'continent_id': 2})
+        self.assertRaises(TableError, countries.remove, row)
+        self.assertRaises(TableError, frozen.add_table, 'cities')
+        self.assertRaises(TableError, DictBackend().save_table_store, frozen)
+
+        # Lookups work as before and are not affected by changes to the original.
+        ts.get_table('countries').remove({'country_code': 'jp'})
+        self.assertEqual('Japan', countries.get({'country_code': 'jp'})['name'])
+        self.assertEqual('index', countries.explain({'continent_id': 2})['access_path'])
+        self.assertEqual(2, len(countries.find({'continent_id': 2})))
+        continents = frozen.get_table('continents')
+        self.assertEqual(2, len(continents.find_references(continents.get({'continent_id': 2}))['countries']))
+
+        # Copies are modifiable and serialize like plain rows.
+        row_copy = copy.deepcopy(row)
+        row_copy['cities'].append({'name': 'Akureyri'})
+        self.assertEqual(json.dumps(ts.get_table('countries').get(row), sort_keys=True), json.dumps(row, sort_keys=True))
+        self.assertNotIn('_frozen', json.loads(frozen.get_definition()))
+
+        # Pickled snapshots stay frozen.
+        frozen = pickle.loads(pickle.dumps(frozen, protocol=2))
+        self.assertIsInstance(frozen.get_table('countries').get(row)['cities'], relib.FrozenList)
+        self.assertRaises(TableError, frozen.get_table('countries').update, row_copy)
+
+    def test_clone(self):
+        ts = make_store(populate=True)
+        clone = ts.clone()
+        clone2 = clone.clone()
+        countries = ts.get_table('countries')
+
+        # Rows are shared until a table is accessed.
+        self.assertIs(countries._rows, clone.get_table('countries')._rows)
+        self.assertIs(countries._rows, clone2.get_table('countries')._rows)
+
+        # Modifications in the original are not visible in the clones, and vice versa.
+        countries.get({'country_code': 'is'})['name'] = 'Island'
+        countries.remove({'country_code': 'jp'})
+        self.assertIsNot(countries._rows, clone.get_table('countries')._rows)
+        self.assertEqual('Iceland', clone.get_table('countries').get({'country_code': 'is'})['name'])
+        self.assertEqual('Iceland', clone2.get_table('countries').get({'country_code': 'is'})['name'])
+        self.assertEqual(2, len(clone.get_table('countries').find({'continent_id': 2})))
+
+        clone.get_table('continents').add({'continent_id': 4, 'name': 'Oceania'})
+        clone.get_table('continents').add_index('name')
+        self.assertIsNone(ts.get_table('continents').get({'continent_id': 4}))
+        self.assertEqual([], ts.get_table('continents')._indexes)
+        self.assertIsNotNone(clone.get_table('continents').get({'continent_id': 4}))
+        self.assertIsNone(clone2.get_table('continents').get({'continent_id': 4}))
+
+        # Foreign key lookups across tables in the clone.
+        clone.get_table('countries').add({'country_code': 'au', 'name': 'Australia', 'continent_id': 4})
+        refs = clone.get_table('continents').find_references({'continent_id': 4})
+        self.assertEqual(['au'], [row['country_code'] for row in refs['countries']])
+        self.assertRaises(ConstraintError, countries.add, {'country_code': 'au', 'name': 'Australia', 'continent_id': 4})
+
+        # A clone of a frozen table store is modifiable.
+        clone = ts.freeze().clone()
+        clone.get_table('countries').get({'country_code': 'is'})['name'] = 'Iceland'
+        self.assertEqual('Island', countries.get({'country_code': 'is'})['name'])
+        self.assertEqual(ts.get_definition(), clone.get_definition())
+
+    def test_checksum(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+        checksum = countries.get_checksum()
+        self.assertIs(checksum, countries.get_checksum())  # Cached
+
+        def fresh_checksum(ts):
+            b = DictBackend()
+            b.save_table_store(ts)
+            return b.load_table_store().get_table('countries').get_checksum()
+
+        # Only rows added, removed, touched or handed out are hashed again. The checksum stays
+        # the same if the rows handed out weren't modified in-place.
+        hashed = []
+        hash_row = relib._hash_row
+        relib._hash_row = lambda row: hashed.append(row) or hash_row(row)
+        try:
+            countries.get({'country_code': 'jp'})
+            self.assertIs(checksum, countries.get_checksum())
+            self.assertEqual(['Japan'], [row['name'] for row in hashed])
+            del hashed[:]
+
+            change_count = countries.change_count
+            countries.get({'country_code': 'is'})['name'] = 'Island'
+            self.assertNotEqual(checksum, countries.get_checksum())
+            self.assertEqual(['Island'], [row['name'] for row in hashed])
+
+            countries.add({'country_code': 'cn', 'name': 'China', 'continent_id': 2})
+            countries.remove({'country_code': 'jp'})
+            del hashed[:]
+            checksum = countries.get_checksum()
+            self.assertEqual(['China'], [row['name'] for row in hashed])
+            self.assertEqual(fresh_checksum(ts), checksum)
+            self.assertEqual(change_count + 2, countries.change_count)
+        finally:
+            relib._hash_row = hash_row
+
+        # In-place modification after the checksum was calculated needs touch().
+        row = countries.get({'country_code': 'cn'})
+        checksum = countries.get_checksum()
+        row['name'] = 'PRC'
+        self.assertEqual(checksum, countries.get_checksum())
+        countries.touch(row)
+        self.assertEqual(fresh_checksum(ts), countries.get_checksum())
+
+        # Refreshing meta data picks up the changes.
+        countries.get({'country_code': 'cn'})['name'] = 'China'
+        old, new = ts.refresh_metadata()
+        self.assertEqual(countries.get_checksum(), ts.get_table_metadata('countries')['md5'])
+        self.assertEqual(old['version'] + 1, new['version'])
+        old, new = ts.refresh_metadata()
+        self.assertEqual(old, new)
+
+    def test_legacy_checksums(self):
+        # Older versions used the sha256 of the table files in pretty Json format as checksum.
+        ts = make_store(populate=True)
+        ts.refresh_metadata()
+        legacy = hashlib.sha256()
+        for table_meta in ts.meta['tables']:
+            table = ts.get_table(table_meta['table_name'])
+            rows = sorted(table.find(), key=table._canonicalize_key)
+            table_meta['md5'] = hashlib.sha256(json.dumps(rows, indent=4, sort_keys=True).encode('ascii')).hexdigest()
+            del table_meta['checksum_type']
+            legacy.update(table_meta['md5'].encode('ascii'))
+        ts.meta.get()['checksum'] = legacy.hexdigest()
+
+        # Refreshing the meta data upgrades the checksums of tables that weren't modified, and
+        # doesn't report them as modified.
+        ts.get_table('countries').get({'country_code': 'is'})['name'] = 'Island'
+        old, new = ts.refresh_metadata()
+        self.assertEqual(
+            [('continents', 'merkle', False), ('countries', 'merkle', True)],
+            [(m['table_name'], m['checksum_type'], m['md5'] != o['md5']) for m, o in zip(new['tables'], old['tables'])]
+        )
+        self.assertEqual(ts.get_table('continents').get_checksum(), old['tables'][0]['md5'])
+        old, new = ts.refresh_metadata()
+        self.assertEqual(old, new)
+
+    def test_merkle_diff(self):
+        ts = TableStore()
+        table = ts.add_table('items')
+        table.add_primary_key('item_id')
+        for i in range(1000):
+            table.add({'item_id': i, 'name': 'item {}'.format(i)})
+        ts.refresh_metadata()
+        origin = ts.clone()
+
+        table.get({'item_id': 5})['name'] = 'modified'
+        table.remove({'item_id': 500})
+        table.add({'item_id': 1000, 'name': 'new'})
+
+        diff = relib.diff_tables(table, origin.get_table('items'))
+        self.assertEqual([{'item_id': 1000, 'name': 'new'}], diff['new_rows'])
+        self.assertEqual([{'item_id': 500, 'name': 'item 500'}], diff['deleted_rows'])
+        self.assertEqual([{'first': {'item_id': 5, 'name': 'modified'}, 'second': {'item_id': 5, 'name': 'item 5'}}],
+                         diff['modified_rows'])
+        self.assertEqual({'identical': True}, relib.diff_tables(origin.get_table('items'), origin.get_table('items')))
+
+        # The incrementally maintained Merkle root matches one calculated from scratch.
+        checksum = table.get_checksum()
+        table._reset_checksum()
+        self.assertEqual(checksum, table.get_checksum())
+
+        # Only the differing subtrees are visited.
+        visited = []
+        merkle_node = Table._merkle_node
+        Table._merkle_node = lambda self, prefix, lo, hi: visited.append(prefix) or merkle_node(self, prefix, lo, hi)
+        try:
+            list(table._merkle_diff(origin.get_table('items')))
+        finally:
+            Table._merkle_node = merkle_node
+        self.assertLess(len(visited), len(table._merkle_nodes) / 2)
+
+        # The store checksum is the root over all the tables.
+        old, new = ts.refresh_metadata()
+        diff = relib.diff_meta(new, origin.meta.get())
+        self.assertEqual(['items'], diff['modified_tables'])
+
     def test_find_references(self):
 
         ts = TableStore()
@@ -363,6 +748,19 @@ class TestRelib(unittest.TestCase):
         self.assertNotIn(t3r4, result['detail'])
         self.assertNotIn(t3r5, result['detail'])
 
+        # References are looked up through the foreign key index.
+        self.assertIn(('m1', 'm2'), t2._index_maps)
+        self.assertEqual({'middle': [t2r3], 'detail': [t3r3, t3r4, t3r5]}, t1.find_references({'master_id1': 2, 'master_id2': 'b'}))
+
+        # Check if rows can be removed. Rows referencing only themselves can.
+        self.assertFalse(t1.can_remove(t1r1))
+        self.assertTrue(t1.can_remove({'master_id1': 3, 'master_id2': 'c'}))
+        self.assertFalse(t3.can_remove(t3r1))
+        self.assertTrue(t3.can_remove(t3r4))
+        t3.remove(t3r2)
+        self.assertTrue(t3.can_remove(t3r1))
+        t3.add(t3r2)
+
         # Delete top row and expect problems
         t1.remove(t1r1)
         with self.assertRaises(TableError):
@@ -374,6 +772,194 @@ class TestRelib(unittest.TestCase):
                 ts.get_table(table_name).remove(row)
         ts.check_integrity()
 
+    def test_index(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+        countries.add_index('continent_id')
+        self.assertIn(('continent_id',), countries._index_maps)
+
+        # Index is built from current rows and used by find().
+        six.assertCountEqual(self, ['sd', 'ke', 'gn'], [r['country_code'] for r in countries.find({'continent_id': 1})])
+        self.assertEqual(['jp'], [r['country_code'] for r in countries.find({'continent_id': 2, 'name': 'Japan'})])
+        self.assertEqual([], countries.find({'continent_id': 2, 'name': 'Iceland'}))
+        self.assertEqual([], countries.find({'continent_id': 99}))
+
+        # Index is maintained by add, update and remove.
+        countries.add({'country_code': 'cn', 'name': 'China', 'continent_id': 2})
+        countries.update({'country_code': 'is', 'name': 'Iceland', 'continent_id': 2})
+        countries.remove({'country_code': 'jp'})
+        six.assertCountEqual(self, ['vn', 'cn', 'is'], [r['country_code'] for r in countries.find({'continent_id': 2})])
+        self.assertEqual([], countries.find({'continent_id': 3}))
+
+        # Removing a row whose indexed field was modified in-place leaves no trace in the index.
+        row = countries.get({'country_code': 'vn'})
+        row['continent_id'] = 3
+        countries.remove(row)
+        self.assertNotIn('vn', [r['country_code'] for r in countries.find({'continent_id': 2})])
+
+        # Index survives definition round trip and pickling, and is rebuilt on load.
+        storage = {}
+        DictBackend(storage).save_table_store(ts)
+        ts_check = DictBackend(storage).load_table_store()
+        self.assertEqual(countries.find({'continent_id': 2}), ts_check.get_table('countries').find({'continent_id': 2}))
+        self.assertNotIn('_index_maps', ts.get_definition())
+
+        ts_check = pickle.loads(pickle.dumps(ts, protocol=2))
+        self.assertEqual(countries.find({'continent_id': 1}), ts_check.get_table('countries').find({'continent_id': 1}))
+
+    def test_unique_index(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+
+        # Unique constraints are backed by a hash index on the constraint fields.
+        self.assertEqual(['jp'], list(countries._index_maps[('name',)][('Japan',)]))
+
+        with self.assertRaises(ConstraintError) as context:
+            countries.add({'country_code': 'xx', 'name': 'Japan', 'continent_id': 2})
+        self.assertIn("Unique constraint violation", str(context.exception))
+
+        # Values are released on update and remove.
+        countries.update({'country_code': 'jp', 'name': 'Nippon', 'continent_id': 2})
+        countries.add({'country_code': 'xx', 'name': 'Japan', 'continent_id': 2})
+        countries.remove({'country_code': 'xx'})
+        countries.add({'country_code': 'yy', 'name': 'Japan', 'continent_id': 2})
+        with self.assertRaises(ConstraintError):
+            countries.add({'country_code': 'zz', 'name': 'Nippon', 'continent_id': 2})
+
+        # Bulk loading with unique constraint.
+        table = ts.add_table('bulk')
+        table.add_primary_key('id')
+        table.add_unique_constraint('name')
+        for i in range(1000):
+            table.add({'id': i, 'name': 'name-{}'.format(i)})
+        self.assertEqual(1000, len(table._index_maps[('name',)]))
+        ts.check_integrity()
+
+    def test_index_in_place_edit(self):
+        ts = make_store(populate=True)
+        countries = ts.get_table('countries')
+
+        # Rows modified in-place are moved to the right index bucket on the next lookup.
+        countries.get({'country_code': 'jp'})['name'] = 'Nippon'
+        self.assertEqual(countries.find({'name': 'Japan'}), [])
+        self.assertEqual(countries.find({'name': 'Nippon'})[0]['country_code'], 'jp')
+        with self.assertRaises(ConstraintError):
+            countries.add({'country_code': 'xx', 'name': 'Nippon', 'continent_id': 2})
+        countries.add({'country_code': 'xx', 'name': 'Japan', 'continent_id': 2})
+
+        # Modifying a row after a later lookup requires touching it.
+        row = countries.find({'continent_id': 3})[0]
+        countries.find({'name': 'Kenya'})
+        row['name'] = 'Island'
+        countries.touch(row)
+        self.assertEqual(countries.find({'name': 'Island'}), [row])
+        with self.assertRaises(ConstraintError):
+            countries.add({'country_code': 'yy', 'name': 'Island', 'continent_id': 3})
+        ts.check_integrity()
+
+    def test_query_planner(self):
+        ts = TableStore()
+        table = ts.add_table('multikey')
+        table.add_primary_key('key1,key2,key3')
+        table.set_row_as_file(group_by='key1,key3')
+        table.add_index('tag')
+        for key1 in range(3):
+            for key2 in 'abc':
+                for key3 in range(4):
+                    table.add({'key1': key1, 'key2': key2, 'key3': key3, 'tag': key3 % 2})
+
+        def check(crit, access_path, index_fields=None, index_type=None, rows_examined=None):
+            plan = table.explain(crit)
+            self.assertEqual(access_path, plan['access_path'])
+            if index_fields:
+                self.assertEqual(index_fields, plan['index_fields'])
+                self.assertEqual(index_type, plan['index_type'])
+            if rows_examined is not None:
+                self.assertEqual(rows_examined, plan['rows_examined'])
+            # Make sure the plan yields the same result as a full scan.
+            expected = [r for r in table.find() if all(r.get(k) == v for k, v in crit.items())]
+            six.assertCountEqual(self, expected, table.find(crit))
+
+        check({}, 'full_scan', rows_examined=36)
+        check({'key2': 'a'}, 'full_scan', rows_examined=36)
+        check({'key1': 1, 'key2': 'b', 'key3': 2}, 'primary_key', rows_examined=1)
+        check({'key1': 1, 'key2': 'b', 'key3': 2, 'tag': 1}, 'primary_key', rows_examined=1)
+        check({'key1': 1, 'key2': 'b', 'key3': 9}, 'primary_key', rows_examined=0)
+        check({'key1': 1, 'key2': 'no good', 'key3': 2}, 'primary_key', rows_examined=0)
+        check({'key1': 1}, 'index', ['key1'], 'primary_key_prefix', 12)
+        check({'key1': 1, 'key2': 'c'}, 'index', ['key1', 'key2'], 'primary_key_prefix', 4)
+        check({'key1': 1, 'key3': 0}, 'index', ['key1', 'key3'], 'group_by_prefix', 3)
+        check({'tag': 0}, 'index', ['tag'], 'secondary', 18)
+        # The most selective index wins.
+        check({'key1': 2, 'tag': 1}, 'index', ['key1'], 'primary_key_prefix', 12)
+        check({'key1': 2, 'key2': 'a', 'tag': 1}, 'index', ['key1', 'key2'], 'primary_key_prefix', 4)
+
+        # Prefix indexes are maintained on remove.
+        table.remove({'key1': 1, 'key2': 'c', 'key3': 3})
+        check({'key1': 1, 'key2': 'c'}, 'index', ['key1', 'key2'], 'primary_key_prefix', 3)
+
+    def test_identity_sequence(self):
+        ts = make_store(populate=True)
+        table = ts.add_table('identity')
+        table.add_primary_key('id')
+        table.add_default_values({'id': '@@identity'})
+
+        self.assertEqual(1, table.add({})['id'])
+        self.assertEqual(2, table.add({})['id'])
+        self.assertEqual(10, table.add({'id': 10})['id'])
+        self.assertEqual(11, table.add({})['id'])
+
+        # Values are not reissued after delete.
+        table.remove({'id': 11})
+        self.assertEqual(12, table.add({})['id'])
+        table.remove({'id': 12})
+
+        # The sequence is stored in the table meta data and survives serialization.
+        storage = {}
+        DictBackend(storage).save_table_store(ts)
+        self.assertEqual({'id': 12}, ts.get_table_metadata('identity')['sequences'])
+        ts_check = DictBackend(storage).load_table_store()
+        self.assertEqual(13, ts_check.get_table('identity').add({})['id'])
+        ts_check = pickle.loads(pickle.dumps(ts, protocol=2))
+        self.assertEqual(13, ts_check.get_table('identity').add({})['id'])
+        self.assertNotIn('_sequences', ts.get_definition())
+
+    def test_canonicalize_key(self):
+        table = Table('test-canonical')
+        table.add_primary_key('pk1,pk2')
+        self.assertEqual('a.1', table._canonicalize_key({'pk1': 'a', 'pk2': 1, 'other': 'x'}))
+        self.assertEqual({'a', '1'}, table._valid_key_values)
+
+        with self.assertRaises(ConstraintError) as context:
+            table._canonicalize_key({'pk1': 'a', 'pk2': 'no good'})
+        self.assertIn("didn't match pattern", str(context.exception))
+        with self.assertRaises(TableError) as context:
+            table._canonicalize_key({'pk1': 'a'})
+        self.assertIn("can't make primary key", str(context.exception))
+
+        # Keys made of strings are cached, keys of other values are only validated.
+        for i in range(2):
+            self.assertEqual('a.b', table._canonicalize_key({'pk1': 'a', 'pk2': 'b'}))
+            self.assertEqual('1.b', table._canonicalize_key({'pk1': 1, 'pk2': 'b'}))
+            self.assertEqual('True.b', table._canonicalize_key({'pk1': True, 'pk2': 'b'}))
+
+        # Canonicalizers are rebuilt when the key definition changes.
+        table.set_row_as_file(group_by='pk2')
+        self.assertEqual('x', table._canonicalize_key({'pk1': 'a', 'pk2': 'x'}, use_group_by=True))
+        table.add_primary_key('pk2')
+        self.assertEqual(1, table._canonicalize_key({'pk1': 'a', 'pk2': 1}))
+
+        # The cache of valid key values is bounded.
+        table.VALID_KEY_CACHE_SIZE = 10
+        table._build_canonicalizers()
+        for i in range(25):
+            table._canonicalize_key({'pk2': 'key{}'.format(i)})
+        self.assertLessEqual(len(table._valid_key_values), 10)
+
+        # Canonicalizers survive pickling.
+        table = pickle.loads(pickle.dumps(table, protocol=2))
+        self.assertEqual('b', table._canonicalize_key({'pk2': 'b'}))
+
     def test_serialization_filenames(self):
         table = Table('test-filename')
         table.add_primary_key('pk')
@@ -451,6 +1037,520 @@ class TestRelib(unittest.TestCase):
             table_check.load(lambda file_name: storage[file_name])
             self.assertEqual(table_orig._rows, table_check._rows)
 
+    def test_json_profiles(self):
+        # Compact and pretty Json yields the same data and the same checksums.
+        tmpdirname = tempfile.mkdtemp()
+        try:
+            for row_as_file in False, True:
+                ts = make_store(populate=True, row_as_file=row_as_file)
+                compact, pretty = DictBackend(), DictBackend()
+                pretty.json_profile = 'pretty'
+                compact.save_table_store(ts)
+                compact_meta = json.loads(compact.storage['#tsmeta.json'].decode('ascii'))
+                pretty.save_table_store(ts)
+                pretty_meta = json.loads(pretty.storage['#tsmeta.json'].decode('ascii'))
+                FileBackend(tmpdirname).save_table_store(ts, file_format='json')
+                file_ts = FileBackend(tmpdirname).load_table_store()
+
+                self.assertEqual(compact_meta['checksum'], pretty_meta['checksum'])
+                self.assertEqual(compact_meta['checksum'], file_ts.meta['checksum'])
+                for file_name, data in compact.storage.items():
+                    if file_name.endswith('.json') and not file_name.startswith('#'):
+                        self.assertNotIn(b'\n', data)
+                        self.assertLess(len(data), len(pretty.storage[file_name]))
+                        self.assertEqual(json.loads(data.decode('ascii')), json.loads(pretty.storage[file_name].decode('ascii')))
+                for table_name in ts.tables:
+                    self.assertEqual(ts.get_table(table_name)._rows, file_ts.get_table(table_name)._rows)
+        finally:
+            shutil.rmtree(tmpdirname)
+
+    def test_snapshot(self):
+        # Snapshot roundtrip yields the same data, metadata and sequences.
+        for row_as_file in False, True:
+            ts = make_store(populate=True, row_as_file=row_as_file)
+            b = DictBackend()
+            b.save_table_store(ts, file_format='snapshot')
+            blob = b.storage[b.pickle_filename]
+            self.assertTrue(blob.startswith(relib.SNAPSHOT_MAGIC))
+            self.assertEqual(list(b.storage), [b.pickle_filename])
+            self.assertNotIn(b'cdriftconfig', blob)  # No pickled objects.
+
+            snap_ts = b.load_table_store()
+            self.assertEqual(list(snap_ts.tables), list(ts.tables))
+            for table_name in ts.tables:
+                self.assertEqual(ts.get_table(table_name)._rows, snap_ts.get_table(table_name)._rows)
+                self.assertEqual(ts.get_table(table_name)._sequences, snap_ts.get_table(table_name)._sequences)
+            self.assertEqual(snap_ts.meta['checksum'], ts.meta['checksum'])
+            snap_ts._origin = ts._origin
+            self.assertEqual(snap_ts.get_snapshot(), blob)
+
+            # Switching back to json replaces the snapshot.
+            b.save_table_store(ts, file_format='json')
+            self.assertEqual(b.storage[b.pickle_filename], b'')
+            self.assertEqual(b.load_table_store().meta['checksum'], ts.meta['checksum'])
+
+        # Integrity violations are reported when loading.
+        ts = make_store(populate=True)
+        ts.get_table('countries').add({'country_code': 'xx', 'continent_id': 99}, checks=[])
+        b = DictBackend()
+        b.save_table_store(ts, run_integrity_check=False, file_format='snapshot')
+        self.assertRaises(IntegrityError, b.load_table_store)
+        with relib.integrity(False):
+            b.load_table_store()
+
+        # Anything else is rejected.
+        blob = b.storage[b.pickle_filename]
+        for bad in b'RELIBSNP', blob[:8] + b'\x00\x01' + blob[10:], blob[:8] + b'\x00\x03' + blob[10:], blob[:-10]:
+            self.assertRaises(relib.RelibError, TableStore().init_from_snapshot, bad)
+
+        # The toc entries must lie between the header and the toc, and not overlap.
+        ts = make_store(populate=True)
+        blob = ts.get_snapshot()
+
+        def make_snapshot(toc, data):
+            toc_data = json.dumps(toc).encode("ascii")
+            toc_offset = relib._SNAPSHOT_HEADER.size + len(data)
+            header = relib._SNAPSHOT_HEADER.pack(relib.SNAPSHOT_MAGIC, relib.SNAPSHOT_VERSION, toc_offset, len(toc_data))
+            return header + data + toc_data
+
+        toc = relib._read_snapshot_toc(blob)
+        data = blob[relib._SNAPSHOT_HEADER.size:relib._SNAPSHOT_HEADER.unpack_from(blob)[2]]
+        TableStore().init_from_snapshot(make_snapshot(toc, data))
+        name, offset, length = toc['tables'][-1]
+        bad_tocs = [dict(toc, tables=toc['tables'][:-1] + [entry]) for entry in [
+            [name, offset, length + 1], [name, offset - 1, length], [name, -1, length], [name, offset, '1'],
+            [name, offset], toc['tables'][0]]]
+        bad_tocs += [dict(toc, tables=None), {'tables': toc['tables']}]
+        for bad_toc in bad_tocs:
+            self.assertRaises(relib.RelibError, TableStore().init_from_snapshot, make_snapshot(bad_toc, data))
+
+    def test_lazy_load(self):
+        # Only the definition and meta data are loaded up front.
+        for file_format in 'json', 'snapshot':
+            ts = make_store(populate=True, row_as_file=True)
+            b = DictBackend()
+            b.save_table_store(ts, file_format=file_format)
+            loaded = []
+            load_data = b.load_data
+            b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+
+            lazy_ts = b.load_table_store(lazy=True)
+            if file_format == 'json':
+                self.assertEqual(set(loaded), {b.pickle_filename, '#tsdef.json', '#tsmeta.json'})
+            self.assertIsNotNone(lazy_ts._tables['countries']._pending_load)
+            self.assertEqual(lazy_ts._tables['countries']._rows, {})
+
+            # Tables are loaded on first access, along with tables they refer to.
+            continents = lazy_ts.get_table('continents')
+            self.assertEqual(continents._rows, ts.get_table('continents')._rows)
+            self.assertIsNotNone(lazy_ts._tables['countries']._pending_load)
+            self.assertEqual(len(lazy_ts.tables['countries'].find()), 6)
+            self.assertIsNone(lazy_ts._tables['countries']._pending_load)
+            lazy_ts = b.load_table_store(lazy=True)
+            self.assertFalse(lazy_ts.get_table('continents').can_remove({'continent_id': 1}))
+            lazy_ts = b.load_table_store(lazy=True)
+            countries = lazy_ts.get_table('countries')
+            self.assertEqual(countries._rows, ts.get_table('countries')._rows)
+            self.assertIsNone(lazy_ts._tables['continents']._pending_load)
+
+            # Saving and pickling loads all tables.
+            lazy_ts = b.load_table_store(lazy=True)
+            copy_ts = pickle.loads(pickle.dumps(lazy_ts))
+            for table_name in ts.tables:
+                self.assertEqual(copy_ts.get_table(table_name)._rows, ts.get_table(table_name)._rows)
+            lazy_ts = b.load_table_store(lazy=True)
+            DictBackend().save_table_store(lazy_ts)
+            self.assertIsNone(lazy_ts._pending_load)
+            self.assertEqual(lazy_ts.meta['checksum'], ts.meta['checksum'])
+
+        # Integrity violations are reported when the table is loaded, using the integrity
+        # checks in effect when the table store was loaded.
+        ts = make_store(populate=True)
+        ts.get_table('countries').add({'country_code': 'xx', 'continent_id': 99}, checks=[])
+        b = DictBackend()
+        b.save_table_store(ts, run_integrity_check=False, file_format='snapshot')
+        lazy_ts = b.load_table_store(lazy=True)
+        self.assertRaises(IntegrityError, lazy_ts.get_table, 'countries')
+        with relib.integrity(False):
+            lazy_ts = b.load_table_store(lazy=True)
+
+        # Lazy loading works while holding the read lock.
+        lazy_ts.set_locking(True)
+        with lazy_ts.read_locked():
+            self.assertIsNotNone(lazy_ts.get_table('countries').get({'country_code': 'xx'}))
+
+        # A table that doesn't match the checksum in the meta data is loaded once more, in case
+        # it was saved in between, and rejected if it still doesn't match.
+        ts = make_store(populate=True)
+        b = DictBackend()
+        b.save_table_store(ts)
+        file_name = ts.get_table('countries').get_filename()
+        ts.get_table('countries').update({'country_code': 'is', 'name': 'Island', 'continent_id': 3})
+        stale = [ts.get_table('countries')._get_files()[file_name]]
+        load_data = b.load_data
+        b.load_data = lambda name: stale.pop() if name == file_name and stale else load_data(name)
+        lazy_ts = b.load_table_store(lazy=True)
+        self.assertEqual(lazy_ts.get_table('countries').get({'country_code': 'is'})['name'], 'Iceland')
+        self.assertEqual(stale, [])
+
+        b.storage[file_name] = ts.get_table('countries')._get_files()[file_name]
+        lazy_ts = b.load_table_store(lazy=True)
+        self.assertRaises(relib.RelibError, lazy_ts.get_table, 'countries')
+
+        # Checksums saved by older versions are not comparable, so they are not verified.
+        for table_meta in lazy_ts.meta['tables']:
+            del table_meta['checksum_type']
+        self.assertEqual(lazy_ts.get_table('countries').get({'country_code': 'is'})['name'], 'Island')
+
+    def test_load_subset(self):
+        # Only the named tables and the tables they refer to are loaded.
+        ts = make_store(populate=True)
+        languages = ts.add_table('languages')
+        languages.add_primary_key('language_id')
+        languages.add({'language_id': 'is'})
+
+        for file_format in 'json', 'pickle', 'snapshot':
+            b = DictBackend()
+            b.save_table_store(ts, file_format=file_format)
+            loaded = []
+            load_data = b.load_data
+            b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+
+            for lazy in False, True:
+                del loaded[:]
+                partial_ts = b.load_table_store(lazy=lazy, tables=['countries'])
+                self.assertEqual(sorted(partial_ts.tables), ['continents', 'countries'])
+                self.assertEqual(partial_ts.get_table('countries')._rows, ts.get_table('countries')._rows)
+                self.assertEqual(partial_ts.get_table('continents')._rows, ts.get_table('continents')._rows)
+                if file_format == 'json':
+                    self.assertEqual(sorted(loaded), [
+                        '#tsdef.json', '#tsmeta.json', 'continents.json', 'countries.json', b.pickle_filename])
+                self.assertEqual(list(b.load_table_store(lazy=lazy, tables=['languages']).tables), ['languages'])
+
+            self.assertRaises(TableError, b.load_table_store, tables=['cities'])
+            self.assertRaises(RuntimeError, b.save_table_store, partial_ts)
+            self.assertRaises(RuntimeError, partial_ts.refresh_metadata)
+
+        # Rows in tables that were not loaded don't count as references.
+        self.assertTrue(b.load_table_store(tables=['continents']).get_table('continents').can_remove({'continent_id': 1}))
+
+    def test_fetch_rows(self):
+        ts = make_store(populate=True, row_as_file=True)
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        loaded = []
+        load_data = b.load_data
+        b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+
+        # Only the index is loaded up front.
+        fetch_ts = b.load_table_store(fetch_rows=True)
+        countries = fetch_ts.get_table('countries')
+        countries.ROW_CACHE_SIZE = 2
+        self.assertIn('countries/#.countries.json', loaded)
+        self.assertEqual([f for f in loaded if f.startswith('countries/countries.')], [])
+        self.assertEqual(countries._rows, {})
+
+        # Row files are fetched by get() and find() and the most recently used ones are kept.
+        del loaded[:]
+        self.assertEqual(countries.get({'country_code': 'is'})['name'], 'Iceland')
+        self.assertEqual(countries.find({'country_code': 'is', 'continent_id': 3})[0]['name'], 'Iceland')
+        self.assertEqual(countries.find({'country_code': 'is', 'continent_id': 1}), [])
+        self.assertIsNone(countries.get({'country_code': 'xx'}))
+        self.assertEqual(countries.get_foreign_row({'country_code': 'jp'}, 'continents')['name'], 'Asia')
+        self.assertEqual(loaded, ['countries/countries.is.json', 'countries/countries.jp.json'])
+        countries.get({'country_code': 'ke'})
+        countries.get({'country_code': 'is'})
+        self.assertEqual(list(countries._row_cache), ['ke', 'is'])
+        self.assertEqual(loaded.count('countries/countries.is.json'), 2)
+        self.assertEqual(countries._rows, {})
+
+        # The fetched rows are frozen.
+        self.assertRaises(TypeError, countries.get({'country_code': 'is'}).update, {'name': 'Island'})
+        self.assertEqual(countries._rows, {})
+
+        # A row file deleted by a later save is a missing row, and it's not fetched again.
+        def load_data_deleted(file_name):
+            if file_name == 'countries/countries.jp.json':
+                raise relib.BackendFileNotFound(file_name)
+            return load_data(file_name)
+
+        b.load_data = load_data_deleted
+        self.assertIsNone(countries.get({'country_code': 'jp'}))
+        self.assertNotIn('jp', countries._row_groups)
+        b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+        self.assertIsNone(countries.get({'country_code': 'jp'}))
+
+        # Anything else loads the table in full.
+        self.assertEqual(len(countries.find({'continent_id': 1})), 3)
+        self.assertIsNone(countries._row_cache)
+        self.assertEqual(countries._rows, ts.get_table('countries')._rows)
+
+        fetch_ts = b.load_table_store(fetch_rows=True)
+        fetch_ts.get_table('countries').get({'country_code': 'is'})
+        DictBackend().save_table_store(fetch_ts)
+        self.assertEqual(fetch_ts.meta['checksum'], ts.meta['checksum'])
+        self.assertEqual(fetch_ts.get_table('countries')._rows, ts.get_table('countries')._rows)
+
+        # Modifying the table loads it in full as well.
+        countries = b.load_table_store(fetch_rows=True).get_table('countries')
+        countries.add({'country_code': 'dk', 'continent_id': 1})
+        self.assertIsNone(countries._row_cache)
+        self.assertEqual(len(countries._rows), len(ts.get_table('countries')._rows) + 1)
+
+        # Grouped rows.
+        ts = TableStore()
+        multi = ts.add_table('multikey')
+        multi.add_primary_key('key1,key2')
+        multi.set_row_as_file(group_by='key1')
+        multi.add_many([{'key1': k1, 'key2': k2} for k1 in range(3) for k2 in range(3)])
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        multi = b.load_table_store(fetch_rows=True).get_table('multikey')
+        self.assertEqual(multi.find({'key1': 1}), ts.get_table('multikey').find({'key1': 1}))
+        self.assertEqual(multi.get({'key1': 2, 'key2': 1}), {'key1': 2, 'key2': 1})
+        self.assertEqual(list(multi._row_cache), [1, 2])
+
+        # Only the row files of matching groups are fetched if some of the group by fields are
+        # in the search criteria.
+        ts = TableStore()
+        multi = ts.add_table('multikey')
+        multi.add_primary_key('key1,key2,key3')
+        multi.set_row_as_file(group_by='key1,key2')
+        multi.add_many([{'key1': k1, 'key2': k2, 'key3': k3} for k1 in range(3) for k2 in range(3) for k3 in range(2)])
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        loaded = []
+        load_data = b.load_data
+        b.load_data = lambda file_name: loaded.append(file_name) or load_data(file_name)
+        multi = b.load_table_store(fetch_rows=True).get_table('multikey')
+        del loaded[:]
+        self.assertEqual(multi.find({'key2': 1, 'key3': 0}), ts.get_table('multikey').find({'key2': 1, 'key3': 0}))
+        self.assertEqual(sorted(loaded), ['multikey.0.1.json', 'multikey.1.1.json', 'multikey.2.1.json'])
+        self.assertEqual(multi.find({'key1': 3}), [])
+        self.assertEqual(multi._rows, {})
+
+        # Row files are fetched without holding the load lock. Threads that need a row file
+        # which is being fetched wait for it.
+        ts = make_store(populate=True, row_as_file=True)
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        countries = b.load_table_store(fetch_rows=True).get_table('countries')
+        fetching, release, loaded = threading.Event(), threading.Event(), []
+        load_data = b.load_data
+
+        def slow_load_data(file_name):
+            loaded.append(file_name)
+            if file_name == 'countries/countries.is.json':
+                fetching.set()
+                release.wait()
+            return load_data(file_name)
+
+        b.load_data = slow_load_data
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(countries.get({'country_code': 'is'})))
+                   for i in range(3)]
+        threads[0].start()
+        fetching.wait()
+        for thread in threads[1:]:
+            thread.start()
+        self.assertEqual(countries.get({'country_code': 'jp'})['name'], 'Japan')
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([row['name'] for row in results], ['Iceland'] * 3)
+        self.assertEqual(loaded.count('countries/countries.is.json'), 1)
+
+    def test_parallel_fetch(self):
+        # Row files fetched by a thread pool are inserted in the same order as serially.
+        ts = make_store(populate=True, row_as_file=True)
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        threads = set()
+        load_data = b.load_data
+        b.load_data = lambda file_name: threads.add(threading.current_thread()) or load_data(file_name)
+
+        serial_ts = b.load_table_store()
+        self.assertEqual(len(threads), 1)
+        b.fetch_workers = 4
+        parallel_ts = b.load_table_store()
+        self.assertGreater(len(threads), 1)
+        for table_name in ts.tables:
+            self.assertEqual(list(parallel_ts.get_table(table_name)._rows.items()),
+                             list(serial_ts.get_table(table_name)._rows.items()))
+
+        # Each thread decodes the files it fetched, also when loading a single table.
+        decoded = set()
+        jsonloads = relib.jsonloads
+        relib.jsonloads = lambda text, file_name: decoded.add(threading.current_thread()) or jsonloads(text, file_name)
+        try:
+            table_check = make_store(populate=False, row_as_file=True).get_table('countries')
+            with relib.integrity(False):
+                table_check.load(b.load_data, workers=4)
+        finally:
+            relib.jsonloads = jsonloads
+        self.assertGreater(len(decoded), 1)
+        self.assertEqual(list(table_check._rows.items()), list(serial_ts.get_table('countries')._rows.items()))
+
+        del b.storage['countries/countries.is.json']
+        self.assertRaises(KeyError, b.load_table_store)
+
+    def test_batch_io(self):
+        # Tables are loaded and saved using a few batches instead of a request per file.
+        class BatchBackend(DictBackend):
+            def load_many(self, file_names, decode=None):
+                calls.append(('load', len(file_names)))
+                return [decode(file_name, self.storage[file_name]) for file_name in file_names]
+
+            def save_many(self, items):
+                calls.append(('save', len(items)))
+                self.storage.update(items)
+
+        ts = make_store(populate=True, row_as_file=True)
+        calls = []
+        b = BatchBackend()
+        b.save_table_store(ts, file_format='json')
+        self.assertEqual(calls, [('save', 9), ('save', 1)])  # Definition and table files, then meta data.
+
+        calls[:] = []
+        ts_check = b.load_table_store()
+        self.assertIn(('load', 6), calls)  # All the row files of 'countries' in one go.
+        self.assertEqual(len(calls), 4)
+        for table_name in ts.tables:
+            self.assertEqual(ts.get_table(table_name)._rows, ts_check.get_table(table_name)._rows)
+
+    def test_parallel_save(self):
+        ts = make_store(populate=True, row_as_file=True)
+        serial = DictBackend()
+        serial.save_table_store(ts, file_format='json')
+
+        # Table files are saved from a thread pool, but the meta data and pickle marker last.
+        b = DictBackend()
+        b.save_workers = 4
+        saved = []
+        save_data = b.save_data
+        b.save_data = lambda file_name, data: saved.append(file_name) or save_data(file_name, data)
+        b.save_table_store(ts, file_format='json')
+        self.assertEqual(b.storage, serial.storage)
+        self.assertEqual(saved[-2:], ['#tsmeta.json', b.pickle_filename])
+
+        # Failures are reported together and the meta data is not saved.
+        def failing_save_data(file_name, data):
+            if file_name.startswith('countries/countries.'):
+                raise RuntimeError("Upload failed.")
+            save_data(file_name, data)
+
+        b.storage.clear()
+        b.save_data = failing_save_data
+        with self.assertRaises(relib.BackendError) as context:
+            b.save_table_store(ts, file_format='json')
+        self.assertIn("Failed to save 6 of", str(context.exception))
+        self.assertIn("countries/countries.is.json", str(context.exception))
+        self.assertNotIn('#tsmeta.json', b.storage)
+
+        # Failures are listed in the order the files were queued, not the order they failed in.
+        second_failed = threading.Event()
+
+        def out_of_order_save_data(file_name, data):
+            if file_name == 'first.json':
+                second_failed.wait()
+            else:
+                second_failed.set()
+            raise RuntimeError("Upload failed.")
+
+        with self.assertRaises(relib.BackendError) as context:
+            with relib._ParallelSave(out_of_order_save_data, workers=2) as save_data:
+                save_data('first.json', b'')
+                save_data('second.json', b'')
+        message = str(context.exception)
+        self.assertLess(message.index('first.json'), message.index('second.json'))
+
+    def test_delta_save(self):
+        ts = make_store(populate=True, row_as_file=True)
+        b = DictBackend()
+        b.save_table_store(ts, file_format='json')
+        base = b.load_table_store(lazy=True)
+
+        # Change one row, remove another and save only the difference.
+        countries = ts.get_table('countries')
+        countries.remove({'country_code': 'jp'})
+        countries.add({'country_code': 'jp', 'name': 'Nippon', 'continent_id': 2})
+        countries.remove({'country_code': 'is'})
+        stats = b.save_table_store(ts, base=base)
+        self.assertEqual(stats['tables_skipped'], 1)  # The continents table.
+        self.assertEqual(stats['files_skipped'], 4)  # Four country files.
+        self.assertEqual(stats['files_deleted'], 1)
+        self.assertNotIn('countries/countries.is.json', b.storage)
+
+        # The result is the same as a full save.
+        full = DictBackend()
+        stats = full.save_table_store(ts, file_format='json')
+        self.assertEqual(stats['files_skipped'], 0)
+        self.assertEqual(b.storage, full.storage)
+        self.assertEqual(b.load_table_store().get_table('countries').get({'country_code': 'jp'})['name'], 'Nippon')
+
+        # A base from a different backend is ignored.
+        other = DictBackend()
+        stats = other.save_table_store(ts, base=base)
+        self.assertEqual(stats['files_skipped'], 0)
+        self.assertEqual(other.storage, full.storage)
+
+        # A save interrupted before the meta data was saved leaves row files that don't match
+        # the base. Those tables are saved in full.
+        countries.get({'country_code': 'jp'})['name'] = 'Japan'
+        countries.get({'country_code': 'vn'})['name'] = 'Viet Nam'
+        interrupted = DictBackend()
+        interrupted.save_table_store(ts, file_format='json')
+        b.storage['countries/countries.jp.json'] = interrupted.storage['countries/countries.jp.json']
+        base = b.load_table_store(lazy=True)
+        countries.get({'country_code': 'vn'})['name'] = 'Vietnam'
+        stats = b.save_table_store(ts, base=base)
+        self.assertEqual(stats['tables_skipped'], 1)
+        self.assertEqual(stats['files_skipped'], 0)
+        self.assertEqual(b.load_table_store().get_table('countries').get({'country_code': 'jp'})['name'], 'Japan')
+        self.assertEqual(b.load_table_store().get_table('countries').get({'country_code': 'vn'})['name'], 'Vietnam')
+
+    def test_reuse_tables(self):
+        local_ts = make_store(populate=True, row_as_file=True)
+        b = DictBackend()
+        b.save_table_store(local_ts, file_format='json')
+
+        # Origin has changed a single table.
+        origin_ts = b.load_table_store()
+        origin_ts.get_table('continents').add({'continent_id': 4, 'name': 'Oceania'})
+        b.save_table_store(origin_ts, file_format='json')
+
+        fetched = []
+        load_data = b.load_data
+        b.load_data = lambda file_name: fetched.append(file_name) or load_data(file_name)
+        ts = b.load_table_store(lazy=True)
+        local_ts.refresh_metadata()
+        self.assertEqual(ts.reuse_tables(local_ts), ['countries'])
+        self.assertIsNotNone(ts._pending_load)
+        ts._load_pending()
+        self.assertFalse([file_name for file_name in fetched if file_name.startswith('countries')])
+        self.assertEqual(ts.get_table('continents').get({'continent_id': 4})['name'], 'Oceania')
+        old, new = ts.refresh_metadata()
+        self.assertEqual(old, new)
+
+        # The reused table is a copy.
+        ts.get_table('countries').remove({'country_code': 'is'})
+        self.assertTrue(local_ts.get_table('countries').get({'country_code': 'is'}))
+
+        # The sequences are taken from the meta data of the table store being loaded, as they
+        # may have advanced without changing the rows.
+        identity = local_ts.add_table('identity')
+        identity.add_primary_key('id')
+        identity.add_default_values({'id': '@@identity'})
+        identity.add({})
+        b.save_table_store(local_ts, file_format='json')
+        origin_ts = b.load_table_store()
+        origin_ts.get_table('identity').remove(origin_ts.get_table('identity').add({}))
+        b.save_table_store(origin_ts, file_format='json')
+        ts = b.load_table_store(lazy=True)
+        local_ts.refresh_metadata()
+        self.assertIn('identity', ts.reuse_tables(local_ts))
+        self.assertEqual(3, ts.get_table('identity').add({})['id'])
+
     def test_serialization_for_group_by(self):
         # Test row groups per file as well for multiple primary key fields
 
@@ -20,6 +20,9 @@ config_source_cache = TTLCache(maxsize=10, ttl=3.0)
 cache_hits = 0
 cache_misses =0
 
+# Tables used by get_drift_config(), in addition to the ones they refer to.
+DRIFT_CONFIG_TABLES = ['domain', 'tiers', 'deployables', 'tenant-names', 'tenants']
+
 
 def set_cache_ttl(ttl):
     """Set a different timeout for config source cache."""
@@ -95,7 +98,7 @@ def set_sticky_config(ts):
     _sticky_ts = ts
 
 
-def get_default_drift_config():
+def get_default_drift_config(tables=None, fetch_rows=False, lazy=False):
     """
     Return Drift config as a table store.
     If 'DRIFT_CONFIG_URL' is found in environment variables, it is used to load the
@@ -105,12 +108,17 @@ def get_default_drift_config():
 
     If a table store object was set using set_sticky_config(), then that object will
     always be returned.
+
+    If 'tables' is a list of table names, a table store loaded using 'DRIFT_CONFIG_URL'
+    contains only those tables and the tables they refer to. If 'fetch_rows' is True, the
+    rows of tables serialized one file per row or row group are fetched on demand. If 'lazy'
+    is True, each table is fetched when first accessed. See relib.Backend.load_table_store().
     """
-    ts, source = get_default_drift_config_and_source()
+    ts, source = get_default_drift_config_and_source(tables=tables, fetch_rows=fetch_rows, lazy=lazy)
     return ts
 
 
-def get_default_drift_config_and_source():
+def get_default_drift_config_and_source(tables=None, fetch_rows=False, lazy=False):
     """
     Same as get_default_drift_config but returns a tuple of table store and the
     source of where it was loaded from.
@@ -123,7 +131,10 @@ def get_default_drift_config_and_source():
 
     url = os.environ.get('DRIFT_CONFIG_URL')
     if url:
-        ts = config_source_cache.get(url)
+        cache_key = url
+        if tables is not None or fetch_rows or lazy:
+            cache_key = (url, tuple(sorted(tables)) if tables is not None else None, fetch_rows, lazy)
+        ts = config_source_cache.get(cache_key)
         if ts:
             cache_hits += 1
             return ts, url
@@ -139,10 +150,10 @@ def get_default_drift_config_and_source():
                     url, ", ".join(domains.keys())))
 
         b = create_backend(url)
-        ts = b.load_table_store()
+        ts = b.load_table_store(lazy=lazy, tables=tables, fetch_rows=fetch_rows)
         if b.is_cache:
             cache_misses += 1
-            config_source_cache[url] = ts
+            config_source_cache[cache_key] = ts
         return ts, url
     else:
         domains = get_domains()
@@ -188,7 +199,9 @@ def get_drift_config(
     tier_name=None,
     deployable_name=None,
     drift_app=None,
-    allow_missing_tenant=False
+    allow_missing_tenant=False,
+    tables=None,
+    fetch_rows=False,
 ):
     """
     Return config tuple for given config context, containing the following properties:
@@ -200,11 +213,19 @@ def get_drift_config(
     If 'tenant_name' is specified but not found in config a TenantNotConfigured exception
     is raised. If 'allow_missing_tenant' is True however, then the config tuple will be
     returned but with the 'tenant' property set to None.
+
+    If 'tables' is a list of table names, the default config is loaded with only those
+    tables and the ones in DRIFT_CONFIG_TABLES. If 'fetch_rows' is True, the rows of the
+    tenants table are fetched on demand, which are the row files of 'tenant_name' and the
+    other tenants on 'tier_name'. The rest of the tables used here are stored in a single
+    file each, and are loaded in full. See get_default_drift_config().
     """
     if ts:
         source = "internal"
     else:
-        ts, source = get_default_drift_config_and_source()
+        if tables is not None:
+            tables = sorted(set(tables) | set(DRIFT_CONFIG_TABLES))
+        ts, source = get_default_drift_config_and_source(tables=tables, fetch_rows=fetch_rows)
 
     # Map tenant alias to actual tenant name if needed.
     tenant_name_row = ts.get_table('tenant-names').find({'alias': tenant_name})
@@ -317,99 +338,101 @@ def define_tenant(ts, tenant_name, product_name, tier_name):
     list of [deployable_name, state] tuples indicating state of each deployable for this
     tenant after the creation/update command.
     """
-    prep = prepare_tenant_name(ts=ts, tenant_name=tenant_name, product_name=product_name)
-    tenant_name = prep['tenant_name']
-    product = prep['product']
-    organization = prep['organization']
-
-    # Add a record to 'tenant-names' if needed.
-    tenant_names = ts.get_table('tenant-names')
-    tenant_master_row = tenant_names.get({'tenant_name': tenant_name})
-    if not tenant_master_row:
-        tenant_master_row = tenant_names.add({
-            'tenant_name': tenant_name,
-            'organization_name': organization['organization_name'],
-            'product_name': product_name,
-            'tier_name': tier_name,
-            'reserved_by': getpass.getuser(),
-            'reserved_at': datetime.utcnow().isoformat() + 'Z',
-        })
-
-    prep['tenant_master_row'] = tenant_master_row
-
-    # Make a list of active and inactive deployables associated with the given product.
-    active_deployables = []
-    inactive_deployables = []
-    deployables = ts.get_table('deployables')
-    for deployable_name in product['deployables']:
-        deployable = deployables.get({'tier_name': tier_name, 'deployable_name': deployable_name})
-        if deployable:
-            if deployable['is_active']:
-                active_deployables.append(deployable_name)
+    # Rows are modified in-place so hold the write lock if 'ts' has locking enabled.
+    with ts.write_locked():
+        prep = prepare_tenant_name(ts=ts, tenant_name=tenant_name, product_name=product_name)
+        tenant_name = prep['tenant_name']
+        product = prep['product']
+        organization = prep['organization']
+
+        # Add a record to 'tenant-names' if needed.
+        tenant_names = ts.get_table('tenant-names')
+        tenant_master_row = tenant_names.get({'tenant_name': tenant_name})
+        if not tenant_master_row:
+            tenant_master_row = tenant_names.add({
+                'tenant_name': tenant_name,
+                'organization_name': organization['organization_name'],
+                'product_name': product_name,
+                'tier_name': tier_name,
+                'reserved_by': getpass.getuser(),
+                'reserved_at': datetime.utcnow().isoformat() + 'Z',
+            })
+
+        prep['tenant_master_row'] = tenant_master_row
+
+        # Make a list of active and inactive deployables associated with the given product.
+        active_deployables = []
+        inactive_deployables = []
+        deployables = ts.get_table('deployables')
+        for deployable_name in product['deployables']:
+            deployable = deployables.get({'tier_name': tier_name, 'deployable_name': deployable_name})
+            if deployable:
+                if deployable['is_active']:
+                    active_deployables.append(deployable_name)
+                else:
+                    inactive_deployables.append(deployable_name)
             else:
-                inactive_deployables.append(deployable_name)
-        else:
-            raise RuntimeError(
-                "Deployable '{}' defined for product '{}' is not found in table 'deployables' for tier {}.".format(
-                    deployable_name, product_name, tier_name)
-            )
-
-    tenants = ts.get_table('tenants')
-    report = []  # List of deployable names and current state.
-
-    def add_report(deployable_name, state):
-        report_row = {'deployable_name': deployable_name, 'state': state}
-        report.append(report_row)
-        return report_row
-
-    # Deactivate/delete deployables if needed
-    for tenant in tenants.find({'tier_name': tier_name, 'tenant_name': tenant_name}):
-        deployable_name = tenant['deployable_name']
-        if deployable_name in inactive_deployables:
-            tenant['state'] = 'disabled'
-            add_report(deployable_name, 'disabled')
-        elif deployable_name not in active_deployables and tenant['state'] != 'deleted':
-            tenant['state'] = 'uninitializing'  # Signal de-provision of resources.
-            add_report(deployable_name, 'uninitializing')
-
-    # Activate/associate deployables if needed
-    for deployable_name in active_deployables:
-        pk = {
-            'tier_name': tier_name,
-            'deployable_name': deployable_name,
-            'tenant_name': tenant_name
-        }
-        tenant = tenants.get(pk)
-        if tenant:
-            report_row = add_report(deployable_name, tenant['state'])
-        else:
-            # State is set to 'initializing' by default signaling provisioning of resources.
-            tenant = tenants.add(pk)
-            report_row = add_report(deployable_name, 'initializing')
+                raise RuntimeError(
+                    "Deployable '{}' defined for product '{}' is not found in table 'deployables' for tier {}.".format(
+                        deployable_name, product_name, tier_name)
+                )
+
+        tenants = ts.get_table('tenants')
+        report = []  # List of deployable names and current state.
+
+        def add_report(deployable_name, state):
+            report_row = {'deployable_name': deployable_name, 'state': state}
+            report.append(report_row)
+            return report_row
+
+        # Deactivate/delete deployables if needed
+        for tenant in tenants.find({'tier_name': tier_name, 'tenant_name': tenant_name}):
+            deployable_name = tenant['deployable_name']
+            if deployable_name in inactive_deployables:
+                tenant['state'] = 'disabled'
+                add_report(deployable_name, 'disabled')
+            elif deployable_name not in active_deployables and tenant['state'] != 'deleted':
+                tenant['state'] = 'uninitializing'  # Signal de-provision of resources.
+                add_report(deployable_name, 'uninitializing')
+
+        # Activate/associate deployables if needed
+        for deployable_name in active_deployables:
+            pk = {
+                'tier_name': tier_name,
+                'deployable_name': deployable_name,
+                'tenant_name': tenant_name
+            }
+            tenant = tenants.get(pk)
+            if tenant:
+                report_row = add_report(deployable_name, tenant['state'])
+            else:
+                # State is set to 'initializing' by default signaling provisioning of resources.
+                tenant = tenants.add(pk)
+                report_row = add_report(deployable_name, 'initializing')
 
-        # Initialize/update tenant resource config using default tier or deployables values.
-        depl_names = ts.get_table('deployable-names').get({'deployable_name': deployable_name})
-        tier = ts.get_table('tiers').get({'tier_name': tier_name})
-        for resource_name in depl_names['resources']:
-            # LEGACY SUPPORT: Shorten resource name to its last bit
-            legacy_resource_name = resource_name.rsplit('.', 1)[1]
+            # Initialize/update tenant resource config using default tier or deployables values.
+            depl_names = ts.get_table('deployable-names').get({'deployable_name': deployable_name})
+            tier = ts.get_table('tiers').get({'tier_name': tier_name})
+            for resource_name in depl_names['resources']:
+                # LEGACY SUPPORT: Shorten resource name to its last bit
+                legacy_resource_name = resource_name.rsplit('.', 1)[1]
 
-            # Update the tenants attributes but leave current ones intact
-            resource_attribs = tenant.setdefault(legacy_resource_name, {})
+                # Update the tenants attributes but leave current ones intact
+                resource_attribs = tenant.setdefault(legacy_resource_name, {})
 
-            # Apply tier defaults
-            for k, v in tier['resources'][resource_name].items():
-                resource_attribs.setdefault(k, v)
+                # Apply tier defaults
+                for k, v in tier['resources'][resource_name].items():
+                    resource_attribs.setdefault(k, v)
 
-            # Apply deployable defaults
-            deployable_defaults = depl_names['resource_attributes'].get(resource_name, {})
-            for k, v in deployable_defaults.items():
-                resource_attribs.setdefault(k, v)
+                # Apply deployable defaults
+                deployable_defaults = depl_names['resource_attributes'].get(resource_name, {})
+                for k, v in deployable_defaults.items():
+                    resource_attribs.setdefault(k, v)
 
-            report_row.setdefault('resources', {})[resource_name] = resource_attribs
+                report_row.setdefault('resources', {})[resource_name] = resource_attribs
 
-    prep['report'] = report
-    return prep
+        prep['report'] = report
+        return prep
 
 
 def provision_tenant_resources(ts, tenant_name, deployable_name=None, preview=False):
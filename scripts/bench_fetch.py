@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for loading and saving tables stored one file per row on a slow backend.
+
+Saves and loads a table store with a row-per-file table using an in-memory backend that adds
+a fixed latency to each file, and reports the times for a number of fetch and save workers.
+With --batched, the backend loads and saves many files at the cost of a single file, like
+Redis does using MGET and pipelining.
+
+Usage: python scripts/bench_fetch.py [--rows N] [--latency MS] [--workers 1,4,10,32] [--batched]
+"""
+import argparse
+import time
+
+from driftconfig.relib import TableStore, DictBackend
+
+
+class SlowBackend(DictBackend):
+    latency = 0.0
+
+    def load_data(self, k):
+        time.sleep(self.latency)
+        return super(SlowBackend, self).load_data(k)
+
+    def save_data(self, k, data):
+        time.sleep(self.latency)
+        return super(SlowBackend, self).save_data(k, data)
+
+
+class BatchedBackend(SlowBackend):
+
+    def load_many(self, file_names, decode=None):
+        time.sleep(self.latency)
+        values = [DictBackend.load_data(self, k) for k in file_names]
+        if decode is not None:
+            values = [decode(k, data) for k, data in zip(file_names, values)]
+        return values
+
+    def save_many(self, items):
+        time.sleep(self.latency)
+        for k, data in items:
+            DictBackend.save_data(self, k, data)
+
+
+def make_store(num_rows):
+    ts = TableStore()
+    items = ts.add_table('items')
+    items.add_primary_key('item_id')
+    items.set_row_as_file(subfolder_name='items')
+    for i in range(num_rows):
+        items.add({'item_id': i, 'name': 'item-{}'.format(i), 'tags': ['a', 'b', 'c']})
+    return ts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel row file fetch and save benchmark.")
+    parser.add_argument('--rows', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=20.0, help="Latency per fetch in ms.")
+    parser.add_argument('--workers', default='1,4,10,32')
+    parser.add_argument('--batched', action='store_true', help="Load and save many files per request.")
+    args = parser.parse_args()
+
+    ts = make_store(args.rows)
+    b = BatchedBackend() if args.batched else SlowBackend()
+    b.latency = args.latency / 1000.0
+    print("{:>8} {:>12} {:>12}".format("workers", "save", "load"))
+    for workers in [int(n) for n in args.workers.split(',')]:
+        b.fetch_workers = b.save_workers = workers
+        start = time.time()
+        b.save_table_store(ts, file_format='json')
+        save_time = time.time() - start
+        start = time.time()
+        b.load_table_store()
+        load_time = time.time() - start
+        print("{:>8} {:>9.0f} ms {:>9.0f} ms".format(workers, save_time * 1000.0, load_time * 1000.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for Table.get().
+
+Looks up rows by primary key in tables keyed by a number, a string and two fields, and
+reports the time per call. The tables have a unique constraint and their checksums have been
+calculated, so the bookkeeping for rows handed out is included.
+
+Usage: python scripts/bench_get.py [--rows N] [--gets N] [--repeat N]
+"""
+import argparse
+import time
+
+from driftconfig.relib import TableStore
+
+
+def make_store(num_rows):
+    ts = TableStore()
+    numbers = ts.add_table('numbers')
+    numbers.add_primary_key('item_id')
+    numbers.add_unique_constraint('name')
+    names = ts.add_table('names')
+    names.add_primary_key('name')
+    names.add_unique_constraint('item_id')
+    pairs = ts.add_table('pairs')
+    pairs.add_primary_key('group_name,name')
+    pairs.add_unique_constraint('item_id')
+
+    for i in range(num_rows):
+        numbers.add({'item_id': i, 'name': 'item-{}'.format(i)})
+        names.add({'item_id': i, 'name': 'item-{}'.format(i)})
+        pairs.add({'item_id': i, 'group_name': 'group-{}'.format(i % 100), 'name': 'item-{}'.format(i)})
+    ts.refresh_metadata()
+    return ts
+
+
+def timed(table, keys, repeat):
+    """Return the best time per get() of 'keys' in 'table' out of 'repeat' runs, in microseconds."""
+    get = table.get
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        for key in keys:
+            get(key)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / len(keys) * 1000000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Table get() benchmark.")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--gets', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5, help="Best of N runs.")
+    args = parser.parse_args()
+
+    ts = make_store(args.rows)
+    indexes = [i % args.rows for i in range(args.gets)]
+    lookups = [
+        ('number', 'numbers', [{'item_id': i} for i in indexes]),
+        ('string', 'names', [{'name': 'item-{}'.format(i)} for i in indexes]),
+        ('two fields', 'pairs', [{'group_name': 'group-{}'.format(i % 100), 'name': 'item-{}'.format(i)} for i in indexes]),
+    ]
+    print("{:>12} {:>12}".format("key", "get"))
+    for label, table_name, keys in lookups:
+        print("{:>12} {:>9.2f} us".format(label, timed(ts.get_table(table_name), keys, args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Stress benchmark for TableStore locking.
+
+Runs a mix of get() and find() calls from a number of threads against a populated table
+store, and reports the read throughput for each thread count. The reads are either
+serialized using a global mutex, which is how multi-threaded servers had to guard the
+config before, or run using the reader-writer lock of the table store.
+
+Usage: python scripts/bench_locking.py [--rows N] [--reads N] [--threads 1,2,4,8] [--writer]
+"""
+import argparse
+import threading
+import time
+
+from driftconfig.relib import TableStore
+
+
+def make_store(num_rows):
+    ts = TableStore()
+    groups = ts.add_table('groups')
+    groups.add_primary_key('group_id')
+    items = ts.add_table('items')
+    items.add_primary_key('item_id')
+    items.add_foreign_key('group_id', 'groups')
+
+    for i in range(100):
+        groups.add({'group_id': i})
+    for i in range(num_rows):
+        items.add({'item_id': i, 'group_id': i % 100, 'name': 'item-{}'.format(i)})
+    return ts
+
+
+def run(ts, num_threads, num_reads, mutex=None, writer=False):
+    items = ts.get_table('items')
+    num_rows = len(items._rows)
+    stop = threading.Event()
+
+    def read():
+        for i in range(num_reads):
+            if mutex:
+                with mutex:
+                    items.get({'item_id': i % num_rows})
+                    items.find({'group_id': i % 100})
+            else:
+                items.get({'item_id': i % num_rows})
+                items.find({'group_id': i % 100})
+
+    def write():
+        i = num_rows
+        while not stop.is_set():
+            row = {'item_id': i, 'group_id': i % 100}
+            if mutex:
+                with mutex:
+                    items.add(row)
+                    items.remove(row)
+            else:
+                items.add(row)
+                items.remove(row)
+            i += 1
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=read) for i in range(num_threads)]
+    writer_thread = threading.Thread(target=write) if writer else None
+    if writer_thread:
+        writer_thread.start()
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+    stop.set()
+    if writer_thread:
+        writer_thread.join()
+
+    return num_threads * num_reads * 2 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TableStore locking benchmark.")
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--reads', type=int, default=20000, help="Reads per thread.")
+    parser.add_argument('--threads', default='1,2,4,8')
+    parser.add_argument('--writer', action='store_true', help="Run a concurrent writer thread.")
+    args = parser.parse_args()
+
+    ts = make_store(args.rows)
+    print("{:>8} {:>16} {:>16}".format("threads", "global mutex", "rw lock"))
+    for num_threads in [int(n) for n in args.threads.split(',')]:
+        ts.set_locking(False)
+        with_mutex = run(ts, num_threads, args.reads, mutex=threading.Lock(), writer=args.writer)
+        ts.set_locking(True)
+        with_rwlock = run(ts, num_threads, args.reads, writer=args.writer)
+        print("{:>8} {:>12.0f} op/s {:>12.0f} op/s".format(num_threads, with_mutex, with_rwlock))
+
+
+if __name__ == '__main__':
+    main()